@@ -1,8 +1,13 @@
 from flask import Flask
+from .uploads import MAX_UPLOAD_BYTES, SpooledRequest
 
 def create_app():
     app = Flask(__name__, template_folder="../templates")
+    # Large uploads are spooled to disk; bodies over MAX_UPLOAD_BYTES are rejected with 413
+    app.request_class = SpooledRequest
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
     with app.app_context():
-        from . import routes
+        from . import api, routes
         app.register_blueprint(routes.bp)
+        app.register_blueprint(api.bp)
     return app
\ No newline at end of file
@@ -0,0 +1,233 @@
+"""
+Versioned JSON API for upstream systems, without any HTML rendering.
+
+Every POST takes the PDF either as a multipart upload (field pdf_file or pdf)
+or as the raw request body with Content-Type: application/pdf. Options come
+from form fields or the query string. Errors are always {"error": ...}.
+"""
+import logging
+from io import BytesIO
+
+from flask import Blueprint, jsonify, request, send_file, url_for
+from werkzeug.exceptions import HTTPException
+
+from .artifacts import artifact_store
+from .data_extraction import WrongDocumentError, extract_certificate_data, extract_data_from_pdf
+from .processing import TEMPLATE_DIRS, generate_artifact, get_download_name, template_registry
+from .uploads import body_source, upload_source
+
+API_VERSION = 'v1'
+
+bp = Blueprint('api', __name__, url_prefix=f'/api/{API_VERSION}')
+
+# Multipart fields a PDF may be uploaded under
+PDF_FIELDS = ('pdf_file', 'pdf')
+# Raw body content types read as a PDF
+PDF_MIMETYPES = ('application/pdf', 'application/octet-stream')
+# Keys of an extraction result that are not fields of the document
+_META_FIELDS = ('extraction_tier', 'Extraction_Tier')
+
+JSON_MIMETYPE = 'application/json'
+ARTIFACT_MIMETYPES = {
+    'excel': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'pdf': 'application/pdf',
+}
+ARTIFACT_EXTENSIONS = {'excel': 'xlsx', 'pdf': 'pdf'}
+
+
+class ApiError(Exception):
+    """An error answered as {"error": message} with its HTTP status"""
+
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+
+@bp.errorhandler(ApiError)
+def _api_error(e):
+    return jsonify({"error": str(e), **e.extra}), e.status
+
+
+@bp.app_errorhandler(HTTPException)
+def _http_error(e):
+    # Registered on the app so unknown /api/ URLs are answered in JSON too
+    if e.code is None or e.code < 400 or not request.path.startswith(bp.url_prefix + '/'):
+        return e
+    return jsonify({"error": e.description}), e.code
+
+
+@bp.errorhandler(Exception)
+def _unexpected_error(e):
+    # Flask prefers this handler over the app-wide one even for HTTP errors raised in API views
+    if isinstance(e, HTTPException):
+        return _http_error(e)
+    logging.exception(f"Error handling {request.method} {request.path}")
+    return jsonify({"error": "Internal server error"}), 500
+
+
+def _negotiate(offered):
+    """The offered mimetype the Accept header prefers (the first when there is none)"""
+    if not request.accept_mimetypes:
+        return offered[0]
+    mimetype = request.accept_mimetypes.best_match(offered)
+    if mimetype is None:
+        raise ApiError("Not acceptable", 406, available=list(offered))
+    return mimetype
+
+
+def _pdf_source():
+    """The request's PDF as bytes or a spooled file, from a multipart field or the raw body"""
+    if request.mimetype == 'multipart/form-data':
+        for field in PDF_FIELDS:
+            upload = request.files.get(field)
+            if upload and upload.filename:
+                source = upload_source(upload)
+                break
+        else:
+            raise ApiError(f"No PDF file in the {' or '.join(PDF_FIELDS)} field")
+    elif request.mimetype in PDF_MIMETYPES:
+        source = body_source(request)
+    else:
+        raise ApiError(f"Send multipart/form-data or {PDF_MIMETYPES[0]}", 415)
+
+    if hasattr(source, 'read'):
+        head = source.read(1024)
+        source.seek(0)
+    else:
+        head = source[:1024]
+    if b'%PDF-' not in head:
+        raise ApiError("The body is not a PDF")
+    return source
+
+
+def _require_fields(data):
+    """data, unless nothing but metadata could be extracted (an unreadable or foreign PDF)"""
+    if not any(key not in _META_FIELDS for key in data):
+        raise ApiError("No fields could be extracted from the PDF", 422)
+    return data
+
+
+def _pdf_type(pdf_type):
+    if pdf_type not in TEMPLATE_DIRS:
+        raise ApiError(f"Unknown PDF type {pdf_type}", 404, available=sorted(TEMPLATE_DIRS))
+    return pdf_type
+
+
+def _int_option(name, default):
+    value = request.values.get(name, '').strip()
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ApiError(f"{name} must be an integer")
+
+
+def _artifact_handle(token, artifact):
+    """JSON description of a stored artifact with the URLs of its files"""
+    return {
+        "token": token,
+        "pdf_type": artifact['pdf_type'],
+        "expires_at": artifact['created'] + artifact_store.ttl,
+        "url": url_for('api.artifact', token=token, _external=True),
+        "files": {
+            kind: url_for('api.artifact_file', token=token, kind=kind, _external=True)
+            for kind in artifact_store.kinds(token)
+        },
+    }
+
+
+def _send_artifact(token, kind, artifact):
+    download_name = get_download_name(artifact['data'], artifact['pdf_type'], ARTIFACT_EXTENSIONS[kind])
+    # Served from disk when possible, as the download routes do
+    path = artifact_store.get_path(token, kind)
+    if path is not None:
+        return send_file(path, as_attachment=True, download_name=download_name, mimetype=ARTIFACT_MIMETYPES[kind])
+    content = artifact_store.get_file(token, kind)
+    if content is None:
+        raise ApiError(f"No {kind} available", 404)
+    return send_file(BytesIO(content), as_attachment=True, download_name=download_name,
+                     mimetype=ARTIFACT_MIMETYPES[kind])
+
+
+@bp.route('/templates')
+def templates():
+    """Template filenames per PDF type"""
+    _negotiate([JSON_MIMETYPE])
+    return jsonify({"templates": template_registry.listing()})
+
+
+@bp.route('/extract/<pdf_type>', methods=['POST'])
+def extract(pdf_type):
+    """Extract the fields of a proforma PDF"""
+    pdf_type = _pdf_type(pdf_type)
+    _negotiate([JSON_MIMETYPE])
+    data = _require_fields(extract_data_from_pdf(_pdf_source(), pdf_type))
+    return jsonify({"pdf_type": pdf_type, "data": data})
+
+
+@bp.route('/process/<pdf_type>', methods=['POST'])
+def process(pdf_type):
+    """
+    Extract a proforma PDF and fill template_file with it. Answers with the
+    data and an artifact handle as JSON, or with the Excel or PDF file itself
+    when the Accept header asks for that mimetype.
+    """
+    pdf_type = _pdf_type(pdf_type)
+    mimetype = _negotiate([JSON_MIMETYPE, ARTIFACT_MIMETYPES['excel'], ARTIFACT_MIMETYPES['pdf']])
+    template_file = request.values.get('template_file', '').strip()
+    if template_file not in template_registry.templates(pdf_type):
+        raise ApiError("template_file is missing or unknown", available=template_registry.templates(pdf_type))
+    freight_number = _int_option('freight_number', None)
+    container_type = request.values.get('container_type', '') if pdf_type == 'maritime' else ''
+    num_containers = _int_option('num_containers', 1) if pdf_type == 'maritime' else 1
+    pdf_content = _pdf_source()
+
+    data = _require_fields(extract_data_from_pdf(pdf_content, pdf_type))
+    token = generate_artifact(data, pdf_type, template_file, freight_number, container_type, num_containers)
+    if token is None:
+        raise ApiError("Excel generation failed", 500, data=data)
+    artifact = artifact_store.get(token)
+
+    if mimetype != JSON_MIMETYPE:
+        kind = 'excel' if mimetype == ARTIFACT_MIMETYPES['excel'] else 'pdf'
+        if kind not in artifact_store.kinds(token):
+            raise ApiError(f"No {kind} was generated", 406, artifact=_artifact_handle(token, artifact))
+        return _send_artifact(token, kind, artifact)
+    return jsonify({
+        "pdf_type": pdf_type,
+        "template_file": template_file,
+        "data": data,
+        "artifact": _artifact_handle(token, artifact),
+    }), 201
+
+
+@bp.route('/artifacts/<token>')
+def artifact(token):
+    _negotiate([JSON_MIMETYPE])
+    stored = artifact_store.get(token)
+    if stored is None:
+        raise ApiError("Unknown or expired artifact", 404)
+    return jsonify({**_artifact_handle(token, stored), "data": stored['data']})
+
+
+@bp.route('/artifacts/<token>/<kind>')
+def artifact_file(token, kind):
+    if kind not in ARTIFACT_MIMETYPES:
+        raise ApiError(f"Unknown artifact kind {kind}", 404, available=list(ARTIFACT_MIMETYPES))
+    stored = artifact_store.get(token)
+    if stored is None:
+        raise ApiError("Unknown or expired artifact", 404)
+    return _send_artifact(token, kind, stored)
+
+
+@bp.route('/certificates', methods=['POST'])
+def certificates():
+    """Extract a flagging certificate (AD or Normal)"""
+    _negotiate([JSON_MIMETYPE])
+    try:
+        data = _require_fields(extract_certificate_data(_pdf_source()))
+    except WrongDocumentError as e:
+        raise ApiError(str(e), 422)
+    return jsonify({"data": data})
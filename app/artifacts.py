@@ -0,0 +1,220 @@
+import json
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+def _default_artifact_dir():
+    # /dev/shm is memory-backed on Linux and visible to every worker process
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'proforma_artifacts')
+
+# Seconds generated files stay downloadable
+ARTIFACT_TTL = float(os.environ.get('ARTIFACT_TTL', 3600))
+# Byte budget of the in-process memory tier
+ARTIFACT_MEMORY_BYTES = int(os.environ.get('ARTIFACT_MEMORY_BYTES', 64 * 1024 * 1024))
+# Shared directory tier so any worker can serve any download; disabled when empty
+ARTIFACT_DIR = os.environ.get('ARTIFACT_DIR', _default_artifact_dir())
+# Byte budget of the directory tier
+ARTIFACT_DISK_BYTES = int(os.environ.get('ARTIFACT_DISK_BYTES', 512 * 1024 * 1024))
+
+ARTIFACT_FILES = {'excel': 'output.xlsx', 'pdf': 'output.pdf'}
+
+_TOKEN = re.compile(r'[A-Za-z0-9_\-]{16,64}')
+
+
+class ArtifactStore:
+    """
+    Generated Excel/PDF files keyed by a random token.
+
+    Recent artifacts are kept in memory (LRU within a byte budget) and, when a
+    directory is configured, written to it so another worker process can serve
+    the download. Both tiers expire entries after the TTL.
+    """
+
+    def __init__(self, directory=ARTIFACT_DIR, ttl=ARTIFACT_TTL,
+                 memory_bytes=ARTIFACT_MEMORY_BYTES, disk_bytes=ARTIFACT_DISK_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def put(self, data, pdf_type, excel=None, pdf=None):
+        """Store the outputs of one request and return its token"""
+        token = secrets.token_urlsafe(16)
+        entry = {
+            'meta': {'data': data, 'pdf_type': pdf_type, 'created': time.time()},
+            'files': {'excel': excel, 'pdf': pdf},
+        }
+        entry['size'] = sum(len(content) for content in entry['files'].values() if content)
+        with self._lock:
+            self.entries[token] = entry
+            self.size += entry['size']
+            self._evict_memory()
+        if self.directory:
+            self._write_disk(token, entry)
+            self._sweep_disk()
+        return token
+
+    def _evict_memory(self):
+        cutoff = time.time() - self.ttl
+        while self.entries:
+            token, entry = next(iter(self.entries.items()))
+            if self.size <= self.memory_bytes and entry['meta']['created'] >= cutoff:
+                break
+            self.entries.popitem(last=False)
+            self.size -= entry['size']
+
+    def staging_dir(self):
+        """
+        Create a private directory inside the directory tier for writing
+        outputs that put_files() will then publish. None without a directory tier.
+        """
+        if not self.directory:
+            return None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            return tempfile.mkdtemp(dir=self.directory, prefix='.staging_')
+        except OSError as e:
+            print(f"Error creating artifact staging directory: {str(e)}")
+            return None
+
+    def _publish(self, staging, token, meta):
+        with open(os.path.join(staging, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.rename(staging, os.path.join(self.directory, token))
+
+    def _write_disk(self, token, entry):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            staging = tempfile.mkdtemp(dir=self.directory, prefix='.staging_')
+            for kind, content in entry['files'].items():
+                if content is not None:
+                    with open(os.path.join(staging, ARTIFACT_FILES[kind]), 'wb') as f:
+                        f.write(content)
+            self._publish(staging, token, entry['meta'])
+        except OSError as e:
+            print(f"Error writing artifact {token}: {str(e)}")
+
+    def put_files(self, staging, data, pdf_type, excel_path=None, pdf_path=None):
+        """
+        Publish outputs already written inside staging (from staging_dir()) by
+        renaming them in place, without reading them into memory. Returns the token.
+        """
+        token = secrets.token_urlsafe(16)
+        for kind, path in (('excel', excel_path), ('pdf', pdf_path)):
+            if path is not None:
+                os.replace(path, os.path.join(staging, ARTIFACT_FILES[kind]))
+        keep = set(ARTIFACT_FILES.values())
+        for name in os.listdir(staging):
+            if name not in keep:
+                os.remove(os.path.join(staging, name))
+        self._publish(staging, token, {'data': data, 'pdf_type': pdf_type, 'created': time.time()})
+        self._sweep_disk()
+        return token
+
+    def _sweep_disk(self):
+        """Drop expired artifacts, then the oldest ones while over the byte budget"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < 60:
+                return
+            self._last_sweep = now
+        try:
+            entries = []
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                try:
+                    mtime = os.path.getmtime(path)
+                    size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                except OSError:
+                    continue
+                # Outputs still being generated are left alone unless abandoned
+                if name.startswith('.staging_') and mtime >= now - self.ttl:
+                    continue
+                entries.append((mtime, size, path))
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, path in entries:
+                if mtime >= now - self.ttl and total <= self.disk_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+        except OSError as e:
+            print(f"Error sweeping artifacts: {str(e)}")
+
+    def _disk_path(self, token):
+        if not self.directory or not _TOKEN.fullmatch(token or ''):
+            return None
+        path = os.path.join(self.directory, token)
+        if not os.path.isdir(path) or os.path.getmtime(path) < time.time() - self.ttl:
+            return None
+        return path
+
+    def get(self, token):
+        """Return {'data', 'pdf_type', 'created'} for a token, or None"""
+        if not token:
+            return None
+        with self._lock:
+            entry = self.entries.get(token)
+            if entry is not None and entry['meta']['created'] >= time.time() - self.ttl:
+                self.entries.move_to_end(token)
+                return dict(entry['meta'])
+        path = self._disk_path(token)
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get_path(self, token, kind):
+        """Path of one artifact in the directory tier, for serving straight from disk, or None"""
+        if kind not in ARTIFACT_FILES:
+            return None
+        path = self._disk_path(token)
+        if path is None:
+            return None
+        path = os.path.join(path, ARTIFACT_FILES[kind])
+        return path if os.path.isfile(path) else None
+
+    def kinds(self, token):
+        """The kinds of artifact ('excel', 'pdf') stored under a token"""
+        if not token:
+            return []
+        with self._lock:
+            entry = self.entries.get(token)
+            if entry is not None and entry['meta']['created'] >= time.time() - self.ttl:
+                return [kind for kind, content in entry['files'].items() if content is not None]
+        return [kind for kind in ARTIFACT_FILES if self.get_path(token, kind) is not None]
+
+    def get_file(self, token, kind):
+        """Return the bytes of one artifact ('excel' or 'pdf'), or None"""
+        if not token or kind not in ARTIFACT_FILES:
+            return None
+        with self._lock:
+            entry = self.entries.get(token)
+            if entry is not None and entry['meta']['created'] >= time.time() - self.ttl:
+                return entry['files'][kind]
+        path = self._disk_path(token)
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, ARTIFACT_FILES[kind]), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+
+# Shared store used by the download routes
+artifact_store = ArtifactStore()
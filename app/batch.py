@@ -0,0 +1,564 @@
+"""
+Batch processing of many PDFs in a process pool, for POST /process_batch and
+for folders of PDFs on the command line:
+
+    python -m app.batch <directory> [--pdf-type TYPE] [--template [TYPE=]NAME] [--workers N]
+
+Run it from the project root so the template directories resolve. Outputs and
+a manifest.jsonl are written to --output (default <directory>/batch_output);
+running the same command again skips the files the manifest already lists as
+done.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from .data_extraction import extract_data_from_pdf, first_page_text
+from .processing import TEMPLATE_DIRS, get_download_name, process_excel_and_pdf, template_registry
+
+# Worker processes used for batch jobs
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+# Maximum number of PDFs accepted in one batch
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 500))
+# Maximum total size of the PDFs in one batch once unzipped
+BATCH_MAX_BYTES = int(os.environ.get('BATCH_MAX_BYTES', 512 * 1024 * 1024))
+
+# Manifest of a command-line run, in its output directory
+MANIFEST_NAME = 'manifest.jsonl'
+
+# Folder names that give the pdf_type of the PDFs below them: the types and their template directories
+PDF_TYPE_FOLDERS = {name.lower(): name for name in TEMPLATE_DIRS}
+PDF_TYPE_FOLDERS.update({os.path.basename(path).lower(): name for name, path in TEMPLATE_DIRS.items()})
+
+# First-page markers per pdf_type, tried in order when no folder gives the type
+PDF_TYPE_MARKERS = [
+    ('busia', re.compile(r'\bBUSIA\b', re.IGNORECASE)),
+    ('possiano', re.compile(r'\bPO[NS]SIANO\b', re.IGNORECASE)),
+    ('maritime', re.compile(r'FERI N°|\bBL\s*:', re.IGNORECASE)),
+    ('normal', re.compile(r'TITRE DE TRANSPORT', re.IGNORECASE)),
+]
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class BatchTooLarge(Exception):
+    """A batch holds more PDFs, or more bytes of them, than allowed"""
+
+
+def get_executor():
+    """Return the shared process pool, creating it on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=BATCH_WORKERS)
+        return _executor
+
+
+def _discard_executor(executor):
+    """Drop a pool whose worker died, so the next submission starts a fresh one"""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _result(source, pdf_type):
+    return {
+        'source': source,
+        'pdf_type': pdf_type,
+        'status': 'error',
+        'error': None,
+        'timings': {},
+        'data': None,
+        'excel': None,
+        'pdf': None,
+    }
+
+
+def process_one(source, pdf_content, pdf_type, template_file, freight_number, container_type='', num_containers=1):
+    """
+    Extract and fill a single PDF, given as bytes or the path of the file.
+    Runs inside a worker process. Returns a result dict with status,
+    timings, extracted data and output bytes.
+    """
+    result = _result(source, pdf_type)
+    try:
+        if isinstance(pdf_content, str):
+            with open(pdf_content, 'rb') as f:
+                pdf_content = f.read()
+        started = time.perf_counter()
+        data = extract_data_from_pdf(pdf_content, pdf_type)
+        result['timings']['extract'] = round(time.perf_counter() - started, 4)
+        result['data'] = data
+
+        started = time.perf_counter()
+        modified_excel, modified_pdf, _ = process_excel_and_pdf(
+            data, pdf_type, template_file, freight_number, container_type, num_containers
+        )
+        result['timings']['fill'] = round(time.perf_counter() - started, 4)
+
+        if modified_excel is not None:
+            result['excel'] = modified_excel.getvalue()
+        if modified_pdf is not None:
+            result['pdf'] = modified_pdf.getvalue()
+        if template_file and modified_excel is None:
+            result['error'] = 'Excel generation failed'
+        else:
+            result['status'] = 'ok'
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def _size(content):
+    if hasattr(content, 'seek'):
+        size = content.seek(0, os.SEEK_END)
+        content.seek(0)
+        return size
+    return len(content)
+
+
+def _copy(content, path):
+    """Write bytes or a file's content to path, in chunks for files"""
+    with open(path, 'wb') as target:
+        if isinstance(content, bytes):
+            target.write(content)
+        else:
+            content.seek(0)
+            shutil.copyfileobj(content, target)
+
+
+def read_batch_inputs(files, directory, max_files=None, max_bytes=None):
+    """
+    Write the PDFs of uploaded files into directory and return them as a
+    list of (name, path). files is a list of (filename, bytes or seekable
+    file); zip archives are expanded, a member at a time. The PDFs are
+    counted and sized (zip members by their declared size, which zipfile
+    never reads past) before any of them is written, and BatchTooLarge is
+    raised when there are more than max_files (BATCH_MAX_FILES) or they add
+    up to more than max_bytes (BATCH_MAX_BYTES).
+    """
+    max_files = BATCH_MAX_FILES if max_files is None else max_files
+    max_bytes = BATCH_MAX_BYTES if max_bytes is None else max_bytes
+    members = []
+    archives = []
+    total = 0
+    try:
+        for filename, content in files:
+            if filename.lower().endswith('.zip'):
+                archive = zipfile.ZipFile(BytesIO(content) if isinstance(content, bytes) else content)
+                archives.append(archive)
+                for info in archive.infolist():
+                    name = info.filename
+                    if info.is_dir() or not name.lower().endswith('.pdf') or name.startswith('__MACOSX/'):
+                        continue
+                    members.append((os.path.basename(name), archive, info))
+                    total += info.file_size
+            elif filename.lower().endswith('.pdf'):
+                members.append((filename, None, content))
+                total += _size(content)
+            if len(members) > max_files:
+                raise BatchTooLarge(f"Too many files (maximum {max_files})")
+            if total > max_bytes:
+                raise BatchTooLarge(f"The PDFs are too large (maximum {max_bytes / (1024 * 1024):g} MB in total)")
+        inputs = []
+        for index, (name, archive, item) in enumerate(members):
+            path = os.path.join(directory, f'{index:05d}.pdf')
+            if archive is None:
+                _copy(item, path)
+            else:
+                with archive.open(item) as member:
+                    _copy(member, path)
+            inputs.append((name, path))
+        return inputs
+    finally:
+        for archive in archives:
+            archive.close()
+
+
+def _unique_name(name, used):
+    base, ext = os.path.splitext(name)
+    candidate = name
+    counter = 2
+    while candidate in used:
+        candidate = f"{base}_{counter}{ext}"
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+
+def run_batch(inputs, pdf_type, template_file, freight_number, container_type='', num_containers=1):
+    """
+    Process (name, bytes or path) inputs in the process pool and yield results
+    as they complete. At most two files per worker are queued at a time, so
+    only those and their outputs are held in memory. When a worker process
+    dies, the files it took down are reported as errors and the rest go to
+    a fresh pool.
+    """
+    executor = get_executor()
+    pending = {}
+    inputs = iter(inputs)
+
+    def submit_next():
+        nonlocal executor
+        for name, content in inputs:
+            args = (process_one, name, content, pdf_type, template_file, freight_number, container_type, num_containers)
+            try:
+                future = executor.submit(*args)
+            except BrokenProcessPool:
+                # Broken by an earlier file or batch
+                _discard_executor(executor)
+                executor = get_executor()
+                future = executor.submit(*args)
+            pending[future] = name
+            return
+
+    try:
+        for _ in range(2 * BATCH_WORKERS):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    _discard_executor(executor)
+                    result = _result(name, pdf_type)
+                    result['error'] = f"Worker process died: {str(e)}"
+                submit_next()
+                yield result
+    finally:
+        # The consumer stopped early (e.g. the client went away)
+        for future in pending:
+            future.cancel()
+
+
+def _add_result(archive, result, used):
+    """Write one result's outputs into archive and return its manifest entry"""
+    entry = {
+        'source': result['source'],
+        'status': result['status'],
+        'error': result['error'],
+        'timings': result['timings'],
+        'data': result['data'],
+        'outputs': [],
+    }
+    for key, extension in (('excel', 'xlsx'), ('pdf', 'pdf')):
+        if result[key] is None:
+            continue
+        name = _unique_name(get_download_name(result['data'], result['pdf_type'], extension), used)
+        archive.writestr(name, result[key])
+        entry['outputs'].append(name)
+    return entry
+
+
+def write_batch_zip(results, fileobj):
+    """
+    Write every generated Proforma_Invoice_<id>.xlsx/.pdf plus manifest.json
+    into a zip archive on fileobj. Returns the manifest.
+    """
+    manifest = []
+    used = set()
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for result in results:
+            manifest.append(_add_result(archive, result, used))
+        archive.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+    return manifest
+
+
+class _Chunks:
+    """Write-only stream collecting what zipfile writes until it is taken"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_batch_zip(results):
+    """
+    The zip write_batch_zip would write, yielded in pieces as each result
+    arrives, so a response can send it without holding the whole archive
+    """
+    stream = _Chunks()
+    manifest = []
+    used = set()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for result in results:
+            manifest.append(_add_result(archive, result, used))
+            yield stream.take()
+        archive.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+    yield stream.take()
+
+
+def infer_pdf_type(source, first_page):
+    """
+    pdf_type of a PDF from the folders of its relative path (e.g. maritime/ or
+    malaba/), else from markers on its first page, else None
+    """
+    for folder in reversed(os.path.dirname(source).replace('\\', '/').split('/')):
+        if folder.lower() in PDF_TYPE_FOLDERS:
+            return PDF_TYPE_FOLDERS[folder.lower()]
+    for pdf_type, marker in PDF_TYPE_MARKERS:
+        if marker.search(first_page):
+            return pdf_type
+    return None
+
+
+def _normalized(name):
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+
+def choose_template(pdf_type, data, templates):
+    """
+    Template for one document. templates maps a pdf_type (or '*' for any) to
+    a template filename. Without one, a template named after the document's
+    forwarding agent is used, else the only template of the type.
+    Raises ValueError when no template can be chosen.
+    """
+    available = template_registry.templates(pdf_type)
+    chosen = templates.get(pdf_type, templates.get('*'))
+    if chosen:
+        if chosen not in available:
+            raise ValueError(f"Template {chosen} not found for {pdf_type}")
+        return chosen
+    forwarder = _normalized(data.get('forwarding_agent') or data.get('transitaire') or '')
+    if forwarder:
+        for name in available:
+            stem = _normalized(os.path.splitext(name)[0])
+            if stem and forwarder.startswith(stem):
+                return name
+    if len(available) == 1:
+        return available[0]
+    raise ValueError(f"{len(available)} {pdf_type} templates and none named after the forwarder; "
+                     f"pass --template {pdf_type}=NAME")
+
+
+def process_file(path, source, pdf_type, templates, freight_number, container_type='', num_containers=1):
+    """
+    Read, type, extract and fill one PDF from disk. Runs inside a worker
+    process; pdf_type None means infer it. Returns the process_one result plus
+    the template and the seconds the whole file took.
+    """
+    started = time.perf_counter()
+    template_file = None
+    try:
+        with open(path, 'rb') as f:
+            pdf_content = f.read()
+        if pdf_type is None:
+            pdf_type = infer_pdf_type(source, first_page_text(pdf_content))
+            if pdf_type is None:
+                raise ValueError('Cannot infer the PDF type; pass --pdf-type or put the file in a folder named after it')
+        extract_started = time.perf_counter()
+        data = extract_data_from_pdf(pdf_content, pdf_type)
+        extract_seconds = round(time.perf_counter() - extract_started, 4)
+        template_file = choose_template(pdf_type, data, templates)
+        if pdf_type != 'maritime':
+            container_type, num_containers = '', 1
+        # Extraction results are cached, so process_one's own extraction is a cache hit
+        result = process_one(source, pdf_content, pdf_type, template_file, freight_number, container_type, num_containers)
+        result['timings']['extract'] = extract_seconds
+    except Exception as e:
+        result = {'source': source, 'pdf_type': pdf_type, 'status': 'error', 'error': str(e),
+                  'timings': {}, 'data': None, 'excel': None, 'pdf': None}
+    result['template'] = template_file
+    result['seconds'] = round(time.perf_counter() - started, 4)
+    return result
+
+
+def find_pdfs(directory, exclude=None):
+    """Relative paths of the PDFs below directory, sorted, skipping the exclude directory"""
+    exclude = os.path.abspath(exclude) if exclude else None
+    sources = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != exclude)
+        for name in sorted(files):
+            if name.lower().endswith('.pdf'):
+                sources.append(os.path.relpath(os.path.join(root, name), directory))
+    return sources
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def load_manifest(path):
+    """Latest manifest entry per source; a line cut off by an interruption is ignored"""
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries[entry['source']] = entry
+    return entries
+
+
+def _is_done(entry, stamp, output_dir):
+    """Whether a manifest entry finished this version of the file and its outputs still exist"""
+    return (
+        entry is not None
+        and entry['status'] == 'ok'
+        and entry.get('size') == stamp['size']
+        and entry.get('mtime') == stamp['mtime']
+        and all(os.path.exists(os.path.join(output_dir, name)) for name in entry['outputs'])
+    )
+
+
+def _write_output(path, content):
+    """Write via a temporary file, so an interrupted run never leaves a partial output"""
+    temp_path = f"{path}.part"
+    with open(temp_path, 'wb') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_directory(directory, output_dir, pdf_type, templates, freight_number, container_type='',
+                  num_containers=1, workers=BATCH_WORKERS):
+    """
+    Process every PDF below directory that the manifest in output_dir does
+    not list as done. Outputs are written to output_dir and a manifest line is
+    appended per file as it completes. Returns (entries of this run, number of
+    files skipped as done).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    previous = load_manifest(manifest_path)
+
+    pending = []
+    used = set()
+    skipped = 0
+    for source in find_pdfs(directory, exclude=output_dir):
+        stamp = _file_stamp(os.path.join(directory, source))
+        if _is_done(previous.get(source), stamp, output_dir):
+            used.update(previous[source]['outputs'])
+            skipped += 1
+        else:
+            pending.append((source, stamp))
+
+    entries = []
+    if not pending:
+        return entries, skipped
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(manifest_path, 'a', encoding='utf-8') as manifest:
+        futures = {
+            executor.submit(process_file, os.path.join(directory, source), source, pdf_type, templates,
+                            freight_number, container_type, num_containers): (source, stamp)
+            for source, stamp in pending
+        }
+        try:
+            for future in as_completed(futures):
+                source, stamp = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # The worker died (e.g. out of memory); the pool cannot run anything else
+                    result = {'source': source, 'pdf_type': pdf_type, 'template': None, 'status': 'error',
+                              'error': f"Worker failed: {str(e)}", 'timings': {}, 'seconds': None,
+                              'data': None, 'excel': None, 'pdf': None}
+                entry = dict(stamp, source=source, pdf_type=result['pdf_type'], template=result['template'],
+                             status=result['status'], error=result['error'], timings=result['timings'],
+                             seconds=result['seconds'], outputs=[], data=result['data'])
+                for key, extension in (('excel', 'xlsx'), ('pdf', 'pdf')):
+                    if result[key] is None:
+                        continue
+                    name = _unique_name(get_download_name(result['data'], result['pdf_type'], extension), used)
+                    _write_output(os.path.join(output_dir, name), result[key])
+                    entry['outputs'].append(name)
+                manifest.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                manifest.flush()
+                entries.append(entry)
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+    return entries, skipped
+
+
+def _template_option(value):
+    """Parse [TYPE=]NAME into (pdf_type or '*', NAME)"""
+    pdf_type, sep, name = value.partition('=')
+    if sep and pdf_type in TEMPLATE_DIRS:
+        return pdf_type, name
+    return '*', value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.batch',
+                                     description='Extract and fill every PDF below a directory')
+    parser.add_argument('directory', help='Directory searched recursively for PDFs')
+    parser.add_argument('--pdf-type', choices=sorted(TEMPLATE_DIRS),
+                        help='Type of every PDF (default: from folder names such as maritime/ or malaba/, else the first page)')
+    parser.add_argument('--template', action='append', type=_template_option, default=[], metavar='[TYPE=]NAME',
+                        help='Template filename, for every type or for one; repeatable '
+                             '(default: the one named after the forwarding agent, else the only one)')
+    parser.add_argument('--output', help='Directory for the outputs and manifest (default: <directory>/batch_output)')
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS, help='Worker processes')
+    parser.add_argument('--freight-number', type=int)
+    parser.add_argument('--container-type', default='', help='Maritime only')
+    parser.add_argument('--num-containers', type=int, default=1, help='Maritime only')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"{args.directory} is not a directory")
+    output_dir = args.output or os.path.join(args.directory, 'batch_output')
+
+    started = time.perf_counter()
+    try:
+        entries, skipped = run_directory(
+            args.directory, output_dir, args.pdf_type, dict(args.template), args.freight_number,
+            args.container_type, args.num_containers, max(1, args.workers)
+        )
+    except KeyboardInterrupt:
+        print(f"Interrupted; run the same command again to resume from {os.path.join(output_dir, MANIFEST_NAME)}")
+        return 130
+    elapsed = time.perf_counter() - started
+
+    failed = [entry for entry in entries if entry['status'] != 'ok']
+    for entry in failed:
+        print(f"{entry['source']}: {entry['error']}")
+    print(f"{len(entries)} files processed ({len(entries) - len(failed)} ok, {len(failed)} failed), "
+          f"{skipped} already done, in {elapsed:.1f}s; outputs in {output_dir}")
+    seconds = [entry['seconds'] for entry in entries if entry['seconds'] is not None]
+    if seconds:
+        print(f"Throughput {len(entries) / elapsed:.2f} files/s; "
+              f"latency p50 {percentile(seconds, 0.5):.2f}s, p95 {percentile(seconds, 0.95):.2f}s")
+        for stage in ('extract', 'fill'):
+            samples = [entry['timings'][stage] for entry in entries if stage in entry['timings']]
+            if samples:
+                print(f"  {stage:<8} p50 {percentile(samples, 0.5):.2f}s, p95 {percentile(samples, 0.95):.2f}s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
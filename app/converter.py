@@ -0,0 +1,341 @@
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+# LibreOffice converter pool settings
+LIBREOFFICE_PATH = os.environ.get('LIBREOFFICE_PATH', 'soffice')
+CONVERTER_POOL_SIZE = int(os.environ.get('CONVERTER_POOL_SIZE', 2))
+CONVERTER_QUEUE_SIZE = int(os.environ.get('CONVERTER_QUEUE_SIZE', 16))
+CONVERTER_TIMEOUT = float(os.environ.get('CONVERTER_TIMEOUT', 30))
+CONVERTER_START_TIMEOUT = float(os.environ.get('CONVERTER_START_TIMEOUT', 30))
+# Seconds a resident soffice gets to answer a health probe
+CONVERTER_PROBE_TIMEOUT = float(os.environ.get('CONVERTER_PROBE_TIMEOUT', 5))
+
+
+class ConverterError(Exception):
+    """Raised when a document could not be converted to PDF"""
+
+
+class ConverterBusy(ConverterError):
+    """Raised when the converter queue is full"""
+
+
+def libreoffice_available():
+    """Return True when a soffice binary can be found"""
+    return shutil.which(LIBREOFFICE_PATH) is not None
+
+
+def _uno_available():
+    try:
+        import uno  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _call_with_timeout(func, timeout):
+    """
+    Run func in a helper thread and return its result, or raise
+    TimeoutError when it has not returned after timeout seconds. A UNO
+    call into a wedged soffice blocks forever, so the caller must kill the
+    process to release the helper thread.
+    """
+    outcome = {}
+    done = threading.Event()
+
+    def run():
+        try:
+            outcome['result'] = func()
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=run, daemon=True).start()
+    if not done.wait(timeout):
+        raise TimeoutError
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome.get('result')
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class _Converter:
+    """
+    One headless soffice instance with its own user profile.
+
+    When the python-uno bridge is importable the soffice process is kept
+    running and documents are converted over a socket connection. Otherwise
+    each job starts a new soffice --convert-to process against the
+    already-initialised profile: that skips the first-start profile
+    creation, but not the process start-up, so without uno the pool mostly
+    bounds how many conversions run at once.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.profile_dir = tempfile.mkdtemp(prefix=f'soffice_profile_{index}_')
+        self.use_uno = _uno_available()
+        self.process = None
+        self.desktop = None
+        self.current = None
+        self.conversions = 0
+
+    def _profile_url(self):
+        return 'file://' + self.profile_dir.replace(os.sep, '/')
+
+    def start(self):
+        if not self.use_uno:
+            return
+        port = _free_port()
+        self.process = subprocess.Popen(
+            [
+                LIBREOFFICE_PATH,
+                f'-env:UserInstallation={self._profile_url()}',
+                '--headless', '--invisible', '--nologo', '--norestore', '--nodefault',
+                f'--accept=socket,host=127.0.0.1,port={port};urp;',
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        self.desktop = self._connect(port)
+
+    def _connect(self, port):
+        import uno
+
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local)
+        deadline = time.monotonic() + CONVERTER_START_TIMEOUT
+        while True:
+            try:
+                ctx = resolver.resolve(f'uno:socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext')
+                return ctx.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', ctx)
+            except Exception:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    raise ConverterError('soffice did not start')
+                time.sleep(0.2)
+
+    def healthy(self):
+        """
+        Whether the converter can take a job. A resident soffice must answer
+        a UNO call within CONVERTER_PROBE_TIMEOUT; without uno there is no
+        process between jobs, so the binary only has to be found.
+        """
+        if not self.use_uno:
+            return libreoffice_available()
+        if self.process is None or self.process.poll() is not None or self.desktop is None:
+            return False
+        try:
+            _call_with_timeout(lambda: self.desktop.getFrames().getCount(), CONVERTER_PROBE_TIMEOUT)
+            return True
+        except Exception:
+            return False
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, 9)
+            except Exception:
+                self.process.kill()
+            try:
+                self.process.wait(timeout=5)
+            except Exception:
+                pass
+        self.process = None
+        self.desktop = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def destroy(self):
+        self.stop()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def convert(self, source_path, pdf_path, timeout):
+        if self.use_uno:
+            try:
+                _call_with_timeout(lambda: self._convert_uno(source_path, pdf_path), timeout)
+            except TimeoutError:
+                # Killing soffice breaks the bridge, which ends the blocked call
+                self.stop()
+                raise ConverterError(f'Conversion timed out after {timeout}s')
+        else:
+            self._convert_cli(source_path, pdf_path, timeout)
+        self.conversions += 1
+
+    def _convert_uno(self, source_path, pdf_path):
+        import uno
+        from com.sun.star.beans import PropertyValue
+
+        def prop(name, value):
+            p = PropertyValue()
+            p.Name = name
+            p.Value = value
+            return p
+
+        doc = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(os.path.abspath(source_path)), '_blank', 0, (prop('Hidden', True),)
+        )
+        try:
+            doc.storeToURL(
+                uno.systemPathToFileUrl(os.path.abspath(pdf_path)), (prop('FilterName', 'calc_pdf_Export'),)
+            )
+        finally:
+            doc.close(True)
+
+    def _convert_cli(self, source_path, pdf_path, timeout):
+        out_dir = tempfile.mkdtemp()
+        try:
+            self.process = subprocess.Popen(
+                [
+                    LIBREOFFICE_PATH,
+                    f'-env:UserInstallation={self._profile_url()}',
+                    '--headless', '--norestore', '--convert-to', 'pdf', '--outdir', out_dir,
+                    source_path,
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+            try:
+                returncode = self.process.wait(timeout=timeout)
+            finally:
+                self.stop()
+            if returncode != 0:
+                raise ConverterError(f'soffice exited with status {returncode}')
+            produced = os.path.join(out_dir, os.path.splitext(os.path.basename(source_path))[0] + '.pdf')
+            if not os.path.exists(produced):
+                raise ConverterError('soffice produced no PDF')
+            shutil.move(produced, pdf_path)
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+
+class ConverterPool:
+    """
+    Pool of warm headless LibreOffice converters fed from a bounded queue.
+
+    Each worker thread owns one converter. A converter that fails its health
+    check is restarted before taking the next job, and a job that runs past
+    its timeout gets its converter killed and restarted.
+    """
+
+    def __init__(self, size=CONVERTER_POOL_SIZE, queue_size=CONVERTER_QUEUE_SIZE, timeout=CONVERTER_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.converters = []
+        self.threads = []
+        self.restarts = 0
+        self._closed = False
+        for i in range(size):
+            converter = _Converter(i)
+            self.converters.append(converter)
+            thread = threading.Thread(target=self._worker, args=(converter,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _worker(self, converter):
+        try:
+            converter.start()
+        except Exception as e:
+            print(f"Error starting converter {converter.index}: {str(e)}")
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            source_path, pdf_path, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if not converter.healthy():
+                    self.restarts += 1
+                    converter.restart()
+                converter.current = future
+                converter.convert(source_path, pdf_path, self.timeout)
+                future.set_result(pdf_path)
+            except Exception as e:
+                if not future.done():
+                    if isinstance(e, subprocess.TimeoutExpired):
+                        e = f'Conversion timed out after {self.timeout}s'
+                    future.set_exception(ConverterError(str(e)))
+                # The converter may be wedged; bring up a fresh one
+                try:
+                    self.restarts += 1
+                    converter.restart()
+                except Exception as restart_error:
+                    print(f"Error restarting converter {converter.index}: {str(restart_error)}")
+            finally:
+                converter.current = None
+        converter.destroy()
+
+    def submit(self, source_path, pdf_path):
+        """Queue a conversion and return a Future; raises ConverterBusy when the queue is full"""
+        if self._closed:
+            raise ConverterError('Converter pool is closed')
+        future = Future()
+        try:
+            self.jobs.put_nowait((source_path, pdf_path, future))
+        except queue.Full:
+            raise ConverterBusy('Converter queue is full')
+        return future
+
+    def convert(self, source_path, pdf_path, timeout=None):
+        """Convert source_path to pdf_path, blocking until done or the job timeout passes"""
+        timeout = timeout or self.timeout
+        future = self.submit(source_path, pdf_path)
+        # Allow for time spent waiting in the queue behind other jobs
+        wait = timeout * (1 + self.jobs.qsize() / max(self.size, 1))
+        try:
+            return future.result(timeout=wait)
+        except FutureTimeout:
+            if not future.cancel():
+                # The job is running and hung: kill its converter, the worker restarts it
+                for converter in self.converters:
+                    if converter.current is future:
+                        converter.stop()
+            raise ConverterError(f'Conversion timed out after {timeout}s')
+
+    def health(self):
+        """Return a small status dict for monitoring"""
+        return {
+            'size': self.size,
+            'healthy': sum(1 for c in self.converters if c.healthy()),
+            'queued': self.jobs.qsize(),
+            'restarts': self.restarts,
+            'conversions': sum(c.conversions for c in self.converters),
+        }
+
+    def close(self):
+        self._closed = True
+        for _ in self.threads:
+            self.jobs.put(None)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_converter_pool():
+    """Return the process-wide converter pool, starting it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConverterPool()
+        return _pool
+
+def convert_to_pdf(source_path, pdf_path, timeout=None):
+    """Convert a workbook to PDF using the shared converter pool"""
+    return get_converter_pool().convert(source_path, pdf_path, timeout)
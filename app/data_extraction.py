@@ -1,131 +1,375 @@
 import pdfplumber
+import os
 import re
+import time
 from io import BytesIO
-
-def extract_data_from_pdf(pdf_content, pdf_type):
+from .extraction_cache import extraction_cache
+from .layouts import LAYOUT_EXTRACTION, FirstPage, find_boxes, layout_cache
+from .metrics import StageTimer, metrics
+
+# Bump whenever extraction output changes so cached results are not reused
+EXTRACTOR_VERSION = 7
+
+def _clean_importer(value):
+    # remove trailing "Importateur" word if it exists
+    return _TRAILING_IMPORTATEUR.sub('', value.strip()).strip()
+
+def _clean_exporter(value):
+    value = value.strip()
+    name_match = _EXPORTER_NAME.match(value)
+    value = name_match.group(0).strip() if name_match else value
+    if value.endswith(' E'):
+        value = value[:-2].strip()
+    return value
+
+def _clean_forwarder(value):
+    value = value.strip()
+    name_match = _FORWARDER_NAME.match(value)
+    return name_match.group(0).strip() if name_match else value
+
+def _strip(value):
+    return value.strip()
+
+_TRAILING_IMPORTATEUR = re.compile(r'\bIMPORTATEUR\b.*$', re.IGNORECASE)
+_EXPORTER_NAME = re.compile(r'^[A-Za-z\s().&-]+')
+_FORWARDER_NAME = re.compile(r'^[A-Za-z\s().&-]+(?:\s*\([A-Za-z]+\)\s*[A-Za-z.]+)?')
+
+def _field(name, patterns, anchor, post=None, coerce=None, flags=0):
     """
-    Extract structured data from the PDF content based on the PDF type (normal or maritime).
+    Build a field spec. patterns are tried in order until one matches; anchor is
+    an upper-case literal that must appear in the text for any pattern to match,
+    so missing fields cost a substring check instead of a regex scan.
     """
-    extracted = {}
-    with pdfplumber.open(BytesIO(pdf_content)) as pdf:
-        text = ""
-        for page in pdf.pages:
-            text += page.extract_text() or ""
-
-    # Clean up text
-    text = text.replace('\n', ' ').strip()
-
-    if pdf_type == 'normal':
-        # Attestation Number
-        match = re.search(r'A\.D\s+N°\s*(\w+)', text)
-        if match:
-            extracted['attestation_number'] = match.group(1)
-
-        # Importateur (only name)
-        match = re.search(r'IMPORTATEUR\s*:\s*(.*?)(?=\s*(?:;|EXPORTATEUR))', text, re.DOTALL | re.IGNORECASE)
-        if match:
-            importateur_name = match.group(1).strip()
-            # remove trailing "Importateur" word if it exists
-            importateur_name = re.sub(r'\bIMPORTATEUR\b.*$', '', importateur_name, flags=re.IGNORECASE).strip()
-            extracted['importateur'] = importateur_name
-
-        # Exporter (only name)
-        match = re.search(r'EXPORTATEUR\s*([^\n;]+?)(?=\s+Exportater|\s*;|TRANSITAIRE)', text, re.DOTALL | re.IGNORECASE)
-        if match:
-            exporter_name = match.group(1).strip()
-            name_match = re.match(r'^[A-Za-z\s().&-]+', exporter_name)
-            exporter_name = name_match.group(0).strip() if name_match else exporter_name
-            if exporter_name.endswith(' E'):
-                exporter_name = exporter_name[:-2].strip()
-            extracted['exporter'] = exporter_name
-
-
-        # Forwarding Agent (only name)
-        match = re.search(r'TRANSITAIRE\s*:\s*([^\s;][^;]*?)(?:\s*Forwarding agent|DEST\.)', text, re.DOTALL)
-        if match:
-            forwarding_name = match.group(1).strip()
-            name_match = re.match(r'^[A-Za-z\s().&-]+(?:\s*\([A-Za-z]+\)\s*[A-Za-z.]+)?', forwarding_name)
-            extracted['forwarding_agent'] = name_match.group(0).strip() if name_match else forwarding_name
-
-        # Transport ID
-        match = re.search(r'TITRE DE TRANSPORT\s*:\s*(.+?)\s*TRANS', text)
-        if match:
-            extracted['transport_id'] = match.group(1).strip()
-
-        # CBM (Cubic Meters)
-        match = re.search(r'(\d+\.\d+\s*CBM)', text)
-        if match:
-            extracted['cbm'] = match.group(1).strip()
-
-        # Gross Weight
-        match = re.search(r'POIDS BRUT\s*:\s*([\d\.]+)\s*Kg', text)
-        if match:
-            extracted['gross_weight'] = float(match.group(1))
-
-    else:  # maritime
-        # FERI Number or Attestation Number
-        match = re.search(r'(?:FERI N°|VALIDATION|A\.D\s+N°)\s*:\s*(\w+)', text)
-        if match:
-            extracted['feri_number'] = match.group(1)
-            
-         # Attestation Number
-        match = re.search(r'A\.D\s+N°\s*(\w+)', text)
-        if match:
-            extracted['attestation_number'] = match.group(1)
-
-         # Importateur (only name)
-        match = re.search(r'IMPORTATEUR\s*:\s*(.*?)(?=\s*(?:;|EXPORTATEUR))', text, re.DOTALL | re.IGNORECASE)
-        if match:
-            importateur_name = match.group(1).strip()
-            # remove trailing "Importateur" word if it exists
-            importateur_name = re.sub(r'\bIMPORTATEUR\b.*$', '', importateur_name, flags=re.IGNORECASE).strip()
-            extracted['importateur'] = importateur_name
-
-
-        # Transitaire (only name)
-        match = re.search(r'TRANSITAIRE\s*:\s*([^\s;][^;]*?)(?:\s*Forwarding agent|DEST\.|ADD:|$)', text, re.DOTALL)
-        if match:
-            forwarding_name = match.group(1).strip()
-            name_match = re.match(r'^[A-Za-z\s().&-]+(?:\s*\([A-Za-z]+\)\s*[A-Za-z.]+)?', forwarding_name)
-            extracted['transitaire'] = name_match.group(0).strip() if name_match else forwarding_name
-
-        # BL (Bill of Lading)
-        match = re.search(r'(?:BL|TITRE DE TRANSPORT)\s*:\s*(.+?)(?:\s*ARMATEUR|TRANS|$)', text)
-        if match:
-            extracted['bl'] = match.group(1).strip()
-
-        # 1. Look for "CBM :" pattern (most reliable)
-        match = re.search(r'CBM\s*[:\-]?\s*(\d+(?:\.\d+)?)', text)
-
-        # 2. If not found, look for "TN: ... CBM: ..."
-        if not match:
-            match = re.search(r'CBM\s*:\s*(\d+(?:\.\d+)?)', text)
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    return {
+        'name': name,
+        'patterns': [re.compile(p, flags) for p in patterns],
+        'anchor': anchor,
+        'post': post,
+        'coerce': coerce,
+    }
 
-        # 3. If still not found, fallback to generic "X.XXX CBM"
-        if not match:
-            match = re.search(r'(\d+(?:\.\d+)?)\s*CBM', text)
+# Fields shared between the PDF types
+_ATTESTATION = _field('attestation_number', r'A\.D\s+N°\s*(\w+)', 'N°')
+_IMPORTATEUR = _field('importateur', r'IMPORTATEUR\s*:\s*(.*?)(?=\s*(?:;|EXPORTATEUR))', 'IMPORTATEUR',
+                      post=_clean_importer, flags=re.DOTALL | re.IGNORECASE)
+_EXPORTER = _field('exporter', r'EXPORTATEUR\s*([^\n;]+?)(?=\s+Exportater|\s*;|TRANSITAIRE)', 'EXPORTATEUR',
+                   post=_clean_exporter, flags=re.DOTALL | re.IGNORECASE)
+
+# Fields read the same way on the maritime-style forms
+_FERI = _field('feri_number', r'(?:FERI N°|VALIDATION|A\.D\s+N°)\s*:\s*(\w+)', ':')
+_BL = _field('bl', r'(?:BL|TITRE DE TRANSPORT)\s*:\s*(.+?)(?:\s*ARMATEUR|TRANS|$)', ':', post=_strip)
+# "CBM :" is the most reliable; fall back to a generic "X.XXX CBM"
+_CBM = _field('cbm', [r'CBM\s*[:\-]?\s*(\d+(?:\.\d+)?)', r'(\d+(?:\.\d+)?)\s*CBM'], 'CBM', coerce=float)
+_GROSS_WEIGHT = _field('gross_weight', r'POIDS BRUT\s*:\s*([\d\.]+)\s*(?:Kg|T)', 'POIDS BRUT', coerce=float)
+
+# Field specs per pdf_type, compiled once at import
+FIELD_SPECS = {
+    'normal': [
+        _ATTESTATION,
+        _IMPORTATEUR,
+        _EXPORTER,
+        _field('forwarding_agent', r'TRANSITAIRE\s*:\s*([^\s;][^;]*?)(?:\s*Forwarding agent|DEST\.)', 'TRANSITAIRE',
+               post=_clean_forwarder, flags=re.DOTALL),
+        _field('transport_id', r'TITRE DE TRANSPORT\s*:\s*(.+?)\s*TRANS', 'TITRE DE TRANSPORT', post=_strip),
+        _field('cbm', r'(\d+\.\d+\s*CBM)', 'CBM', post=_strip),
+        _field('gross_weight', r'POIDS BRUT\s*:\s*([\d\.]+)\s*Kg', 'POIDS BRUT', coerce=float),
+    ],
+    'maritime': [
+        _FERI,
+        _ATTESTATION,
+        _IMPORTATEUR,
+        _field('transitaire', r'TRANSITAIRE\s*:\s*([^\s;][^;]*?)(?:\s*Forwarding agent|DEST\.|ADD:|$)', 'TRANSITAIRE',
+               post=_clean_forwarder, flags=re.DOTALL),
+        _BL,
+        _CBM,
+        _GROSS_WEIGHT,
+        _EXPORTER,
+    ],
+    # Ponsiano attestations: maritime labels, but the debtor under TRANSITAIRE
+    # may run straight into the BL line
+    'possiano': [
+        _FERI,
+        _ATTESTATION,
+        _IMPORTATEUR,
+        _field('transitaire', r'TRANSITAIRE\s*:\s*([^\s;][^;]*?)(?:\s*Forwarding agent|DEST\.|ADD:|\bBL\s*:|$)',
+               'TRANSITAIRE', post=_clean_forwarder, flags=re.DOTALL),
+        _BL,
+        _CBM,
+        _GROSS_WEIGHT,
+        _EXPORTER,
+    ],
+    # Busia attestations: the debtor is the forwarding agent, labelled as on the
+    # Laban form, and the transport document is a BL or a road TITRE DE TRANSPORT
+    'busia': [
+        _FERI,
+        _ATTESTATION,
+        _IMPORTATEUR,
+        _field('forwarding_agent',
+               r'TRANSITAIRE\s*:\s*([^\s;][^;]*?)(?:\s*Forwarding agent|DEST\.|ADD:|\bBL\s*:|TITRE DE TRANSPORT|$)',
+               'TRANSITAIRE', post=_clean_forwarder, flags=re.DOTALL),
+        _BL,
+        _CBM,
+        _GROSS_WEIGHT,
+        _EXPORTER,
+    ],
+}
 
-        if match:
-            extracted['cbm'] = float(match.group(1))
+def extract_fields(text, spec):
+    """Run a field spec over the flattened text and return the extracted values"""
+    extracted = {}
+    upper = text.upper()
+    matches = {}  # each compiled pattern is scanned at most once
+    for field in spec:
+        if field['anchor'] not in upper:
+            continue
+        for pattern in field['patterns']:
+            if pattern not in matches:
+                matches[pattern] = pattern.search(text)
+            match = matches[pattern]
+            if not match:
+                continue
+            value = match.group(1)
+            if field['post']:
+                value = field['post'](value)
+            if field['coerce']:
+                try:
+                    value = field['coerce'](value)
+                except ValueError:
+                    break
+            extracted[field['name']] = value
+            break
+    return extracted
 
-        # Gross Weight
-        match = re.search(r'POIDS BRUT\s*:\s*([\d\.]+)\s*(?:Kg|T)', text)
-        if match:
-            extracted['gross_weight'] = float(match.group(1))
+# Fields that must be found for the fast pypdfium2 text to be accepted;
+# otherwise the document is re-read with pdfplumber. Pages stop being read
+# early only once every field of the spec is found (see has_every_field)
+REQUIRED_FIELDS = {
+    'normal': ['attestation_number', 'importateur', 'transport_id', 'cbm'],
+    'maritime': ['importateur', 'bl', 'cbm'],
+    'possiano': ['importateur', 'bl', 'cbm'],
+    'busia': ['importateur', 'bl', 'cbm'],
+}
 
-        # Exporter (only name)
-        match = re.search(r'EXPORTATEUR\s*([^\n;]+?)(?=\s+Exportater|\s*;|TRANSITAIRE)', text, re.DOTALL | re.IGNORECASE)
-        if match:
-            exporter_name = match.group(1).strip()
-            name_match = re.match(r'^[A-Za-z\s().&-]+', exporter_name)
-            exporter_name = name_match.group(0).strip() if name_match else exporter_name
-            if exporter_name.endswith(' E'):
-                exporter_name = exporter_name[:-2].strip()
-            extracted['exporter'] = exporter_name
+def has_every_field(extracted, spec):
+    """Whether every field of spec was found; any missing one may still be on a later page"""
+    return all(field['name'] in extracted for field in spec)
+
+def _pdf_size(pdf_content):
+    """Size of pdf_content, which is bytes or a seekable binary file (e.g. a spooled upload)"""
+    if hasattr(pdf_content, 'seek'):
+        size = pdf_content.seek(0, os.SEEK_END)
+        pdf_content.seek(0)
+        return size
+    return len(pdf_content)
+
+def _pdfium_pages(pdf_content):
+    """Yield the text of each page using pypdfium2 (fast, no layout analysis)"""
+    import pypdfium2 as pdfium
+
+    # Files are read by pdfium on demand rather than loaded into memory
+    if hasattr(pdf_content, 'seek'):
+        pdf_content.seek(0)
+    pdf = pdfium.PdfDocument(pdf_content)
+    try:
+        for i in range(len(pdf)):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            text = textpage.get_text_bounded()
+            textpage.close()
+            page.close()
+            yield text.replace('\r\n', '\n').replace('\r', '\n')
+    finally:
+        pdf.close()
+
+def _pdfplumber_pages(pdf_content):
+    """Yield the text of each page using pdfplumber"""
+    if hasattr(pdf_content, 'seek'):
+        pdf_content.seek(0)
+    else:
+        pdf_content = BytesIO(pdf_content)
+    with pdfplumber.open(pdf_content) as pdf:
+        for page in pdf.pages:
+            yield page.extract_text() or ""
+
+TEXT_TIERS = [('pypdfium2', _pdfium_pages), ('pdfplumber', _pdfplumber_pages)]
+
+def _timed_pages(pages, timer, stage):
+    """Yield from pages, adding the time spent producing each page to timer under stage"""
+    pages = iter(pages)
+    while True:
+        started = time.perf_counter()
+        try:
+            page_text = next(pages)
+        except StopIteration:
+            timer.add(stage, time.perf_counter() - started)
+            return
+        timer.add(stage, time.perf_counter() - started)
+        yield page_text
+
+def extract_tiered(pdf_content, parse, is_complete, stop_early=True, timer=None, until=None, is_done=None):
+    """
+    Parse the document text from the fastest tier that yields a complete result.
+
+    parse turns a list of page texts into a result dict and is_complete
+    decides whether that result is good enough. With stop_early, each page is
+    parsed once as it is read, as parse([page], found) where found is the
+    result of the pages before it; parse then only needs to look for what
+    found still misses. Pages stop being read as soon as is_done (default
+    is_complete) says nothing more can be found in them. Without stop_early
+    the pages are parsed together once they are read. until, given the page
+    texts read so far, says whether the remaining pages can be skipped
+    without parsing in between. Returns the result and the name of the tier
+    that produced it; when no tier is complete the last tier's result is
+    returned. timer, a metrics.StageTimer, receives the text reading time per
+    tier ('text_<tier>') and the 'parse' time.
+    """
+    if timer is not None:
+        untimed_parse = parse
 
+        def parse(*args):
+            started = time.perf_counter()
+            try:
+                return untimed_parse(*args)
+            finally:
+                timer.add('parse', time.perf_counter() - started)
+
+    is_done = is_done or is_complete
+    best = ({}, None)
+    for tier, pages_of in TEXT_TIERS:
+        pages = []
+        result = {}
+        try:
+            page_texts = pages_of(pdf_content)
+            if timer is not None:
+                page_texts = _timed_pages(page_texts, timer, f'text_{tier}')
+            for page_text in page_texts:
+                pages.append(page_text)
+                if stop_early:
+                    result = parse([page_text], result)
+                    if is_done(result) and is_complete(result):
+                        return result, tier
+                if until is not None and until(pages):
+                    break
+            if not stop_early or not pages:
+                result = parse(pages)
+        except Exception as e:
+            print(f"Error reading PDF text with {tier}: {str(e)}")
+            continue
+        if is_complete(result):
+            return result, tier
+        best = (result, tier)
+    return best
 
+def extract_data_from_pdf(pdf_content, pdf_type):
+    """
+    Extract structured data from the PDF content based on the PDF type
+    (normal, maritime, possiano or busia). Results are cached by content hash.
+    pdf_content is bytes or a seekable binary file such as a spooled upload.
+    """
+    metrics.inc('proforma_input_bytes_total', _pdf_size(pdf_content), operation='extract', pdf_type=pdf_type)
+    with StageTimer('extract', pdf_type=pdf_type) as timer:
+        return extraction_cache.cached(
+            pdf_content, pdf_type, EXTRACTOR_VERSION, lambda: _extract_data_from_pdf(pdf_content, pdf_type, timer)
+        )
+
+def _extract_data_from_pdf(pdf_content, pdf_type, timer=None):
+    spec = FIELD_SPECS.get(pdf_type, FIELD_SPECS['maritime'])
+    required = REQUIRED_FIELDS.get(pdf_type, REQUIRED_FIELDS['maritime'])
+
+    def parse(pages, found=None):
+        # Clean up text
+        text = "".join(pages).replace('\n', ' ').strip()
+        if not found:
+            return extract_fields(text, spec)
+        missing = [field for field in spec if field['name'] not in found]
+        return {**found, **extract_fields(text, missing)}
+
+    def is_complete(extracted):
+        return all(field in extracted for field in required)
+
+    def is_done(extracted):
+        return has_every_field(extracted, spec)
+
+    learn_key = first_page = None
+    if LAYOUT_EXTRACTION:
+        started = time.perf_counter()
+        learn_key, extracted, first_page = _extract_by_layout(pdf_content, pdf_type, spec)
+        if timer is not None:
+            timer.add('layout', time.perf_counter() - started)
+        # Boxes are on the first page, so they only do when they hold every field
+        if extracted is not None and is_done(extracted):
+            extracted['extraction_tier'] = 'layout'
+            return extracted
+
+    # The layout check already read the first page, which is usually all the full-text path needs
+    extracted = None
+    if first_page:
+        started = time.perf_counter()
+        extracted = parse([first_page])
+        if timer is not None:
+            timer.add('parse', time.perf_counter() - started)
+    if extracted is not None and is_done(extracted):
+        tier = TEXT_TIERS[0][0]
+    else:
+        extracted, tier = extract_tiered(pdf_content, parse, is_complete, timer=timer, is_done=is_done)
+    if learn_key is not None and tier is not None and is_complete(extracted):
+        started = time.perf_counter()
+        _learn_layout(pdf_content, learn_key, spec, extracted)
+        if timer is not None:
+            timer.add('learn_layout', time.perf_counter() - started)
+    extracted['extraction_tier'] = tier
     return extracted
 
+def _extract_by_layout(pdf_content, pdf_type, spec):
+    """
+    Read the fields from the boxes learned for the document's layout,
+    fingerprinted from label positions on its first page. Returns the layout
+    key when the layout has not been seen yet (so it can be learned), the
+    fields read from the boxes, or None when there are no usable boxes or one
+    of them came out empty, and the first page's full text when the fields
+    were not read from boxes.
+    """
+    try:
+        with FirstPage(pdf_content) as page:
+            fingerprint = page.fingerprint()
+            key = f"{pdf_type}:{fingerprint}"
+            known, boxes = layout_cache.get(key) if fingerprint else (True, None)
+            if boxes:
+                extracted = {}
+                for field in spec:
+                    if field['name'] in boxes:
+                        extracted.update(extract_fields(page.text(boxes[field['name']]), [field]))
+                if len(extracted) == len(boxes):
+                    return None, extracted, None
+            return (None if known else key), None, page.page_text()
+    except Exception as e:
+        print(f"Error reading PDF layout: {str(e)}")
+        return None, None, None
+
+def _learn_layout(pdf_content, key, spec, extracted):
+    """
+    Learn the field boxes of a layout from a document whose full-text
+    extraction was complete. The boxes are kept only if reading them gives
+    back exactly the values the full text gave; otherwise the layout is
+    remembered as unusable and always takes the full-text path.
+    """
+    fields = [field for field in spec if field['name'] in extracted]
+    boxes = None
+    try:
+        found = find_boxes(pdf_content, {field['name']: field['patterns'] for field in fields})
+        if len(found) == len(fields):
+            with FirstPage(pdf_content) as page:
+                if all(
+                    extract_fields(page.text(found[field['name']]), [field]).get(field['name']) == extracted[field['name']]
+                    for field in fields
+                ):
+                    boxes = found
+    except Exception as e:
+        print(f"Error learning PDF layout: {str(e)}")
+    layout_cache.put(key, boxes)
+
 ###################
 # Invesco Flagging
 ###################
@@ -142,6 +386,64 @@ BORDER_MAPPING = {
     "CYANIKA": "CYANIKA"
 }
 
+# End of the goods section, the last part of a Normal certificate that is parsed
+NORMAL_GOODS_END = re.compile(r"TYPE NR COLIS", re.IGNORECASE)
+NORMAL_FOB_BLOCK = re.compile(r"VALEUR FOB.*?TOTAL", re.S | re.I)
+
+# Goods section markers: an item, and the end of the section. The goods
+# patterns are matched against the upper-cased text, which is much faster
+# than an IGNORECASE alternation
+GOODS_MARKERS = re.compile(r"(?P<item>MARCHANDISE\s+N\.C\.\s+PAYS\s*:)|(?P<end>TYPE NR COLIS)")
+# The HS line that starts an item's description
+GOODS_HS_LINE = re.compile(r"[A-Z]+\s*HS\s*:\s*([^\n]*)\n")
+# Ends an item's description where the declared values start
+GOODS_DECLARED = re.compile(r"VALEURS DECLAREES PAR L'EXPORTATEUR")
+GOODS_QUANTITY = re.compile(r"\b(?:QTE|QTY|QUANTITE)\s*:?\s*(\d[\d.,]*)")
+GOODS_VALUE = re.compile(r"\b(?:VALEUR|VALUE)\s*:?\s*(\d[\d.,]*)")
+
+def tokenize_goods(extracted_text):
+    """
+    Split the goods section of a Normal certificate into line items in a
+    single pass over the text. Each item is a dict with the HS code, the
+    description (whitespace collapsed) and the quantity and value found in
+    it, or None. Items without an HS line are skipped, and nothing is
+    returned unless the section's end marker (TYPE NR COLIS) is present.
+    """
+    upper = extracted_text.upper()
+    if len(upper) != len(extracted_text):
+        # A few characters (e.g. ß) change length when upper-cased; keep offsets aligned
+        upper = ''.join(c if len(c.upper()) != 1 else c.upper() for c in extracted_text)
+    items = []
+
+    def add(start, end):
+        # An HS line needs its own line break before the item's trailing whitespace
+        while end > start and upper[end - 1].isspace():
+            end -= 1
+        # Only the first HS line of an item starts its description
+        hs_line = GOODS_HS_LINE.search(upper, start, end)
+        if hs_line is None:
+            return
+        declared = GOODS_DECLARED.search(upper, hs_line.end(), end)
+        if declared:
+            end = declared.start()
+        quantity = GOODS_QUANTITY.search(upper, hs_line.end(), end)
+        value = GOODS_VALUE.search(upper, hs_line.end(), end)
+        items.append({
+            "hs_code": extracted_text[hs_line.start(1):hs_line.end(1)].strip(),
+            "description": ' '.join(extracted_text[hs_line.end():end].split()),
+            "quantity": quantity.group(1) if quantity else None,
+            "value": value.group(1) if value else None,
+        })
+
+    item_start = None  # where the current item's text starts
+    for marker in GOODS_MARKERS.finditer(upper):
+        if item_start is not None:
+            add(item_start, marker.start())
+        if marker.lastgroup == "end":
+            return items
+        item_start = marker.end()
+    return []
+
 # --- Extraction function for Normal Certificate ---
 def extract_normal_certificate_data(extracted_text):
     patterns = {
@@ -161,7 +463,7 @@ def extract_normal_certificate_data(extracted_text):
         data[key] = match.group(1).strip() if match else None
 
     # Block-based parse for FOB/Charges
-    block_match = re.search(r"VALEUR FOB.*?TOTAL", extracted_text, re.S | re.I)
+    block_match = NORMAL_FOB_BLOCK.search(extracted_text)
     if block_match:
         block_text = block_match.group(0)
         numbers = re.findall(r"\d+\.\d+", block_text)
@@ -173,58 +475,34 @@ def extract_normal_certificate_data(extracted_text):
             data["transporterName"] = "OWN"
             data["validationNotes"] = "please verify"
 
-    # Extract Goods Descriptions
-    descriptions_list = []
-    start_marker = r"MARCHANDISE\s+N\.C\.\s+Pays\s*:"
-    end_marker = r"TYPE NR COLIS"
-    
-    start_matches = list(re.finditer(start_marker, extracted_text, re.IGNORECASE))
-    end_match = re.search(end_marker, extracted_text, re.IGNORECASE)
-    
-    if start_matches and end_match:
-        for i, start_match in enumerate(start_matches):
-            start_pos = start_match.end()
-            if i < len(start_matches) - 1:
-                end_pos = start_matches[i + 1].start()
-            else:
-                end_pos = end_match.start()
-            
-            goods_text = extracted_text[start_pos:end_pos].strip()
-            
-            description_match = re.search(
-                r"[A-Z]+\s*HS\s*:\s*([^\n]*)\n([\s\S]*?)(?=(?:\s*MARCHANDISE\s+N\.C\.\s+Pays\s*:|\s*VALEURS DECLAREES PAR L'EXPORTATEUR|$))",
-                goods_text,
-                re.IGNORECASE
-            )
-            if description_match:
-                description = description_match.group(2)
-                description = ' '.join(description.split()).strip()
-                descriptions_list.append(description)
-    
+    # Goods line items, one pass over the text
+    data["Goods"] = tokenize_goods(extracted_text)
+    descriptions_list = [item["description"] for item in data["Goods"]]
     data["Descriptions"] = descriptions_list if descriptions_list else ["No descriptions extracted"]
 
     return data
 
+# AD certificate fields, all in the header block
+AD_CERTIFICATE_PATTERNS = {
+    "Certificate_No": r"AD\s*N°\s*:?([0-9A-Z/ ]+)",
+    "Importer": r"IMPORTATEUR\s*:?\s*([^\n]+?)(?=\s*BL#:|$)",
+    "Transporteur": r"(?<!ID\s)Transporteur\s*:\s*(.+?)(?=\s+Fret\b|$)",
+    "Carrier": r"Carrier:\s*([^\n]+)(?=\s+On\b|$)",
+    "Forwarder": r"Transitaire:\s*([^\n]+)",
+    "Entry_No": r"N°\s*Declaration\s*([\w\d]+(?:\s[\w\d]+)*)(?=\s*Agent)",
+    "Discharge_Place": r"Lieu d'entrée en RDC:?\s*([A-Z]+)",
+    "Final_Destination": r"Destination finale en\s*([A-Z][A-Za-z]*)\b",
+    "Transport": r"ID Transporteur:?\s*([^\n]+)",
+    "Descriptions": r"MARCHANDISE\s*:\s*([^\n]+)",
+    "FOB_Value": r"Valeur FOB\s*:\s*([\d.,]+)",
+    "Base_Freight": r"Valeur Fret\s*:\s*([\d.,]+)",
+    "Insurance": r"Assurance\s*([\d.,]+)\s*USD"
+}
+
 # --- Extraction function for AD Certificate ---
 def extract_ad_certificate_data(extracted_text):
-    patterns = {
-        "Certificate_No": r"AD\s*N°\s*:?([0-9A-Z/ ]+)",
-        "Importer": r"IMPORTATEUR\s*:?\s*([^\n]+?)(?=\s*BL#:|$)",
-        "Transporteur": r"(?<!ID\s)Transporteur\s*:\s*(.+?)(?=\s+Fret\b|$)",
-        "Carrier": r"Carrier:\s*([^\n]+)(?=\s+On\b|$)",
-        "Forwarder": r"Transitaire:\s*([^\n]+)",
-        "Entry_No": r"N°\s*Declaration\s*([\w\d]+(?:\s[\w\d]+)*)(?=\s*Agent)",
-        "Discharge_Place": r"Lieu d'entrée en RDC:?\s*([A-Z]+)",
-        "Final_Destination": r"Destination finale en\s*([A-Z][A-Za-z]*)\b",
-        "Transport": r"ID Transporteur:?\s*([^\n]+)",
-        "Descriptions": r"MARCHANDISE\s*:\s*([^\n]+)",
-        "FOB_Value": r"Valeur FOB\s*:\s*([\d.,]+)",
-        "Base_Freight": r"Valeur Fret\s*:\s*([\d.,]+)",
-        "Insurance": r"Assurance\s*([\d.,]+)\s*USD"
-    }
-
     data = {}
-    for key, pattern in patterns.items():
+    for key, pattern in AD_CERTIFICATE_PATTERNS.items():
         match = re.search(pattern, extracted_text, re.IGNORECASE)
         if match:
             try:
@@ -246,25 +524,124 @@ def extract_ad_certificate_data(extracted_text):
 
     return data
 
-# --- Main extraction function ---
-def extract_certificate_data(pdf_file):
-    extracted_text = ""
-    with pdfplumber.open(pdf_file) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text()
-            if text:
-                extracted_text += text + "\n"
+# Certificate fields that must be found for the fast pypdfium2 text to be accepted
+REQUIRED_CERTIFICATE_FIELDS = ["Certificate_No", "Importer"]
+
+class WrongDocumentError(ValueError):
+    """The uploaded PDF is not the kind of document the page expects"""
+
+# Markers read from the first page of an upload to tell the documents apart
+AD_CERTIFICATE_MARKER = re.compile(r"AD\s*N°", re.IGNORECASE)
+NORMAL_CERTIFICATE_MARKERS = re.compile(
+    r"MOYEN DE TRANSPORT|LIEU DE\s+[A-Z]+\s+\d{2}/\d{2}/\d{4}|MARCHANDISE\s+N\.C\.|VALEUR FOB", re.IGNORECASE
+)
+PROFORMA_MARKERS = re.compile(r"FERI N°|POIDS BRUT|\bCBM\b|ATTESTATION DE VALIDATION|\bBL\s*:", re.IGNORECASE)
+
+def classify_certificate(first_page):
+    """
+    Classify a flagging upload from the text of its first page: "AD", "Normal",
+    or "Proforma" for a FERI/proforma document uploaded to the flagging page.
+    """
+    if AD_CERTIFICATE_MARKER.search(first_page):
+        return "AD"
+    if NORMAL_CERTIFICATE_MARKERS.search(first_page) or not PROFORMA_MARKERS.search(first_page):
+        return "Normal"
+    return "Proforma"
+
+def first_page_text(pdf_content):
+    """Text of the first page from the first tier that yields any, or "" """
+    for tier, pages_of in TEXT_TIERS:
+        pages = pages_of(pdf_content)
+        try:
+            first_page = next(pages, "")
+        except Exception as e:
+            print(f"Error reading PDF text with {tier}: {str(e)}")
+            continue
+        finally:
+            pages.close()
+        if first_page.strip():
+            return first_page
+    return ""
+
+def _ad_pages_needed():
+    """
+    Every AD field is in the header, so once all are found later pages are
+    never needed. Only the newest page is searched for the fields still missing.
+    """
+    missing = set()
+
+    def until(pages):
+        if len(pages) == 1:
+            missing.update(AD_CERTIFICATE_PATTERNS)
+        for key in list(missing):
+            if re.search(AD_CERTIFICATE_PATTERNS[key], pages[-1], re.IGNORECASE):
+                missing.discard(key)
+        return not missing
+    return until
+
+def _normal_pages_needed():
+    """The goods section and the FOB block come last; annex pages after them are skipped"""
+    def until(pages):
+        return bool(NORMAL_GOODS_END.search(pages[-1])) and bool(NORMAL_FOB_BLOCK.search("\n".join(pages)))
+    return until
+
+# Certificate type -> factory for the extract_tiered until check that stops
+# reading once the pages hold everything the type's extractor needs
+CERTIFICATE_PAGES_NEEDED = {
+    "AD": _ad_pages_needed,
+    "Normal": _normal_pages_needed,
+}
 
-    # Determine certificate type based on content
-    if re.search(r"AD\s*N°", extracted_text, re.IGNORECASE):
+def parse_certificate_text(extracted_text, certificate_type=None):
+    """
+    Run the extractor for certificate_type ("AD" or "Normal") over the
+    certificate text, classifying the text itself when no type is given.
+    """
+    if certificate_type is None:
+        certificate_type = "AD" if AD_CERTIFICATE_MARKER.search(extracted_text) else "Normal"
+    if certificate_type == "AD":
         data = extract_ad_certificate_data(extracted_text)
-        data["Certificate_Type"] = "AD"
     else:
         data = extract_normal_certificate_data(extracted_text)
-        data["Certificate_Type"] = "Normal"
+    data["Certificate_Type"] = certificate_type
 
     # Map Discharge_Place to OUT-BOUND-Border
     discharge_place = data.get("Discharge_Place")
     data["Out_Bound_Border"] = BORDER_MAPPING.get(discharge_place, "UNKNOWN") if discharge_place else "UNKNOWN"
 
-    return data
\ No newline at end of file
+    return data
+
+# --- Main extraction function ---
+def extract_certificate_data(pdf_file):
+    # Uploads are read from their (possibly spooled) stream, not copied into memory
+    pdf_content = getattr(pdf_file, 'stream', pdf_file)
+    metrics.inc('proforma_input_bytes_total', _pdf_size(pdf_content), operation='certificate')
+    with StageTimer('certificate') as timer:
+        return extraction_cache.cached(
+            pdf_content, 'certificate', EXTRACTOR_VERSION, lambda: _extract_certificate_data(pdf_content, timer)
+        )
+
+def _extract_certificate_data(pdf_content, timer=None):
+    # The first page decides the type, which decides how many pages are read
+    started = time.perf_counter()
+    certificate_type = classify_certificate(first_page_text(pdf_content))
+    if timer is not None:
+        timer.add('classify', time.perf_counter() - started)
+    if certificate_type == "Proforma":
+        raise WrongDocumentError(
+            "This looks like a FERI/proforma document, not a flagging certificate. "
+            "Upload it on the Proforma Generator page instead."
+        )
+
+    def parse(pages):
+        return parse_certificate_text("".join(text + "\n" for text in pages if text), certificate_type)
+
+    def is_complete(data):
+        return all(data.get(field) for field in REQUIRED_CERTIFICATE_FIELDS)
+
+    data, tier = extract_tiered(
+        pdf_content, parse, is_complete, stop_early=False, timer=timer,
+        until=CERTIFICATE_PAGES_NEEDED[certificate_type](),
+    )
+    data["Extraction_Tier"] = tier
+    return data
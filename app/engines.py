@@ -0,0 +1,247 @@
+import os
+from .template_cache import template_cache
+
+# Workbook fill engine used by process_excel_and_pdf ('xlwings', 'openpyxl' or 'xmlpatch')
+EXCEL_ENGINE = os.environ.get('EXCEL_ENGINE', 'xlwings')
+
+# PDF export used by headless engines ('libreoffice', 'overlay' or 'none')
+PDF_EXPORT = os.environ.get('PDF_EXPORT', 'libreoffice')
+
+def _no_progress(stage):
+    pass
+
+def get_insert_function(pdf_type):
+    """Return the insert_data function for the given pdf_type"""
+    if pdf_type == 'normal':
+        from .insertions_normal import insert_data
+    elif pdf_type == 'maritime':
+        from .insertions_maritime import insert_data
+    elif pdf_type == 'possiano':
+        from .insertions_possiano import insert_data
+    elif pdf_type == 'busia':
+        from .insertions_busia import insert_data
+    else:
+        from .insertions_maritime import insert_data
+    return insert_data
+
+def call_insert_function(insert_func, ws, data, freight_number, container_type, num_containers, template_file):
+    """Call an insert_data function, passing the template filename only to modules that accept it"""
+    try:
+        insert_func(ws, data, freight_number, container_type, num_containers, template_file)
+    except TypeError:
+        insert_func(ws, data, freight_number, container_type, num_containers)
+
+
+class _CellRange:
+    """Minimal stand-in for an xlwings Range backed by an openpyxl cell"""
+
+    def __init__(self, ws, address):
+        self._cell = ws[address]
+
+    @property
+    def value(self):
+        return self._cell.value
+
+    @value.setter
+    def value(self, value):
+        self._cell.value = value
+
+
+class SheetAdapter:
+    """
+    Wrap an openpyxl worksheet so the insert_data functions can keep using
+    the xlwings style ws.range('B8').value = ... API.
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+
+    def range(self, address):
+        return _CellRange(self.ws, address)
+
+
+class _RecordedRange:
+    def __init__(self, values, address):
+        self._values = values
+        self._address = address.upper()
+
+    @property
+    def value(self):
+        return self._values.get(self._address)
+
+    @value.setter
+    def value(self, value):
+        self._values[self._address] = value
+
+
+class CellRecorder:
+    """
+    Stand-in sheet that only records the ws.range('B8').value = ... writes of
+    an insert_data function, as {address: value}. Reads return what was
+    written so far, not the template's values.
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def range(self, address):
+        return _RecordedRange(self.values, address)
+
+
+class XlwingsEngine:
+    """Fill and export through a Microsoft Excel instance (Windows only)"""
+    name = 'xlwings'
+
+    def fill(self, template_path, excel_path, pdf_path, fill_sheet, progress=_no_progress):
+        """
+        Write the cached template to excel_path, open it in Excel, run fill_sheet
+        on the first sheet, recalculate, save and export to pdf_path.
+        progress is called with 'start', 'fill', 'calculate' and 'export' as each
+        stage starts ('start' covers launching Excel and opening the workbook).
+        Returns True when a PDF was produced.
+        """
+        import xlwings as xw
+
+        progress('start')
+
+        with open(excel_path, 'wb') as f:
+            f.write(template_cache.get_bytes(template_path))
+
+        app = xw.App(visible=False, add_book=False)
+        wb = None
+        try:
+            wb = app.books.open(excel_path)
+            progress('fill')
+            fill_sheet(wb.sheets[0])
+
+            # Force calculation of all formulas
+            progress('calculate')
+            wb.app.calculate()
+            wb.save()
+
+            # Export to PDF with exact formatting
+            progress('export')
+            wb.api.ExportAsFixedFormat(Type=0, Filename=pdf_path)
+            return True
+        finally:
+            if wb is not None:
+                wb.close()
+            app.quit()
+
+
+class OpenpyxlEngine:
+    """
+    Headless fill engine: the template is loaded into an in-memory openpyxl
+    workbook, filled and written out without starting Excel.
+    """
+    name = 'openpyxl'
+
+    def load(self, template_path):
+        return template_cache.get_workbook(template_path)
+
+    def fill(self, template_path, excel_path, pdf_path, fill_sheet, progress=_no_progress):
+        """
+        Load template_path, run fill_sheet on the first sheet and save to excel_path.
+        progress is called with 'fill', 'calculate' and 'export' as each stage starts.
+        Returns True when a PDF was produced.
+        """
+        progress('fill')
+        wb = self.load(template_path)
+        ws = wb.worksheets[0]
+        fill_sheet(SheetAdapter(ws))
+        # Formulas are recalculated by whichever application opens the file
+        progress('calculate')
+        wb.save(excel_path)
+        progress('export')
+        return self.export_pdf(template_path, ws, excel_path, pdf_path)
+
+    def export_pdf(self, template_path, ws, excel_path, pdf_path):
+        """
+        Export the filled sheet according to PDF_EXPORT: convert the saved
+        workbook through the pooled LibreOffice converters, or draw the dynamic
+        cells over the template's cached base PDF. Returns True on success.
+        """
+        if PDF_EXPORT not in ('libreoffice', 'overlay'):
+            return False
+
+        from .converter import ConverterError, convert_to_pdf, libreoffice_available
+
+        if PDF_EXPORT == 'overlay':
+            from .overlay import render_overlay_pdf
+            try:
+                render_overlay_pdf(template_path, ws, pdf_path)
+            except ConverterError as e:
+                print(f"Error rendering base PDF: {str(e)}")
+                return False
+            except Exception as e:
+                # The workbook is already saved; a failed overlay only costs the PDF
+                print(f"Error rendering overlay PDF: {str(e)}")
+                return False
+            return True
+
+        if not libreoffice_available():
+            print("LibreOffice not available, skipping PDF export")
+            return False
+        try:
+            convert_to_pdf(excel_path, pdf_path)
+        except ConverterError as e:
+            print(f"Error exporting PDF: {str(e)}")
+            return False
+        return True
+
+
+class XmlPatchEngine(OpenpyxlEngine):
+    """
+    Headless fill engine that never parses the workbook: the cells written by
+    fill_sheet are patched straight into the template's sheet XML (see
+    xlsx_patch.py) and every other part of the file is copied unchanged. The
+    formulas depending on them are recomputed with the template's formula
+    graph (formulas.py) and their results cached in the file. Templates the
+    patcher cannot handle are filled with openpyxl instead.
+    """
+    name = 'xmlpatch'
+
+    def fill(self, template_path, excel_path, pdf_path, fill_sheet, progress=_no_progress):
+        """
+        Record the writes of fill_sheet and patch them into a copy of template_path
+        at excel_path. progress is called with 'fill', 'calculate' and 'export'.
+        Returns True when a PDF was produced.
+        """
+        from .formulas import get_formula_graph
+        from .xlsx_patch import PatchError, patch_workbook
+
+        progress('fill')
+        cells = CellRecorder()
+        fill_sheet(cells)
+        # Only the totals downstream of the written cells are recomputed and cached in the file
+        progress('calculate')
+        formula_values = get_formula_graph(template_path).recalculate(cells.values, changed=cells.values)
+        try:
+            with open(excel_path, 'wb') as f:
+                patch_workbook(template_cache.get_bytes(template_path), cells.values, f, formula_values)
+        except PatchError as e:
+            print(f"Cannot patch {os.path.basename(template_path)} in place ({str(e)}), filling it with openpyxl")
+            return super().fill(template_path, excel_path, pdf_path, fill_sheet, progress)
+
+        progress('export')
+        ws = None
+        if PDF_EXPORT == 'overlay':
+            # The overlay draws from a parsed sheet, so apply the same writes to a cached clone
+            ws = self.load(template_path).worksheets[0]
+            for address, value in cells.values.items():
+                ws[address].value = value
+        return self.export_pdf(template_path, ws, excel_path, pdf_path)
+
+
+ENGINES = {
+    'xlwings': XlwingsEngine,
+    'openpyxl': OpenpyxlEngine,
+    'xmlpatch': XmlPatchEngine,
+}
+
+def get_engine(name=None):
+    """Return an engine instance by name, defaulting to EXCEL_ENGINE"""
+    name = (name or EXCEL_ENGINE).lower()
+    if name not in ENGINES:
+        raise ValueError(f"Unknown Excel engine: {name}")
+    return ENGINES[name]()
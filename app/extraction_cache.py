@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# In-memory cache budget in bytes (JSON size of the cached results)
+EXTRACTION_CACHE_BYTES = int(os.environ.get('EXTRACTION_CACHE_BYTES', 16 * 1024 * 1024))
+# Optional SQLite file shared by all gunicorn workers; disabled when empty
+EXTRACTION_CACHE_DB = os.environ.get('EXTRACTION_CACHE_DB', '')
+# Rows kept in the SQLite file, oldest written pruned first; 0 keeps every row
+EXTRACTION_CACHE_DB_ROWS = int(os.environ.get('EXTRACTION_CACHE_DB_ROWS', 10000))
+# Seconds a SQLite row stays usable after it was written; 0 keeps rows forever
+EXTRACTION_CACHE_TTL = float(os.environ.get('EXTRACTION_CACHE_TTL', 30 * 24 * 3600))
+# The SQLite file is pruned when opened and after this many writes by a process
+PRUNE_EVERY = 64
+
+
+def cache_key(pdf_content, pdf_type, version):
+    """
+    Content-addressed key: hash of the PDF bytes plus type and extractor version.
+    pdf_content may also be a seekable binary file, hashed in chunks.
+    """
+    if hasattr(pdf_content, 'read'):
+        sha = hashlib.sha256()
+        pdf_content.seek(0)
+        for chunk in iter(lambda: pdf_content.read(1024 * 1024), b''):
+            sha.update(chunk)
+        pdf_content.seek(0)
+        digest = sha.hexdigest()
+    else:
+        digest = hashlib.sha256(pdf_content).hexdigest()
+    return f"{digest}:{pdf_type}:{version}"
+
+
+class ExtractionCache:
+    """
+    Two-tier cache of extraction results.
+
+    The memory tier is an LRU evicted by total JSON size. The SQLite tier is
+    optional and lets every worker process reuse a result computed by another;
+    rows older than ttl are ignored, and expired rows plus the oldest beyond
+    max_rows are deleted every PRUNE_EVERY writes. Results are stored as JSON,
+    so callers always get their own copy.
+    """
+
+    def __init__(self, max_bytes=EXTRACTION_CACHE_BYTES, db_path=EXTRACTION_CACHE_DB,
+                 max_rows=EXTRACTION_CACHE_DB_ROWS, ttl=EXTRACTION_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.writes = 0
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if self.db_path:
+            self._execute('PRAGMA journal_mode=WAL')
+            self._execute(
+                'CREATE TABLE IF NOT EXISTS extractions (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)'
+            )
+            self._execute('CREATE INDEX IF NOT EXISTS extractions_created ON extractions (created)')
+            self.prune()
+
+    def _execute(self, sql, params=()):
+        """Run one statement on a short-lived connection and return the first row"""
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchone()
+        finally:
+            conn.close()
+
+    def _oldest_kept(self):
+        """Write time before which SQLite rows have expired"""
+        return time.time() - self.ttl if self.ttl > 0 else 0
+
+    def prune(self):
+        """Delete expired SQLite rows and the oldest ones beyond max_rows"""
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        try:
+            with conn:
+                conn.execute('DELETE FROM extractions WHERE created < ?', (self._oldest_kept(),))
+                if self.max_rows > 0:
+                    conn.execute(
+                        'DELETE FROM extractions WHERE key IN '
+                        '(SELECT key FROM extractions ORDER BY created DESC LIMIT -1 OFFSET ?)',
+                        (self.max_rows,),
+                    )
+        finally:
+            conn.close()
+
+    def _remember(self, key, value):
+        with self._lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            if len(value) > self.max_bytes:
+                return
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def get(self, key):
+        with self._lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(value)
+        if self.db_path:
+            try:
+                row = self._execute('SELECT value FROM extractions WHERE key = ? AND created >= ?',
+                                    (key, self._oldest_kept()))
+            except sqlite3.Error as e:
+                print(f"Error reading extraction cache: {str(e)}")
+                row = None
+            if row:
+                self._remember(key, row[0])
+                with self._lock:
+                    self.disk_hits += 1
+                return json.loads(row[0])
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result):
+        value = json.dumps(result, ensure_ascii=False)
+        self._remember(key, value)
+        if self.db_path:
+            try:
+                self._execute(
+                    'INSERT OR REPLACE INTO extractions (key, value, created) VALUES (?, ?, ?)',
+                    (key, value, time.time()),
+                )
+                with self._lock:
+                    self.writes += 1
+                    due = self.writes % PRUNE_EVERY == 0
+                if due:
+                    self.prune()
+            except sqlite3.Error as e:
+                print(f"Error writing extraction cache: {str(e)}")
+
+    def cached(self, pdf_content, pdf_type, version, extract):
+        """Return the cached result for this PDF or compute it with extract()"""
+        key = cache_key(pdf_content, pdf_type, version)
+        result = self.get(key)
+        if result is None:
+            result = extract()
+            self.put(key, result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+        if self.db_path:
+            self._execute('DELETE FROM extractions')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
+
+
+# Shared cache used by data_extraction
+extraction_cache = ExtractionCache()
@@ -0,0 +1,625 @@
+import atexit
+import logging
+import os
+import queue
+import secrets
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from .metrics import StageTimer
+
+# Invesco portal
+FLAGGING_LOGIN_URL = os.environ.get('FLAGGING_LOGIN_URL', 'https://www.invesco-ug.com/auth/login')
+FLAGGING_FORM_URL = os.environ.get('FLAGGING_FORM_URL', 'https://www.invesco-ug.com/business/application/new')
+# Portal account; both must be set in the environment
+FLAGGING_EMAIL = os.environ.get('FLAGGING_EMAIL', '')
+FLAGGING_PASSWORD = os.environ.get('FLAGGING_PASSWORD', '')
+
+# Browser used by the session pool ('edge' or 'chrome')
+FLAGGING_BROWSER = os.environ.get('FLAGGING_BROWSER', 'edge')
+# WebDriver binary; Selenium Manager locates one when this path does not exist
+FLAGGING_DRIVER_PATH = os.environ.get('FLAGGING_DRIVER_PATH', os.path.join("..", "python-prototype", "msedgedriver.exe"))
+# Run the browser without a window, with the lean HEADLESS_ARGUMENTS profile
+FLAGGING_HEADLESS = os.environ.get('FLAGGING_HEADLESS', '0') == '1'
+# Selenium page load strategy; 'eager' stops waiting at DOMContentLoaded instead of the load event
+FLAGGING_PAGE_LOAD = os.environ.get('FLAGGING_PAGE_LOAD', 'eager' if FLAGGING_HEADLESS else 'normal')
+# Comma-separated BLOCKED_RESOURCES kinds the browser may not fetch; empty loads everything
+FLAGGING_BLOCK = os.environ.get('FLAGGING_BLOCK', 'image,font,media,analytics' if FLAGGING_HEADLESS else '')
+# Logged-in browser sessions kept per process
+FLAGGING_POOL_SIZE = int(os.environ.get('FLAGGING_POOL_SIZE', 1))
+# Seconds to wait for a free session before giving up
+FLAGGING_LEASE_TIMEOUT = float(os.environ.get('FLAGGING_LEASE_TIMEOUT', 120))
+# Seconds after which a browser is replaced by a fresh one
+FLAGGING_SESSION_MAX_AGE = float(os.environ.get('FLAGGING_SESSION_MAX_AGE', 4 * 3600))
+# How text fields are filled: 'script' sets them all in one execute_script call
+# (falling back to typing for any field that does not verify), 'keys' types each one
+FLAGGING_FILL_MODE = os.environ.get('FLAGGING_FILL_MODE', 'script')
+# Extra attempts per certificate in a batch before it is reported as failed
+FLAGGING_RETRIES = int(os.environ.get('FLAGGING_RETRIES', 2))
+# Button that submits a filled application in a batch; set it to match the
+# portal's submit button, or to an empty value to refuse submitting batches
+FLAGGING_SUBMIT_XPATH = os.environ.get('FLAGGING_SUBMIT_XPATH', "//button[@type='submit']")
+# Where screenshots of failed fills are saved
+FLAGGING_SCREENSHOT_DIR = os.environ.get('FLAGGING_SCREENSHOT_DIR', os.path.join(tempfile.gettempdir(), 'flagging_screenshots'))
+
+# Browser flags for headless sessions: no window, extensions, disk cache or background traffic.
+# The in-memory cache stays on so the portal's scripts are not fetched again for every form
+HEADLESS_ARGUMENTS = [
+    '--headless=new',
+    '--window-size=1366,900',
+    '--disable-extensions',
+    '--disable-gpu',
+    '--disable-dev-shm-usage',
+    '--disable-background-networking',
+    '--disable-component-update',
+    '--disable-sync',
+    '--no-first-run',
+    '--mute-audio',
+    '--disk-cache-size=1',
+    '--media-cache-size=1',
+]
+
+# URL patterns per resource kind, blocked through the DevTools Network.setBlockedURLs command
+_EXTENSIONS = {
+    'image': ['png', 'jpg', 'jpeg', 'gif', 'svg', 'webp', 'ico'],
+    'font': ['woff', 'woff2', 'ttf', 'otf', 'eot'],
+    'media': ['mp4', 'webm', 'mp3', 'ogg'],
+}
+BLOCKED_RESOURCES = {kind: [f'*.{ext}{tail}' for ext in exts for tail in ('', '?*')] for kind, exts in _EXTENSIONS.items()}
+BLOCKED_RESOURCES['font'] += ['*fonts.googleapis.com*', '*fonts.gstatic.com*']
+BLOCKED_RESOURCES['analytics'] = [
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*hotjar.com*',
+    '*clarity.ms*', '*facebook.net*', '*/analytics.js*', '*/gtag/js*',
+]
+
+# Text inputs: element id -> certificate field
+TEXT_FIELDS = [
+    ('certificateNumber', 'Certificate_No'),
+    ('customsDeclarationNumber', 'Entry_No'),
+    ('importerName', 'Importer'),
+    ('exporterName', 'Exporter'),
+    ('importAgentName', 'Forwarder'),
+    ('exportAgentName', 'Forwarder'),
+    ('transporterName', 'transporterName'),
+    ('vehicleNumber', 'Transport'),
+    ('dischargeLocation', 'Discharge_Place'),
+    ('finalDestination', 'Final_Destination'),
+    ('fobValue', 'FOB_Value'),
+    ('freightValue', 'Base_Freight'),
+]
+
+# Sets each [xpath, value] pair through the native value setter and fires the
+# events Angular's value accessors listen to. Returns the xpaths not found.
+SET_VALUES_SCRIPT = """
+const missing = [];
+for (const [xpath, value] of arguments[0]) {
+  const el = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+  if (!el) { missing.push(xpath); continue; }
+  const proto = el.tagName === 'TEXTAREA' ? HTMLTextAreaElement.prototype : HTMLInputElement.prototype;
+  Object.getOwnPropertyDescriptor(proto, 'value').set.call(el, value);
+  el.dispatchEvent(new Event('input', {bubbles: true}));
+  el.dispatchEvent(new Event('change', {bubbles: true}));
+  el.dispatchEvent(new Event('blur'));
+}
+return missing;
+"""
+
+# Current value of each xpath (null when not found)
+GET_VALUES_SCRIPT = """
+return arguments[0].map(function (xpath) {
+  const el = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+  return el ? el.value : null;
+});
+"""
+
+# Present once the application form has rendered
+FORM_READY = "//app-my-text-input[@id='certificateNumber']//input"
+
+
+class FlaggingError(Exception):
+    """Raised when the flagging form could not be filled"""
+
+
+class FlaggingBusy(FlaggingError):
+    """Raised when no browser session became free in time"""
+
+
+def _no_progress(stage):
+    pass
+
+
+def check_credentials():
+    """Raise FlaggingError unless the portal account is configured"""
+    missing = [name for name, value in (('FLAGGING_EMAIL', FLAGGING_EMAIL), ('FLAGGING_PASSWORD', FLAGGING_PASSWORD))
+               if not value]
+    if missing:
+        raise FlaggingError(f"The flagging portal login is not configured: set {' and '.join(missing)}")
+
+
+def blocked_url_patterns(block):
+    """URL patterns for a comma-separated list of BLOCKED_RESOURCES kinds"""
+    patterns = []
+    for kind in (k.strip() for k in block.split(',')):
+        if not kind:
+            continue
+        if kind not in BLOCKED_RESOURCES:
+            raise FlaggingError(f"Unknown resource kind to block: {kind}")
+        patterns += BLOCKED_RESOURCES[kind]
+    return patterns
+
+
+def create_driver(headless=None, page_load_strategy=None, block=None):
+    """
+    Start a WebDriver for FLAGGING_BROWSER. Arguments default to
+    FLAGGING_HEADLESS, FLAGGING_PAGE_LOAD and FLAGGING_BLOCK.
+    """
+    from selenium import webdriver
+
+    headless = FLAGGING_HEADLESS if headless is None else headless
+    page_load_strategy = page_load_strategy or FLAGGING_PAGE_LOAD
+    block = FLAGGING_BLOCK if block is None else block
+    patterns = blocked_url_patterns(block)
+
+    browser = FLAGGING_BROWSER.lower()
+    if browser == 'chrome':
+        from selenium.webdriver.chrome.service import Service
+        options = webdriver.ChromeOptions()
+        driver_class = webdriver.Chrome
+    elif browser == 'edge':
+        from selenium.webdriver.edge.service import Service
+        options = webdriver.EdgeOptions()
+        driver_class = webdriver.Edge
+    else:
+        raise FlaggingError(f"Unknown browser: {FLAGGING_BROWSER}")
+
+    options.page_load_strategy = page_load_strategy
+    if headless:
+        for argument in HEADLESS_ARGUMENTS:
+            options.add_argument(argument)
+    if 'image' in [kind.strip() for kind in block.split(',')]:
+        # Images are also switched off in the profile, so none is requested in the first place
+        options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+
+    service = Service(FLAGGING_DRIVER_PATH) if os.path.exists(FLAGGING_DRIVER_PATH) else Service()
+    driver = driver_class(service=service, options=options)
+    if patterns:
+        try:
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns})
+        except Exception:
+            driver.quit()
+            raise
+    return driver
+
+
+def cargo_description(form_data):
+    """Text for the cargoDescription area from the extracted Descriptions"""
+    descriptions = form_data.get("Descriptions", [])
+    if form_data.get("Certificate_Type") == "AD":
+        if not descriptions:
+            return ""
+        numbers_part = "".join(str(item) for item in descriptions if str(item).isdigit())
+        text_part = " ".join(str(item) for item in descriptions if not str(item).isdigit())
+        full_text = numbers_part
+        if text_part:
+            full_text += ": " + text_part  # adds colon and text
+        return full_text
+    return "\n".join(descriptions) if descriptions else ""
+
+
+def dropdown_choices(form_data):
+    """(toggle XPath, option XPath) for each dropdown, in the order they are filled"""
+    is_ad = form_data.get("Certificate_Type") == "AD"
+    labelled = [
+        ('Issuing Body', 'DR CONGO'),
+        ('Cert. Type', 'CONTINUANCE' if is_ad else 'REGIONAL'),
+        ('Cargo Origin', 'OUTSIDE UGANDA' if is_ad else 'UGANDA'),
+        ('Shipment Route', 'OUT-BOUND'),
+        ('Transport Mode', 'ROAD'),
+        ('FOB Currency', 'USD'),
+    ]
+    choices = [
+        (f"//app-my-input-dropdown[@label='{label}']//button[@ngbdropdowntoggle]",
+         f"//button[@ngbdropdownitem and text()='{option}']")
+        for label, option in labelled
+    ]
+    choices.append((
+        "//div[@ngbdropdown and contains(@class, 'dropdown')]//button[@ngbdropdowntoggle and contains(text(), 'Select Border Point')]",
+        f"//button[@ngbdropdownitem and text()='{form_data.get('Out_Bound_Border', 'UNKNOWN')}']",
+    ))
+    return choices
+
+
+def _wait(driver, seconds=10):
+    from selenium.webdriver.support.ui import WebDriverWait
+    return WebDriverWait(driver, seconds)
+
+
+def _click(driver, xpath):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    _wait(driver).until(EC.element_to_be_clickable((By.XPATH, xpath))).click()
+
+
+def _type(driver, xpath, value):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    field = _wait(driver).until(EC.presence_of_element_located((By.XPATH, xpath)))
+    field.clear()
+    field.send_keys(value)
+
+
+def login(driver):
+    """Sign in on the login page"""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
+    check_credentials()
+    logging.info("Logging in to the flagging portal")
+    driver.get(FLAGGING_LOGIN_URL)
+    _wait(driver).until(EC.presence_of_element_located((By.ID, "emailAddress"))).send_keys(FLAGGING_EMAIL)
+    _wait(driver).until(EC.presence_of_element_located((By.ID, "password"))).send_keys(FLAGGING_PASSWORD)
+    _click(driver, "//button[text()='Login']")
+    _wait(driver, 30).until(EC.url_changes(FLAGGING_LOGIN_URL))
+
+
+def open_form(driver, progress=_no_progress):
+    """
+    Navigate to a new application form, logging in again when the portal
+    sends us to the login page (expired session). Returns True if a login
+    was needed. progress is called with 'navigate' (driver.get returning,
+    per the page load strategy), 'form_ready' (waiting for the form to
+    render) and 'login' as each step starts.
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
+    progress('navigate')
+    driver.get(FLAGGING_FORM_URL)
+    progress('form_ready')
+    _wait(driver, 20).until(EC.any_of(
+        EC.presence_of_element_located((By.XPATH, FORM_READY)),
+        EC.presence_of_element_located((By.ID, "emailAddress")),
+    ))
+    if not driver.find_elements(By.ID, "emailAddress"):
+        return False
+
+    progress('login')
+    login(driver)
+    progress('navigate')
+    driver.get(FLAGGING_FORM_URL)
+    progress('form_ready')
+    _wait(driver, 20).until(EC.presence_of_element_located((By.XPATH, FORM_READY)))
+    return True
+
+
+def text_values(form_data):
+    """(XPath, value) for every text input and text area, in form order"""
+    values = [
+        (f"//app-my-text-input[@id='{field_id}']//input[@id='{field_id}']", form_data.get(key, ""))
+        for field_id, key in TEXT_FIELDS
+    ]
+    values.append(("//app-my-text-area[@id='validationNotes']//textarea[@id='validationNotes']", form_data.get("validationNotes", "")))
+    values.append(("//app-my-text-area[@id='cargoDescription']//textarea[@id='cargoDescription']", cargo_description(form_data)))
+    return [(xpath, "" if value is None else str(value)) for xpath, value in values]
+
+
+def _normalize(value):
+    return (value or "").replace("\r\n", "\n")
+
+
+def fill_by_script(driver, values):
+    """
+    Set all (XPath, value) pairs in one execute_script call, then read them
+    back in a second one. Returns the pairs that are missing or did not take
+    the expected value, for the caller to fill another way.
+    """
+    try:
+        driver.execute_script(SET_VALUES_SCRIPT, [list(pair) for pair in values])
+        current = driver.execute_script(GET_VALUES_SCRIPT, [xpath for xpath, _ in values])
+    except Exception as e:
+        logging.warning(f"Script fill failed, typing every field: {str(e)}")
+        return list(values)
+    return [
+        (xpath, value) for (xpath, value), actual in zip(values, current)
+        if actual is None or _normalize(actual) != _normalize(value)
+    ]
+
+
+def fill_certificate(driver, form_data, progress=_no_progress):
+    """
+    Fill the open application form with one extracted certificate. progress
+    is called with 'dropdowns', 'text_fields' and 'freight_currency' as each
+    step starts.
+    """
+    progress('dropdowns')
+    for toggle, option in dropdown_choices(form_data):
+        _click(driver, toggle)
+        _click(driver, option)
+
+    progress('text_fields')
+    values = text_values(form_data)
+    if FLAGGING_FILL_MODE == 'script':
+        values = fill_by_script(driver, values)
+        if values:
+            logging.info(f"Typing {len(values)} field(s) that did not verify after the script fill")
+    for xpath, value in values:
+        _type(driver, xpath, value)
+
+    progress('freight_currency')
+    _click(driver, "//app-my-input-dropdown[@label='Freight Currency']//button[@ngbdropdowntoggle]")
+    _click(driver, "//app-my-input-dropdown[@label='Freight Currency']//button[@ngbdropdownitem and text()='USD']")
+    logging.info("Form filled successfully")
+
+
+def submit_form(driver):
+    """Submit the filled application and wait for the portal to leave the form"""
+    from selenium.webdriver.support import expected_conditions as EC
+
+    form_url = driver.current_url
+    _click(driver, FLAGGING_SUBMIT_XPATH)
+    _wait(driver, 30).until(EC.url_changes(form_url))
+
+
+def save_screenshot(driver, name):
+    """Save a screenshot under FLAGGING_SCREENSHOT_DIR and return its path, or None"""
+    try:
+        os.makedirs(FLAGGING_SCREENSHOT_DIR, exist_ok=True)
+        path = os.path.join(FLAGGING_SCREENSHOT_DIR, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(3)}.png")
+        return path if driver.save_screenshot(path) else None
+    except Exception as e:
+        logging.error(f"Could not save screenshot: {str(e)}")
+        return None
+
+
+class BrowserSession:
+    """One browser, kept open and logged in between fills"""
+
+    def __init__(self, driver_factory=create_driver):
+        self.driver = driver_factory()
+        self.created = time.monotonic()
+        self.fills = 0
+        self.logins = 0
+
+    def alive(self):
+        try:
+            self.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def expired(self, max_age):
+        return time.monotonic() - self.created > max_age
+
+    def open_form(self, progress=_no_progress):
+        if open_form(self.driver, progress):
+            self.logins += 1
+
+    def fill(self, form_data, progress=_no_progress):
+        fill_certificate(self.driver, form_data, progress)
+        self.fills += 1
+
+    def submit(self):
+        submit_form(self.driver)
+
+    def close(self):
+        try:
+            self.driver.quit()
+        except Exception:
+            pass
+
+
+class SessionPool:
+    """
+    Up to size logged-in browser sessions, created on demand and leased to
+    one fill at a time. Idle sessions are handed out least recently used
+    first, so the form filled last stays on screen the longest. Dead or
+    too-old browsers are replaced on lease.
+    """
+
+    def __init__(self, size=FLAGGING_POOL_SIZE, session_factory=BrowserSession,
+                 lease_timeout=FLAGGING_LEASE_TIMEOUT, max_age=FLAGGING_SESSION_MAX_AGE):
+        self.size = max(1, size)
+        self.session_factory = session_factory
+        self.lease_timeout = lease_timeout
+        self.max_age = max_age
+        self.idle = queue.Queue()
+        self.created = 0
+        self.leased = 0
+        self.replaced = 0
+        self._lock = threading.Lock()
+
+    def _new_session(self):
+        """Start a session if the pool is below size, else return None"""
+        with self._lock:
+            if self.created >= self.size:
+                return None
+            self.created += 1
+        try:
+            return self.session_factory()
+        except Exception:
+            with self._lock:
+                self.created -= 1
+            raise
+
+    def _acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                session = self.idle.get_nowait()
+            except queue.Empty:
+                session = self._new_session()
+                if session is not None:
+                    return session
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise FlaggingBusy("All flagging browser sessions are busy")
+                # Wake up periodically in case a dead session freed a slot
+                try:
+                    session = self.idle.get(timeout=min(remaining, 1.0))
+                except queue.Empty:
+                    continue
+            if session.alive() and not session.expired(self.max_age):
+                return session
+            self._discard(session)
+            with self._lock:
+                self.replaced += 1
+
+    def _discard(self, session):
+        session.close()
+        with self._lock:
+            self.created -= 1
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """Borrow a session; it goes back to the pool afterwards unless its browser died"""
+        session = self._acquire(self.lease_timeout if timeout is None else timeout)
+        with self._lock:
+            self.leased += 1
+        try:
+            yield session
+        finally:
+            with self._lock:
+                self.leased -= 1
+            if session.alive():
+                self.idle.put(session)
+            else:
+                self._discard(session)
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self.created,
+                'leased': self.leased,
+                'idle': self.idle.qsize(),
+                'replaced': self.replaced,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_session_pool():
+    """Return the process-wide session pool; browsers are closed at exit"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SessionPool()
+            atexit.register(_pool.close)
+        return _pool
+
+def _fill_once(session, form_data, timer, submit=False):
+    # The timer doubles as the progress callback, so every browser step gets its own stage
+    session.open_form(timer)
+    session.fill(form_data, timer)
+    if submit:
+        timer('submit')
+        session.submit()
+    timer.end()
+
+def submit_certificate(form_data, timeout=None):
+    """
+    Fill the flagging form with one extracted certificate in a pooled,
+    logged-in browser. Returns per-stage timings in seconds.
+    """
+    check_credentials()
+    timer = StageTimer('fill_form')
+    try:
+        timer('lease')
+        with get_session_pool().lease(timeout) as session:
+            try:
+                _fill_once(session, form_data, timer)
+            except Exception:
+                screenshot = save_screenshot(session.driver, 'error_screenshot')
+                if screenshot:
+                    logging.info(f"Screenshot saved as {screenshot}")
+                raise
+    except Exception as e:
+        logging.error(f"An error occurred: {str(e)}")
+        timer.error()
+        raise
+    finally:
+        timer.finish()
+    return {stage: round(seconds, 3) for stage, seconds in timer.stages.items()}
+
+def _attempt(session, index, form_data, result, submit):
+    """One try at filling (and optionally submitting) a batch item, recorded in result"""
+    result['attempts'] += 1
+    timer = StageTimer('fill_form', mode='batch')
+    try:
+        _fill_once(session, form_data, timer, submit)
+        result['status'] = 'ok'
+        result['error'] = None
+    except Exception as e:
+        timer.error()
+        logging.error(f"Certificate {index} attempt {result['attempts']} failed: {str(e)}")
+        result['error'] = str(e)
+        result['screenshots'].append(save_screenshot(session.driver, f"certificate_{index}_attempt_{result['attempts']}"))
+    finally:
+        timer.finish()
+        result['timings'].append({stage: round(seconds, 3) for stage, seconds in timer.stages.items()})
+
+def submit_certificates(certificates, submit=True, retries=FLAGGING_RETRIES, timeout=None):
+    """
+    Fill the flagging form for each extracted certificate in turn, in one
+    leased browser session. A failed certificate is retried up to retries
+    times before moving on; it never stops the rest of the batch. If the
+    browser dies, a fresh session is leased and the batch continues. Each
+    filled form is submitted; with submit=False forms are only filled, and
+    each one replaces the last, so that only checks that they fill cleanly.
+
+    Returns one result per certificate: index, Certificate_No, status
+    ('ok' or 'error'), attempts, error, timings per attempt and the paths of
+    failure screenshots. When no session can be leased part way through, the
+    remaining certificates are reported as errors with the results so far.
+    """
+    results = [
+        {
+            'index': index,
+            'certificate_no': form_data.get('Certificate_No'),
+            'status': 'error',
+            'attempts': 0,
+            'error': None,
+            'timings': [],
+            'screenshots': [],
+        }
+        for index, form_data in enumerate(certificates)
+    ]
+    check_credentials()
+    if submit and not FLAGGING_SUBMIT_XPATH:
+        raise FlaggingError("Submitting is not configured: set FLAGGING_SUBMIT_XPATH")
+    pool = get_session_pool()
+    current = 0
+    while current < len(certificates):
+        with ExitStack() as stack:
+            try:
+                session = stack.enter_context(pool.lease(timeout))
+            except Exception as e:
+                # Nothing done yet: fail the whole batch (FlaggingBusy answers 503)
+                if not any(result['attempts'] for result in results):
+                    raise
+                # Otherwise keep what was already filled or submitted and report the rest
+                logging.error(f"No browser session for certificate {current}: {str(e)}")
+                for result in results[current:]:
+                    result['error'] = f"No browser session available: {str(e)}"
+                break
+            while current < len(certificates):
+                result = results[current]
+                _attempt(session, current, certificates[current], result, submit)
+                if result['status'] == 'ok' or result['attempts'] > retries:
+                    current += 1
+                if not session.alive():
+                    break
+    for result in results:
+        result['screenshots'] = [path for path in result['screenshots'] if path]
+    return results
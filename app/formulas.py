@@ -0,0 +1,475 @@
+"""
+A small formula engine for the proforma templates.
+
+Formulas are parsed once per template into closures and a dependency graph,
+so filling a template only recomputes the cells downstream of the cells that
+were written (plus volatile ones such as TODAY()). The supported subset is
+what the templates use: numbers, strings, cell and range references,
+arithmetic (+ - * / ^ %), & concatenation, comparisons and the functions in
+FUNCTIONS. A formula outside it, or one that would give an Excel error, gets
+the value None, as do the cells computed from it. Callers then leave those
+cells for Excel or LibreOffice to calculate.
+"""
+import datetime
+import os
+import re
+import threading
+from decimal import ROUND_HALF_UP, Decimal
+
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+from .template_cache import template_cache
+
+# Day 0 of Excel's 1900 date system, as used for cached date values
+EXCEL_EPOCH = datetime.date(1899, 12, 30)
+
+_TOKEN = re.compile(r'''
+    \s*(?:
+      (?P<sheet>(?:'[^']+'|[A-Za-z_][\w.]*)!)
+    | (?P<range>\$?[A-Z]{1,3}\$?\d+:\$?[A-Z]{1,3}\$?\d+)
+    | (?P<function>[A-Z][A-Z0-9.]*)\s*\(
+    | (?P<cell>\$?[A-Z]{1,3}\$?\d+)(?![\w(])
+    | (?P<bool>TRUE|FALSE)(?![\w(])
+    | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<string>"(?:[^"]|"")*")
+    | (?P<op><>|<=|>=|[-+*/^&=<>%(),])
+    )''', re.X)
+_ADDRESS = re.compile(r'\$?([A-Z]{1,3})\$?(\d+)')
+
+
+class FormulaError(Exception):
+    """A formula outside the supported subset, or one whose result is an Excel error"""
+
+
+def split_address(address):
+    """(column index, row) of 'D14' or '$D$14'"""
+    match = _ADDRESS.fullmatch(address)
+    return column_index_from_string(match.group(1)), int(match.group(2))
+
+
+def _plain(address):
+    return address.replace('$', '')
+
+
+def _range_cells(start, end):
+    c0, r0 = split_address(start)
+    c1, r1 = split_address(end)
+    return [f"{get_column_letter(c)}{r}"
+            for r in range(min(r0, r1), max(r0, r1) + 1) for c in range(min(c0, c1), max(c0, c1) + 1)]
+
+
+def to_number(value):
+    """A value as Excel's arithmetic sees it"""
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, datetime.datetime):
+        delta = value - datetime.datetime.combine(EXCEL_EPOCH, datetime.time())
+        return delta.days + delta.seconds / 86400
+    if isinstance(value, datetime.date):
+        return (value - EXCEL_EPOCH).days
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise FormulaError(f"#VALUE! {value!r} is not a number")
+
+
+def _to_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        if value.upper() in ('TRUE', 'FALSE'):
+            return value.upper() == 'TRUE'
+        raise FormulaError(f"#VALUE! {value!r} is not a condition")
+    return bool(to_number(value))
+
+
+def _numbers(args):
+    """Numbers in function arguments; text and booleans inside ranges are skipped as in SUM"""
+    for arg in args:
+        if isinstance(arg, list):
+            for value in arg:
+                if isinstance(value, (int, float, datetime.date)) and not isinstance(value, bool):
+                    yield to_number(value)
+        else:
+            yield to_number(arg)
+
+
+def _round(value, digits=0):
+    # Excel rounds halves away from zero
+    digits = int(to_number(digits))
+    result = float(Decimal(repr(float(to_number(value)))).quantize(Decimal(1).scaleb(-digits), rounding=ROUND_HALF_UP))
+    return int(result) if digits <= 0 else result
+
+
+def _if(condition, when_true=None, when_false=None):
+    # Arguments are thunks, so only the branch taken is evaluated
+    if _to_bool(condition()):
+        return when_true() if when_true else True
+    return when_false() if when_false else False
+
+
+# Supported functions; those in _LAZY get their arguments as thunks
+FUNCTIONS = {
+    'SUM': lambda *args: sum(_numbers(args)),
+    'MIN': lambda *args: min(_numbers(args), default=0),
+    'MAX': lambda *args: max(_numbers(args), default=0),
+    'ROUND': _round,
+    'IF': _if,
+    'TODAY': lambda: datetime.date.today(),
+}
+_LAZY = {'IF'}
+_VOLATILE = {'TODAY'}
+
+
+def _compare(op, left, right):
+    # Excel orders numbers < text < booleans and compares text case-insensitively
+    def key(value):
+        if isinstance(value, bool):
+            return (2, value)
+        if isinstance(value, str):
+            return (1, value.lower())
+        return (0, to_number(value))
+    left, right = key(left), key(right)
+    if left[0] != right[0]:
+        left, right = (left[0], 0), (right[0], 0)
+    return {
+        '=': left == right, '<>': left != right, '<': left < right,
+        '>': left > right, '<=': left <= right, '>=': left >= right,
+    }[op]
+
+
+def _divide(left, right):
+    right = to_number(right)
+    if right == 0:
+        raise FormulaError('#DIV/0!')
+    return to_number(left) / right
+
+
+_BINARY = {
+    '+': lambda a, b: to_number(a) + to_number(b),
+    '-': lambda a, b: to_number(a) - to_number(b),
+    '*': lambda a, b: to_number(a) * to_number(b),
+    '/': _divide,
+    '^': lambda a, b: to_number(a) ** to_number(b),
+    '&': lambda a, b: _to_text(a) + _to_text(b),
+}
+_COMPARISONS = {'=', '<>', '<', '>', '<=', '>='}
+
+
+class _Parser:
+    """
+    Recursive descent over Excel's precedence: comparison, &, + -, * /, ^,
+    unary minus, %. Produces closures taking a get(address) function, and
+    collects the referenced cells.
+    """
+
+    def __init__(self, formula):
+        self.tokens = self._tokenize(formula)
+        self.position = 0
+        self.references = set()
+        self.volatile = False
+
+    @staticmethod
+    def _tokenize(formula):
+        tokens = []
+        position = 0
+        formula = formula.rstrip()
+        while position < len(formula):
+            match = _TOKEN.match(formula, position)
+            if match is None or match.end() == position:
+                raise FormulaError(f"Unsupported syntax at {formula[position:]!r}")
+            kind = match.lastgroup
+            if kind == 'sheet':
+                raise FormulaError("References to other sheets are not supported")
+            tokens.append((kind, match.group(kind)))
+            position = match.end()
+        return tokens
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def _take(self, value=None):
+        token = self._peek()
+        if token[0] is None or (value is not None and token[1] != value):
+            raise FormulaError(f"Expected {value or 'a value'}")
+        self.position += 1
+        return token
+
+    def parse(self):
+        expression = self._comparison()
+        if self._peek()[0] is not None:
+            raise FormulaError(f"Unexpected {self._peek()[1]!r}")
+        return expression
+
+    def _binary_level(self, operators, operand, apply):
+        left = operand()
+        while self._peek()[0] == 'op' and self._peek()[1] in operators:
+            op = self._take()[1]
+            left = apply(op, left, operand())
+        return left
+
+    def _comparison(self):
+        return self._binary_level(
+            _COMPARISONS, self._concat,
+            lambda op, l, r: lambda get: _compare(op, l(get), r(get)),
+        )
+
+    def _concat(self):
+        return self._binary_level({'&'}, self._additive, self._arithmetic)
+
+    def _additive(self):
+        return self._binary_level({'+', '-'}, self._term, self._arithmetic)
+
+    def _term(self):
+        return self._binary_level({'*', '/'}, self._power, self._arithmetic)
+
+    def _power(self):
+        return self._binary_level({'^'}, self._unary, self._arithmetic)
+
+    @staticmethod
+    def _arithmetic(op, left, right):
+        function = _BINARY[op]
+        return lambda get: function(_scalar(left(get)), _scalar(right(get)))
+
+    def _unary(self):
+        if self._peek() == ('op', '-'):
+            self._take()
+            operand = self._unary()
+            return lambda get: -to_number(_scalar(operand(get)))
+        if self._peek() == ('op', '+'):
+            self._take()
+            return self._unary()
+        return self._percent()
+
+    def _percent(self):
+        operand = self._primary()
+        while self._peek() == ('op', '%'):
+            self._take()
+            operand = (lambda inner: lambda get: to_number(_scalar(inner(get))) / 100)(operand)
+        return operand
+
+    def _primary(self):
+        kind, value = self._take()
+        if kind == 'number':
+            number = int(value) if value.isdigit() else float(value)
+            return lambda get: number
+        if kind == 'string':
+            text = value[1:-1].replace('""', '"')
+            return lambda get: text
+        if kind == 'bool':
+            flag = value == 'TRUE'
+            return lambda get: flag
+        if kind == 'cell':
+            address = _plain(value)
+            self.references.add(address)
+            return lambda get: get(address)
+        if kind == 'range':
+            start, end = value.split(':')
+            cells = _range_cells(_plain(start), _plain(end))
+            self.references.update(cells)
+            return lambda get: [get(address) for address in cells]
+        if kind == 'function':
+            return self._call(value)
+        if (kind, value) == ('op', '('):
+            inner = self._comparison()
+            self._take(')')
+            return inner
+        raise FormulaError(f"Unexpected {value!r}")
+
+    def _call(self, name):
+        if name not in FUNCTIONS:
+            raise FormulaError(f"Unsupported function {name}")
+        if name in _VOLATILE:
+            self.volatile = True
+        args = []
+        if self._peek() != ('op', ')'):
+            while True:
+                args.append(self._comparison())
+                if self._peek() != ('op', ','):
+                    break
+                self._take(',')
+        self._take(')')
+        function = FUNCTIONS[name]
+        if name in _LAZY:
+            return lambda get: function(*[(lambda a: lambda: _scalar(a(get)))(arg) for arg in args])
+        return lambda get: function(*[arg(get) for arg in args])
+
+
+def _scalar(value):
+    if isinstance(value, list):
+        raise FormulaError("A range is only supported as a function argument")
+    return value
+
+
+def compile_formula(formula):
+    """
+    Compile a formula (with or without the leading '=') into (evaluate,
+    references, volatile): evaluate(get) computes it from get(address).
+    Raises FormulaError outside the supported subset.
+    """
+    parser = _Parser(formula[1:] if formula.startswith('=') else formula)
+    return parser.parse(), parser.references, parser.volatile
+
+
+class FormulaGraph:
+    """
+    The formula cells of one sheet, compiled, with the cells each one reads
+    and the reverse edges. constants holds the sheet's other values. Formulas
+    that cannot be compiled, or that sit on a reference cycle, are opaque:
+    their value is always None.
+    """
+
+    def __init__(self, formulas, constants=None):
+        self.constants = dict(constants or {})
+        self.compiled = {}
+        self.opaque = set()
+        self.volatile = set()
+        self.dependents = {}
+        for address, formula in formulas.items():
+            try:
+                evaluate, references, volatile = compile_formula(formula)
+            except FormulaError:
+                self.opaque.add(address)
+                continue
+            self.compiled[address] = (evaluate, references)
+            if volatile:
+                self.volatile.add(address)
+            for reference in references:
+                self.dependents.setdefault(reference, set()).add(address)
+        self.order = self._topological_order()
+        self._baseline = None
+
+    @classmethod
+    def from_sheet(cls, ws):
+        """Graph of an openpyxl worksheet (shared formulas come already expanded)"""
+        formulas, constants = {}, {}
+        for row in ws.iter_rows():
+            for cell in row:
+                if isinstance(cell.value, str) and cell.value.startswith('='):
+                    formulas[cell.coordinate] = cell.value
+                elif cell.value is not None:
+                    constants[cell.coordinate] = cell.value
+        return cls(formulas, constants)
+
+    def _topological_order(self):
+        order = []
+        state = {}
+        for root in sorted(self.compiled):
+            if root in state:
+                continue
+            # Iterative depth-first search; cells on a cycle become opaque
+            stack = [(root, iter(sorted(self.compiled[root][1])))]
+            state[root] = 'active'
+            while stack:
+                address, references = stack[-1]
+                for reference in references:
+                    if reference not in self.compiled:
+                        continue
+                    if state.get(reference) == 'active':
+                        self.opaque.update(a for a, _ in stack)
+                    elif reference not in state:
+                        state[reference] = 'active'
+                        stack.append((reference, iter(sorted(self.compiled[reference][1]))))
+                        break
+                else:
+                    stack.pop()
+                    state[address] = 'done'
+                    order.append(address)
+        return [address for address in order if address not in self.opaque]
+
+    def downstream(self, changed):
+        """Formula cells whose value depends on any of the changed cells, or is volatile or opaque"""
+        affected = set(self.volatile) | set(self.opaque)
+        pending = [_plain(address).upper() for address in changed] + list(affected)
+        while pending:
+            for dependent in self.dependents.get(pending.pop(), ()):
+                if dependent not in affected:
+                    affected.add(dependent)
+                    pending.append(dependent)
+        return affected
+
+    def recalculate(self, inputs, changed=None):
+        """
+        Values of the formula cells downstream of changed (every formula cell
+        when changed is None), with inputs {address: value} overriding the
+        sheet's constants. The other formula cells are read from a full
+        calculation of the sheet as it stands, so changed must hold every
+        input that differs from the sheet. Cells that cannot be computed, or
+        are computed from one that cannot, are None. Formula cells
+        overwritten by inputs are left out.
+        """
+        inputs = {_plain(address).upper(): value for address, value in inputs.items()}
+        if changed is None:
+            return self._evaluate(inputs)[0]
+        if self._baseline is None:
+            self._baseline = self._evaluate({})
+        baseline, baseline_failed = self._baseline
+        return self._evaluate(inputs, self.downstream(changed), baseline, baseline_failed)[0]
+
+    def _evaluate(self, inputs, affected=None, seed=None, seed_failed=()):
+        """
+        (results, failed) of computing the formula cells in affected (all when
+        None) in dependency order; the others are read from seed and count as
+        failed when in seed_failed.
+        """
+        results = {}
+        failed = (self.opaque | set(seed_failed)) - set(inputs)
+
+        def get(address):
+            if address in failed:
+                raise FormulaError(f"{address} could not be computed")
+            if address in results:
+                return results[address]
+            if address in inputs:
+                return inputs[address]
+            if seed is not None and address in seed:
+                return seed[address]
+            return self.constants.get(address)
+
+        for address in self.order:
+            if address in inputs or (affected is not None and address not in affected):
+                continue
+            evaluate, _ = self.compiled[address]
+            try:
+                value = evaluate(get)
+                if isinstance(value, list):
+                    raise FormulaError("A formula cannot return a range")
+                results[address] = value
+                failed.discard(address)
+            except (FormulaError, ArithmeticError, ValueError, TypeError):
+                failed.add(address)
+                results[address] = None
+        for address in self.opaque - set(inputs):
+            results[address] = None
+        return results, failed
+
+
+_graphs = {}
+_lock = threading.Lock()
+
+
+def get_formula_graph(template_path):
+    """The FormulaGraph of a template's first sheet, built once per template version"""
+    path = os.path.abspath(template_path)
+    key = (path, os.path.getmtime(path))
+    with _lock:
+        graph = _graphs.get(key)
+    if graph is None:
+        graph = FormulaGraph.from_sheet(template_cache.get_workbook(template_path).worksheets[0])
+        with _lock:
+            for stale in [k for k in _graphs if k[0] == path]:
+                del _graphs[stale]
+            _graphs[key] = graph
+    return graph
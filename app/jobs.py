@@ -0,0 +1,413 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+from .artifacts import artifact_store
+from .data_extraction import extract_data_from_pdf
+from .processing import generate_artifact
+
+# Worker threads per process running queued /process jobs
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# Optional SQLite file holding the queue so jobs and results are shared by all workers
+JOB_QUEUE_DB = os.environ.get('JOB_QUEUE_DB', '')
+# Seconds finished jobs are kept; their files expire with ARTIFACT_TTL
+JOB_TTL = float(os.environ.get('JOB_TTL', 3600))
+# Seconds between the heartbeats a worker sends while it runs a job
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', 10))
+# Seconds without a heartbeat after which a running job's worker is presumed dead and the job failed
+JOB_LEASE_TIMEOUT = float(os.environ.get('JOB_LEASE_TIMEOUT', 60))
+# Longest a /jobs/<job_id>/events stream stays open
+JOB_EVENTS_TIMEOUT = float(os.environ.get('JOB_EVENTS_TIMEOUT', 600))
+
+# Error of a job whose worker stopped sending heartbeats
+LOST_WORKER_ERROR = 'The worker running this job stopped'
+
+
+class MemoryJobQueue:
+    """Job queue and result store held in this process"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.pending = queue.Queue()
+        self._lock = threading.Lock()
+
+    def submit(self, params, pdf_content):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self.jobs[job_id] = {
+                'id': job_id,
+                'status': 'queued',
+                'stage': 'queued',
+                'stages': [{'stage': 'queued', 'at': now}],
+                'params': params,
+                'input': pdf_content,
+                'data': None,
+                'error': None,
+                'token': None,
+                'created': now,
+                'updated': now,
+                'heartbeat': None,
+            }
+        self.pending.put(job_id)
+        return job_id
+
+    def claim(self, timeout=1.0):
+        try:
+            job_id = self.pending.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job['status'] = 'running'
+            job['heartbeat'] = time.time()
+            return job_id, job['params'], job['input']
+
+    def set_stage(self, job_id, stage):
+        with self._lock:
+            job = self.jobs[job_id]
+            now = time.time()
+            job['stage'] = stage
+            job['stages'].append({'stage': stage, 'at': now})
+            job['updated'] = job['heartbeat'] = now
+
+    def heartbeat(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is not None and job['status'] == 'running':
+                job['heartbeat'] = time.time()
+
+    def _expire(self, job):
+        """Fail a running job whose heartbeat is older than JOB_LEASE_TIMEOUT; call with the lock held"""
+        now = time.time()
+        if job['status'] != 'running' or job['heartbeat'] >= now - JOB_LEASE_TIMEOUT:
+            return
+        job.update({'status': 'error', 'stage': 'done', 'error': LOST_WORKER_ERROR, 'input': None, 'updated': now})
+        job['stages'].append({'stage': 'done', 'at': now})
+
+    def expire_stale(self):
+        with self._lock:
+            for job in self.jobs.values():
+                self._expire(job)
+
+    def finish(self, job_id, data, token, error=None):
+        with self._lock:
+            job = self.jobs[job_id]
+            now = time.time()
+            job.update({
+                'status': 'error' if error else 'done',
+                'stage': 'done',
+                'data': data,
+                'error': error,
+                'token': token,
+                'input': None,
+                'updated': now,
+            })
+            job['stages'].append({'stage': 'done', 'at': now})
+
+    def get(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            self._expire(job)
+            return _public(job)
+
+    def get_token(self, job_id):
+        """Artifact store token of a finished job's files, or None"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return job['token'] if job else None
+
+    def purge(self):
+        self.expire_stale()
+        cutoff = time.time() - JOB_TTL
+        with self._lock:
+            for job_id in [j['id'] for j in self.jobs.values() if j['status'] in ('done', 'error') and j['updated'] < cutoff]:
+                del self.jobs[job_id]
+
+
+class SqliteJobQueue:
+    """
+    Job queue and result store in a SQLite file. Any gunicorn worker can
+    claim a job, report its status or serve its artifacts.
+    """
+
+    # Columns added since the table was first created, with their types
+    ADDED_COLUMNS = {'token': 'TEXT', 'heartbeat': 'REAL'}
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._execute('PRAGMA journal_mode=WAL')
+        self._execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT NOT NULL, stages TEXT NOT NULL, '
+            'params TEXT NOT NULL, input BLOB, data TEXT, error TEXT, token TEXT, '
+            'created REAL NOT NULL, updated REAL NOT NULL, heartbeat REAL)'
+        )
+        self._add_columns()
+
+    def _add_columns(self):
+        """Bring a queue file created by an older version up to the current columns"""
+        conn = self._connect()
+        try:
+            existing = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column, column_type in self.ADDED_COLUMNS.items():
+                if column not in existing:
+                    try:
+                        conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+                    except sqlite3.OperationalError:
+                        # Added meanwhile by another worker
+                        pass
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+
+    def _execute(self, sql, params=()):
+        conn = self._connect()
+        try:
+            return conn.execute(sql, params).fetchone()
+        finally:
+            conn.close()
+
+    def submit(self, params, pdf_content):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._execute(
+            'INSERT INTO jobs (id, status, stage, stages, params, input, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (job_id, 'queued', 'queued', json.dumps([{'stage': 'queued', 'at': now}]), json.dumps(params), pdf_content, now, now),
+        )
+        return job_id
+
+    def claim(self, timeout=1.0):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT id, params, input FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1").fetchone()
+            if row:
+                now = time.time()
+                conn.execute("UPDATE jobs SET status = 'running', updated = ?, heartbeat = ? WHERE id = ?", (now, now, row[0]))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        if not row:
+            time.sleep(timeout)
+            return None
+        return row[0], json.loads(row[1]), row[2]
+
+    def set_stage(self, job_id, stage):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            stages = json.loads(conn.execute('SELECT stages FROM jobs WHERE id = ?', (job_id,)).fetchone()[0])
+            now = time.time()
+            stages.append({'stage': stage, 'at': now})
+            conn.execute('UPDATE jobs SET stage = ?, stages = ?, updated = ?, heartbeat = ? WHERE id = ?',
+                         (stage, json.dumps(stages), now, now, job_id))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def heartbeat(self, job_id):
+        self._execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = 'running'", (time.time(), job_id))
+
+    def expire_stale(self, job_id=None):
+        """Fail running jobs (or just job_id) whose heartbeat is older than JOB_LEASE_TIMEOUT"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            sql = "SELECT id, stages FROM jobs WHERE status = 'running' AND heartbeat < ?"
+            params = (now - JOB_LEASE_TIMEOUT,)
+            if job_id is not None:
+                sql += ' AND id = ?'
+                params += (job_id,)
+            for stale_id, stages in conn.execute(sql, params).fetchall():
+                stages = json.loads(stages) + [{'stage': 'done', 'at': now}]
+                conn.execute(
+                    "UPDATE jobs SET status = 'error', stage = 'done', stages = ?, error = ?, input = NULL, updated = ? "
+                    "WHERE id = ?",
+                    (json.dumps(stages), LOST_WORKER_ERROR, now, stale_id),
+                )
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def finish(self, job_id, data, token, error=None):
+        self.set_stage(job_id, 'done')
+        self._execute(
+            'UPDATE jobs SET status = ?, data = ?, error = ?, token = ?, input = NULL, updated = ? WHERE id = ?',
+            ('error' if error else 'done', json.dumps(data, ensure_ascii=False), error, token, time.time(), job_id),
+        )
+
+    def get(self, job_id):
+        row = self._select(job_id)
+        if row is not None and row[1] == 'running' and (row[10] or 0) < time.time() - JOB_LEASE_TIMEOUT:
+            self.expire_stale(job_id)
+            row = self._select(job_id)
+        if row is None:
+            return None
+        return _public({
+            'id': row[0],
+            'status': row[1],
+            'stage': row[2],
+            'stages': json.loads(row[3]),
+            'params': json.loads(row[4]),
+            'data': json.loads(row[5]) if row[5] else None,
+            'error': row[6],
+            'token': row[7],
+            'created': row[8],
+            'updated': row[9],
+        })
+
+    def _select(self, job_id):
+        return self._execute(
+            'SELECT id, status, stage, stages, params, data, error, token, created, updated, heartbeat '
+            'FROM jobs WHERE id = ?',
+            (job_id,),
+        )
+
+    def get_token(self, job_id):
+        """Artifact store token of a finished job's files, or None"""
+        row = self._execute('SELECT token FROM jobs WHERE id = ?', (job_id,))
+        return row[0] if row else None
+
+    def purge(self):
+        self.expire_stale()
+        self._execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'error') AND updated < ?",
+            (time.time() - JOB_TTL,),
+        )
+
+
+def _public(job):
+    """Job status without the input, with the kinds of file still downloadable"""
+    kinds = artifact_store.kinds(job['token'])
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'stages': list(job['stages']),
+        'params': job['params'],
+        'data': job['data'],
+        'error': job['error'],
+        'has_excel': 'excel' in kinds,
+        'has_pdf': 'pdf' in kinds,
+        'created': job['created'],
+        'updated': job['updated'],
+    }
+
+
+def _send_heartbeats(job_queue, job_id, stop):
+    while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+        try:
+            job_queue.heartbeat(job_id)
+        except Exception as e:
+            print(f"Error sending heartbeat for job {job_id}: {str(e)}")
+
+
+def run_job(job_queue, job_id, params, pdf_content):
+    """
+    Extract, fill, calculate and export one job, reporting each stage. A
+    heartbeat is sent every JOB_HEARTBEAT_INTERVAL seconds meanwhile, so a job
+    whose worker process dies is failed after JOB_LEASE_TIMEOUT.
+    """
+    stop = threading.Event()
+    threading.Thread(target=_send_heartbeats, args=(job_queue, job_id, stop), daemon=True).start()
+    try:
+        _run_job(job_queue, job_id, params, pdf_content)
+    finally:
+        stop.set()
+
+
+def _run_job(job_queue, job_id, params, pdf_content):
+    data = None
+    try:
+        job_queue.set_stage(job_id, 'extract')
+        data = extract_data_from_pdf(pdf_content, params['pdf_type'])
+        # The files go to the artifact store, as for synchronous requests, and expire with it
+        token = None
+        if params['template_file']:
+            token = generate_artifact(
+                data,
+                params['pdf_type'],
+                params['template_file'],
+                params['freight_number'],
+                params['container_type'],
+                params['num_containers'],
+                progress=lambda stage: job_queue.set_stage(job_id, stage),
+            )
+        error = None
+        if params['template_file'] and token is None:
+            error = 'Excel generation failed'
+        job_queue.finish(job_id, data, token, error)
+    except Exception as e:
+        print(f"Error running job {job_id}: {str(e)}")
+        job_queue.finish(job_id, data, None, str(e))
+
+
+def _worker(job_queue):
+    while True:
+        try:
+            claimed = job_queue.claim()
+        except Exception as e:
+            print(f"Error claiming job: {str(e)}")
+            time.sleep(1)
+            continue
+        if claimed is None:
+            continue
+        run_job(job_queue, *claimed)
+
+
+_job_queue = None
+_lock = threading.Lock()
+
+def get_job_queue():
+    """Return this process's job queue, starting its worker threads on first use"""
+    global _job_queue
+    with _lock:
+        if _job_queue is None:
+            _job_queue = SqliteJobQueue(JOB_QUEUE_DB) if JOB_QUEUE_DB else MemoryJobQueue()
+            for _ in range(JOB_WORKERS):
+                threading.Thread(target=_worker, args=(_job_queue,), daemon=True).start()
+        return _job_queue
+
+def submit_job(params, pdf_content):
+    """Queue a /process job and return its id"""
+    job_queue = get_job_queue()
+    job_queue.purge()
+    return job_queue.submit(params, pdf_content)
+
+def job_events(job_id, poll_interval=0.25, timeout=None):
+    """
+    Yield Server-Sent Events for each stage change until the job finishes, or
+    a timeout event after timeout (JOB_EVENTS_TIMEOUT) seconds
+    """
+    job_queue = get_job_queue()
+    deadline = time.monotonic() + (JOB_EVENTS_TIMEOUT if timeout is None else timeout)
+    sent = 0
+    while True:
+        job = job_queue.get(job_id)
+        if job is None:
+            yield f"event: error\ndata: {json.dumps({'error': 'Unknown job'})}\n\n"
+            return
+        for entry in job['stages'][sent:]:
+            yield f"event: stage\ndata: {json.dumps(entry)}\n\n"
+        sent = len(job['stages'])
+        if job['status'] in ('done', 'error'):
+            payload = {'status': job['status'], 'error': job['error']}
+            yield f"event: {job['status']}\ndata: {json.dumps(payload)}\n\n"
+            return
+        if time.monotonic() >= deadline:
+            # The client reconnects or falls back to polling the status URL
+            yield f"event: timeout\ndata: {json.dumps({'status': job['status'], 'stage': job['stage']})}\n\n"
+            return
+        time.sleep(poll_interval)
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import pdfplumber
+
+# Set LAYOUT_EXTRACTION=0 to always extract from the full page text
+LAYOUT_EXTRACTION = os.environ.get('LAYOUT_EXTRACTION', '1') != '0'
+# Number of layouts (fingerprints) remembered per process
+LAYOUT_CACHE_SIZE = int(os.environ.get('LAYOUT_CACHE_SIZE', 256))
+# Label positions are rounded to this grid (PDF points) when fingerprinting
+LAYOUT_GRID = float(os.environ.get('LAYOUT_GRID', 6))
+
+# Header labels whose positions on the first page identify an issuer layout
+LAYOUT_LABELS = [
+    'FERI N°', 'A.D N°', 'IMPORTATEUR', 'EXPORTATEUR', 'TRANSITAIRE', 'TITRE DE TRANSPORT',
+    'DEST. FINALE', 'BL', 'ARMATEUR', 'CBM', 'POIDS BRUT',
+]
+_LABEL_PATTERNS = [(label, re.compile(r'(?<!\w)' + re.escape(label) + r'(?!\w)')) for label in LAYOUT_LABELS]
+
+# A first page with fewer of the labels than this is not fingerprinted
+MIN_LABELS = 3
+# Boxes start this many points left of and above a field's label
+BOX_PAD = 1.5
+
+
+class FirstPage:
+    """
+    The first page of a PDF opened with pypdfium2, for cheap layout work:
+    fingerprinting from label positions and reading the text inside boxes.
+    Boxes are (x0, top, x1, bottom) in points from the top-left corner, as in
+    pdfplumber.
+    """
+
+    def __init__(self, pdf_content):
+        import pypdfium2 as pdfium
+
+        if hasattr(pdf_content, 'seek'):
+            pdf_content.seek(0)
+        self.pdf = pdfium.PdfDocument(pdf_content)
+        self.page = None
+        self.textpage = None
+        try:
+            self.page = self.pdf[0]
+            self.width, self.height = self.page.get_size()
+            self.textpage = self.page.get_textpage()
+        except Exception:
+            self.close()
+            raise
+
+    def fingerprint(self):
+        """Hash of the page size and rounded label positions, or None for too few labels"""
+        # One text read indexed like the page's characters, instead of a pdfium search per label
+        text = self.textpage.get_text_range(0, self.textpage.count_chars(), force_this=True)
+        features = []
+        for label, pattern in _LABEL_PATTERNS:
+            found = pattern.search(text)
+            if found:
+                left, bottom, right, top = self.textpage.get_charbox(found.start())
+                features.append((label, round(left / LAYOUT_GRID), round((self.height - top) / LAYOUT_GRID)))
+        if len(features) < MIN_LABELS:
+            return None
+        features.append((round(self.width), round(self.height)))
+        return hashlib.sha1(repr(features).encode('utf-8')).hexdigest()[:16]
+
+    def text(self, box):
+        """Text inside box, with line breaks flattened to spaces like the full-text path"""
+        x0, top, x1, bottom = box
+        text = self.textpage.get_text_bounded(left=x0, bottom=self.height - bottom, right=x1, top=self.height - top)
+        return text.replace('\r\n', ' ').replace('\r', ' ').replace('\n', ' ')
+
+    def page_text(self):
+        """Text of the whole page, as the pypdfium2 text tier reads it"""
+        return self.textpage.get_text_bounded().replace('\r\n', '\n').replace('\r', '\n')
+
+    def close(self):
+        for handle in (self.textpage, self.page, self.pdf):
+            if handle is not None:
+                handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def find_boxes(pdf_content, patterns):
+    """
+    Locate fields on the first page with pdfplumber's page.search. patterns
+    maps a field name to its compiled regexes, tried in order. Each box spans
+    the first match from its label to the right edge of the page, plus one
+    line below for values that wrap or patterns that look ahead to the next
+    label. Fields that are not matched on the first page have no box.
+    """
+    if hasattr(pdf_content, 'seek'):
+        pdf_content.seek(0)
+    else:
+        pdf_content = BytesIO(pdf_content)
+    boxes = {}
+    with pdfplumber.open(pdf_content) as pdf:
+        page = pdf.pages[0]
+        for name, field_patterns in patterns.items():
+            for pattern in field_patterns:
+                matches = page.search(pattern, return_groups=False)
+                if not matches:
+                    continue
+                match = matches[0]
+                first_char = match['chars'][0]
+                line_height = first_char['bottom'] - first_char['top']
+                boxes[name] = (
+                    max(0, match['x0'] - BOX_PAD),
+                    max(0, match['top'] - BOX_PAD),
+                    page.width,
+                    min(page.height, match['bottom'] + line_height * 1.5),
+                )
+                break
+    return boxes
+
+
+class LayoutCache:
+    """
+    LRU of field boxes per (pdf_type, fingerprint). A layout whose fields
+    could not all be boxed is stored as None, so it is not learned again.
+    """
+
+    def __init__(self, max_entries=LAYOUT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """(known, boxes) for a layout key; boxes is None for unusable layouts"""
+        with self._lock:
+            if key not in self.entries:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, self.entries[key]
+
+    def put(self, key, boxes):
+        with self._lock:
+            self.entries[key] = boxes
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'layouts': len(self.entries),
+                'usable': sum(1 for boxes in self.entries.values() if boxes),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+layout_cache = LayoutCache()
@@ -0,0 +1,316 @@
+import atexit
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+
+# SQLite file aggregating metrics from every worker process (e.g. /dev/shm/proforma_metrics.db);
+# in-process only when empty
+METRICS_DB = os.environ.get('METRICS_DB', '')
+
+# Seconds samples are buffered in each process before being added to METRICS_DB; 0 writes every sample
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '1'))
+
+# Histogram buckets in seconds, from regex parsing up to a full Selenium run
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 180)
+
+# name -> (type, help)
+METRICS = {
+    'proforma_operation_duration_seconds': ('histogram', 'End-to-end duration of an operation'),
+    'proforma_stage_duration_seconds': ('histogram', 'Duration of each stage of an operation'),
+    'proforma_errors_total': ('counter', 'Operations that failed, by the stage they failed in'),
+    'proforma_input_bytes_total': ('counter', 'Bytes of uploaded PDFs'),
+    'proforma_output_bytes_total': ('counter', 'Bytes of generated Excel and PDF files'),
+}
+
+
+def _key(labels):
+    return json.dumps(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def histogram_rows(name, value, labels):
+    """Rows (sample name, labels key, increment) for one histogram observation"""
+    rows = []
+    for bound in DURATION_BUCKETS + (math.inf,):
+        if value <= bound:
+            rows.append((f"{name}_bucket", _key(dict(labels, le='+Inf' if bound == math.inf else repr(float(bound)))), 1))
+    rows.append((f"{name}_sum", _key(labels), value))
+    rows.append((f"{name}_count", _key(labels), 1))
+    return rows
+
+
+class MemoryMetricsStore:
+    """Samples held in this process"""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, rows):
+        with self._lock:
+            for name, labels, value in rows:
+                self.samples[(name, labels)] = self.samples.get((name, labels), 0) + value
+
+    def collect(self):
+        with self._lock:
+            return [(name, labels, value) for (name, labels), value in self.samples.items()]
+
+    def take(self):
+        """Collect the samples and start again from zero"""
+        with self._lock:
+            samples, self.samples = self.samples, {}
+        return [(name, labels, value) for (name, labels), value in samples.items()]
+
+
+class SqliteMetricsStore:
+    """
+    Samples in a SQLite file. Every worker adds its increments to the same
+    rows, so any worker can serve /metrics for the whole service.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS samples ('
+                'name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (name, labels))'
+            )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+
+    def add(self, rows):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                'INSERT INTO samples (name, labels, value) VALUES (?, ?, ?) '
+                'ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value',
+                rows,
+            )
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def collect(self):
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT name, labels, value FROM samples').fetchall()
+        finally:
+            conn.close()
+
+
+class BufferedMetricsStore:
+    """
+    Increments summed in this process and added to another store by a
+    background thread every interval seconds, so recording a sample never
+    waits on the shared file. collect() flushes first, so the process serving
+    a scrape always includes its own latest samples. A forked child starts
+    with an empty buffer; its parent still flushes what it had buffered.
+    """
+
+    def __init__(self, store, interval=METRICS_FLUSH_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self._closed = threading.Event()
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self._try_flush)
+
+    def _reset(self):
+        self.pending = MemoryMetricsStore()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            self._try_flush()
+
+    def _try_flush(self):
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            print(f"Error recording metrics: {str(e)}")
+
+    def add(self, rows):
+        if self._thread is None:
+            with self._flush_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+                    self._thread.start()
+        self.pending.add(rows)
+
+    def flush(self):
+        """Add the buffered increments to the store now"""
+        with self._flush_lock:
+            rows = self.pending.take()
+            if not rows:
+                return
+            try:
+                self.store.add(rows)
+            except Exception:
+                self.pending.add(rows)  # retried on the next flush
+                raise
+
+    def collect(self):
+        self.flush()
+        return self.store.collect()
+
+    def close(self):
+        """Flush and stop the background thread"""
+        self._closed.set()
+        self.flush()
+
+
+class Metrics:
+    """Counters and histograms recorded into a metrics store"""
+
+    def __init__(self, db_path=METRICS_DB, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self._store = None
+        self._lock = threading.Lock()
+
+    @property
+    def store(self):
+        with self._lock:
+            if self._store is None:
+                try:
+                    if not self.db_path:
+                        self._store = MemoryMetricsStore()
+                    elif self.flush_interval > 0:
+                        self._store = BufferedMetricsStore(SqliteMetricsStore(self.db_path), self.flush_interval)
+                    else:
+                        self._store = SqliteMetricsStore(self.db_path)
+                except sqlite3.Error as e:
+                    print(f"Error opening metrics database, keeping metrics in memory: {str(e)}")
+                    self._store = MemoryMetricsStore()
+            return self._store
+
+    def record(self, rows):
+        if not rows:
+            return
+        try:
+            self.store.add(rows)
+        except sqlite3.Error as e:
+            print(f"Error recording metrics: {str(e)}")
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter"""
+        self.record([(name, _key(labels), value)])
+
+    def observe(self, name, value, **labels):
+        """Record one histogram observation"""
+        self.record(histogram_rows(name, value, labels))
+
+    def render(self):
+        """All samples in the Prometheus text exposition format"""
+        samples = {}
+        for name, labels, value in self.store.collect():
+            samples.setdefault(name, []).append((json.loads(labels), value))
+
+        lines = []
+        for metric, (kind, help_text) in METRICS.items():
+            names = [f"{metric}_bucket", f"{metric}_sum", f"{metric}_count"] if kind == 'histogram' else [metric]
+            if not any(name in samples for name in names):
+                continue
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for name in names:
+                for labels, value in sorted(samples.get(name, []), key=_sort_key):
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _sort_key(sample):
+    labels = dict(sample[0])
+    le = labels.pop('le', None)
+    return sorted(labels.items()), float(le) if le is not None else 0.0
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# Shared registry used by the timing hooks and the /metrics route
+metrics = Metrics()
+
+
+class StageTimer:
+    """
+    Times the stages of one operation and records them when finished.
+
+    Call the timer with a stage name to start that stage (ending the previous
+    one), so it can be passed anywhere a progress callback is expected. add()
+    accumulates time measured elsewhere. Used as a context manager, an
+    exception counts as an error in the current stage and the timings are
+    recorded on exit.
+    """
+
+    def __init__(self, operation, **labels):
+        self.operation = operation
+        self.labels = labels
+        self.stages = {}
+        self.current = None
+        self.failed = False
+        self._started = time.perf_counter()
+        self._stage_started = None
+
+    def __call__(self, stage):
+        self.end()
+        self.current = stage
+        self._stage_started = time.perf_counter()
+
+    def end(self):
+        """End the current stage"""
+        if self.current is not None:
+            self.add(self.current, time.perf_counter() - self._stage_started)
+            self.current = None
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def error(self, stage=None):
+        """Count a failure in stage (default: the current stage)"""
+        self.failed = True
+        metrics.inc(
+            'proforma_errors_total', operation=self.operation,
+            stage=stage or self.current or 'unknown', **self.labels
+        )
+
+    def finish(self):
+        """Record the operation and stage durations"""
+        self.end()
+        labels = dict(self.labels, operation=self.operation)
+        rows = histogram_rows('proforma_operation_duration_seconds', time.perf_counter() - self._started,
+                              dict(labels, status='error' if self.failed else 'ok'))
+        for stage, seconds in self.stages.items():
+            rows += histogram_rows('proforma_stage_duration_seconds', seconds, dict(labels, stage=stage))
+        metrics.record(rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.error()
+        self.finish()
+        return False
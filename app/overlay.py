@@ -0,0 +1,283 @@
+import datetime
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from io import BytesIO
+
+from openpyxl.utils import get_column_letter
+
+from .formulas import FormulaGraph, get_formula_graph, split_address
+from .template_cache import template_cache
+
+# Where rendered base PDFs are kept so every worker can reuse them
+OVERLAY_CACHE_DIR = os.environ.get('OVERLAY_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'proforma_overlay'))
+
+# Cells written by the insert_data functions. Formula cells and TODAY() are
+# always treated as dynamic as well, since their value depends on these.
+DYNAMIC_CELLS = ['E6', 'B8', 'B10', 'B11', 'B14', 'D14', 'E14', 'D17', 'D18']
+
+# reportlab has no Calibri / Tw Cen MT; map everything to Helvetica
+FONT_REGULAR = 'Helvetica'
+FONT_BOLD = 'Helvetica-Bold'
+
+_base_pdfs = {}
+_layouts = {}
+_lock = threading.Lock()
+
+
+def dynamic_cells(ws):
+    """Return the cells that are drawn per request instead of baked into the base PDF"""
+    cells = list(DYNAMIC_CELLS)
+    for row in ws.iter_rows():
+        for cell in row:
+            if isinstance(cell.value, str) and cell.value.startswith('=') and cell.coordinate not in cells:
+                cells.append(cell.coordinate)
+    return cells
+
+
+def _cache_key(template_path):
+    path = os.path.abspath(template_path)
+    return path, os.path.getmtime(path)
+
+
+def get_base_pdf(template_path):
+    """
+    Return the template rendered to PDF with every dynamic cell blanked.
+    Rendered once per template version and kept in memory and on disk.
+    """
+    key = _cache_key(template_path)
+    with _lock:
+        if key in _base_pdfs:
+            return _base_pdfs[key]
+
+    name = re.sub(r'[^\w\-]', '_', os.path.basename(key[0]))
+    disk_path = os.path.join(OVERLAY_CACHE_DIR, f"{name}_{int(key[1])}.pdf")
+    if os.path.exists(disk_path):
+        with open(disk_path, 'rb') as f:
+            data = f.read()
+    else:
+        data = _render_base_pdf(template_path)
+        os.makedirs(OVERLAY_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{disk_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, disk_path)
+
+    with _lock:
+        _base_pdfs[key] = data
+    return data
+
+
+def _render_base_pdf(template_path):
+    from .converter import convert_to_pdf
+
+    wb = template_cache.get_workbook(template_path)
+    ws = wb.worksheets[0]
+    for address in dynamic_cells(ws):
+        ws[address].value = None
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        excel_path = os.path.join(temp_dir, 'base.xlsx')
+        pdf_path = os.path.join(temp_dir, 'base.pdf')
+        wb.save(excel_path)
+        convert_to_pdf(excel_path, pdf_path)
+        with open(pdf_path, 'rb') as f:
+            return f.read()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _column_points(width):
+    # Excel column width is in characters of the default font; 7px per char
+    # plus 5px padding, 0.75pt per px
+    return (int(width * 7 + 0.5) + 5) * 0.75
+
+
+def _load_calibration(template_path):
+    """Read <template>.overlay.json next to the template if present"""
+    path = os.path.splitext(template_path)[0] + '.overlay.json'
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def get_layout(template_path, ws, page_width, page_height):
+    """
+    Return {cell: (x0, y0, x1, y1, scale)} in PDF points for every dynamic cell.
+
+    Boxes are computed from the sheet's column widths, row heights, margins and
+    print scale, then adjusted by the optional calibration file, which may hold
+    an "offset" [dx, dy], a "scale" override and explicit "cells" boxes.
+    """
+    key = _cache_key(template_path) + (page_width, page_height)
+    with _lock:
+        if key in _layouts:
+            return _layouts[key]
+
+    calibration = _load_calibration(template_path)
+
+    default_width = ws.sheet_format.defaultColWidth or 8.43
+    default_height = ws.sheet_format.defaultRowHeight or 15
+
+    def col_width(index):
+        dim = ws.column_dimensions.get(get_column_letter(index))
+        return _column_points(dim.width if dim is not None and dim.width else default_width)
+
+    def row_height(index):
+        dim = ws.row_dimensions.get(index)
+        return dim.height if dim is not None and dim.height else default_height
+
+    max_col = ws.max_column
+    col_edges = [0.0]
+    for i in range(1, max_col + 2):
+        col_edges.append(col_edges[-1] + col_width(i))
+    row_edges = [0.0]
+    for i in range(1, ws.max_row + 2):
+        row_edges.append(row_edges[-1] + row_height(i))
+
+    margins = ws.page_margins
+    left = (margins.left or 0.7) * 72
+    top = (margins.top or 0.75) * 72
+    right = (margins.right or 0.7) * 72
+
+    scale = (ws.page_setup.scale or 100) / 100
+    if ws.sheet_properties.pageSetUpPr is not None and ws.sheet_properties.pageSetUpPr.fitToPage:
+        scale = min(1, (page_width - left - right) / col_edges[max_col])
+    scale = calibration.get('scale', scale)
+
+    if ws.print_options.horizontalCentered:
+        left = (page_width - col_edges[max_col] * scale) / 2
+    dx, dy = calibration.get('offset', [0, 0])
+
+    merged = {}
+    for rng in ws.merged_cells.ranges:
+        merged[f"{get_column_letter(rng.min_col)}{rng.min_row}"] = rng.bounds
+
+    layout = {}
+    explicit = calibration.get('cells', {})
+    for address in dynamic_cells(ws):
+        if address in explicit:
+            x0, y0, x1, y1 = explicit[address]
+            layout[address] = (x0, y0, x1, y1, scale)
+            continue
+        col, row = split_address(address)
+        min_col, min_row, max_col_, max_row = merged.get(address, (col, row, col, row))
+        x0 = left + col_edges[min_col - 1] * scale + dx
+        x1 = left + col_edges[max_col_] * scale + dx
+        y1 = page_height - top - row_edges[min_row - 1] * scale + dy
+        y0 = page_height - top - row_edges[max_row] * scale + dy
+        layout[address] = (x0, y0, x1, y1, scale)
+
+    with _lock:
+        _layouts[key] = layout
+    return layout
+
+
+def evaluate_formulas(ws, template_path=None):
+    """
+    Values of the sheet's formula cells, computed by the formula engine from
+    the values now in the dynamic cells. The formulas are compiled once per
+    template when template_path is given, otherwise from ws itself. Formulas
+    the engine cannot compute are None.
+    """
+    graph = get_formula_graph(template_path) if template_path else FormulaGraph.from_sheet(ws)
+    inputs = {}
+    for address in DYNAMIC_CELLS:
+        value = ws[address].value
+        if not (isinstance(value, str) and value.startswith('=')):
+            inputs[address] = value
+    return graph.recalculate(inputs)
+
+
+def format_value(value, number_format):
+    """Render a cell value the way its Excel number format would show it"""
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        fmt = (number_format or '').lower()
+        fmt = fmt.replace('yyyy', '%Y').replace('yy', '%y').replace('mm', '%m').replace('dd', '%d')
+        return value.strftime(fmt if '%' in fmt else '%d/%m/%Y')
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return str(value)
+
+    section = (number_format or 'General').split(';')[0]
+    if section == 'General':
+        return str(int(value)) if float(value).is_integer() else format(value, '.10g')
+
+    symbol = ''
+    currency = re.search(r'\[\$([^\]-]*)', section)
+    if currency:
+        symbol = currency.group(1)
+    decimals = re.search(r'0\.(0+)', section)
+    places = len(decimals.group(1)) if decimals else 0
+    text = f"{value:,.{places}f}" if ',' in section else f"{value:.{places}f}"
+    if '%' in section:
+        text = f"{value * 100:.{places}f}%"
+    return f"{symbol} {text}" if symbol else text
+
+
+def _draw_overlay(ws, values, layout, page_width, page_height):
+    from reportlab.pdfgen import canvas
+
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=(page_width, page_height))
+    for address, (x0, y0, x1, y1, scale) in layout.items():
+        cell = ws[address]
+        text = format_value(values.get(address, cell.value), cell.number_format)
+        if not text:
+            continue
+        size = (cell.font.sz or 11) * scale
+        font = FONT_BOLD if cell.font.b else FONT_REGULAR
+        c.setFont(font, size)
+
+        vertical = cell.alignment.vertical
+        if vertical == 'center':
+            y = (y0 + y1) / 2 - size / 3
+        elif vertical == 'top':
+            y = y1 - size
+        else:
+            y = y0 + 2 * scale
+
+        horizontal = cell.alignment.horizontal
+        if horizontal is None and isinstance(values.get(address, cell.value), (int, float)):
+            horizontal = 'right'
+        padding = 2 * scale
+        if horizontal in ('center', 'centerContinuous'):
+            c.drawCentredString((x0 + x1) / 2, y, text)
+        elif horizontal == 'right':
+            c.drawRightString(x1 - padding, y, text)
+        else:
+            c.drawString(x0 + padding, y, text)
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def render_overlay_pdf(template_path, ws, pdf_path):
+    """
+    Write pdf_path by drawing the dynamic cells of the filled sheet ws on top
+    of the cached base PDF of template_path.
+    """
+    import pypdfium2 as pdfium
+
+    base = pdfium.PdfDocument(get_base_pdf(template_path))
+    try:
+        page = base[0]
+        page_width, page_height = page.get_size()
+        layout = get_layout(template_path, ws, page_width, page_height)
+        values = evaluate_formulas(ws, template_path)
+        overlay = pdfium.PdfDocument(_draw_overlay(ws, values, layout, page_width, page_height))
+        try:
+            xobject = overlay.page_as_xobject(0, base)
+            page.insert_obj(xobject.as_pageobject())
+            page.gen_content()
+            base.save(pdf_path)
+        finally:
+            overlay.close()
+    finally:
+        base.close()
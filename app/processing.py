@@ -1,10 +1,13 @@
-import xlwings as xw
 from io import BytesIO
 import os
-import glob
 import json
+import re
 import tempfile
 import shutil
+from .artifacts import artifact_store
+from .engines import PDF_EXPORT, get_engine, get_insert_function, call_insert_function
+from .metrics import StageTimer, metrics
+from .template_registry import TemplateRegistry
 
 # Directory containing Excel templates
 laban_dir = 'template/laban'  # Directory for Normal FERI templates
@@ -12,120 +15,123 @@ malaba_dir = 'template/malaba'  # Directory for Maritime templates
 possiano_dir = 'template/possiano'  # Directory for Possiano templates
 busia_dir = 'template/busia'  # Directory for Busia templates
 
-# Global variables to store the modified files and data in memory
-modified_excel_global = None
-modified_pdf_global = None
-data_global = None
-pdf_type_global = None
-
-def get_available_templates(template_dir):
-    """Get list of available Excel templates from the specified directory"""
-    if not os.path.exists(template_dir):
-        os.makedirs(template_dir)
-        return []
-    
-    excel_files = glob.glob(os.path.join(template_dir, '*.xlsx'))
-    return [os.path.basename(f) for f in excel_files]
-
-def process_excel_and_pdf(data, pdf_type, template_file, freight_number, container_type='', num_containers=1):
+# Template directory per pdf_type
+TEMPLATE_DIRS = {
+    'normal': laban_dir,
+    'maritime': malaba_dir,
+    'possiano': possiano_dir,
+    'busia': busia_dir,
+}
+
+# Shared index of the available templates
+template_registry = TemplateRegistry(TEMPLATE_DIRS)
+
+def get_download_name(data, pdf_type, extension):
+    """
+    Build the download filename for a generated file.
+    Maritime/Possiano/Busia use the BL, Normal uses the Transport ID.
+    """
+    download_name = f'modified.{extension}'
+    if data and pdf_type:
+        identifier = None
+        if pdf_type in ['maritime', 'busia', 'possiano'] and 'bl' in data:
+            identifier = data['bl']
+        elif pdf_type == 'normal' and 'transport_id' in data:
+            identifier = data['transport_id']
+        if identifier:
+            # Sanitize identifier for safe filename
+            identifier = re.sub(r'[^\w\-]', '_', identifier.strip())
+            download_name = f'Proforma_Invoice_{identifier}.{extension}'
+    return download_name
+
+def _template_path(pdf_type, template_file):
+    """Path of the selected template, or None when it does not exist"""
+    if not template_file:
+        return None
+    base_dir = TEMPLATE_DIRS.get(pdf_type, laban_dir)
+    template_path = os.path.join(base_dir, template_file)
+    return template_path if os.path.exists(template_path) else None
+
+def generate_files(data, pdf_type, template_file, freight_number, container_type, num_containers, work_dir, progress=None):
+    """
+    Fill the template with the configured engine and write the results into
+    work_dir. Returns the paths of the Excel file and of the PDF (None when
+    no PDF was exported), or (None, None) when there is no template or
+    generation failed.
+    """
+    template_path = _template_path(pdf_type, template_file)
+    if not template_path:
+        return None, None
+
+    excel_path = os.path.join(work_dir, f"temp_{template_file}")
+    pdf_path = os.path.join(work_dir, "temp_output.pdf")
+
+    # Stage timings for /metrics, fed by the same callbacks as progress
+    timer = StageTimer('process', pdf_type=pdf_type, template=template_file)
+
+    def report(stage):
+        timer(stage)
+        if progress:
+            progress(stage)
+
+    try:
+        insert_func = get_insert_function(pdf_type)
+
+        def fill_sheet(ws):
+            call_insert_function(insert_func, ws, data, freight_number, container_type, num_containers, template_file)
+
+        # Fill, recalculate and export with the configured engine.
+        # The engine takes the template from the in-memory cache.
+        engine = get_engine()
+        has_pdf = engine.fill(template_path, excel_path, pdf_path, fill_sheet, report)
+        timer.end()
+        if not has_pdf and PDF_EXPORT != 'none':
+            timer.error('export')
+
+        outputs = {'excel': excel_path, 'pdf': pdf_path if has_pdf else None}
+        for kind, path in outputs.items():
+            if path is not None:
+                metrics.inc('proforma_output_bytes_total', os.path.getsize(path),
+                            operation='process', pdf_type=pdf_type, template=template_file, kind=kind)
+        return outputs['excel'], outputs['pdf']
+
+    except Exception as e:
+        timer.error()
+        print(f"Error processing Excel/PDF: {str(e)}")
+        return None, None
+
+    finally:
+        timer.finish()
+
+def process_excel_and_pdf(data, pdf_type, template_file, freight_number, container_type='', num_containers=1, progress=None):
     """
-    Process extracted data, update Excel template, and generate PDF using xlwings.
+    Process extracted data, update Excel template, and generate PDF using the
+    configured engine (see EXCEL_ENGINE in engines.py).
+    progress, if given, is called with the name of each stage as it starts.
     Returns modified Excel, PDF buffers, and formatted JSON data.
     """
-    global modified_excel_global, modified_pdf_global, data_global, pdf_type_global
     json_data = json.dumps(data, ensure_ascii=False, indent=2)
     modified_excel = None
     modified_pdf = None
 
-    # Store data and pdf_type globally
-    data_global = data
-    pdf_type_global = pdf_type
-
-    # Check for selected template
-    template_path = None
-    if template_file:
-        base_dir = {
-            'normal': laban_dir,
-            'maritime': malaba_dir,
-            'possiano': possiano_dir,
-            'busia': busia_dir,
-        }.get(pdf_type, laban_dir)
-        template_path = os.path.join(base_dir, template_file)
-        if not os.path.exists(template_path):
-            template_path = None
-
-    if template_path:
+    if _template_path(pdf_type, template_file):
         # Create temporary files for processing
         temp_dir = tempfile.mkdtemp()
-        temp_excel_path = os.path.join(temp_dir, f"temp_{template_file}")
-        temp_pdf_path = os.path.join(temp_dir, "temp_output.pdf")
-        
         try:
-            # Copy template to temporary location
-            shutil.copy2(template_path, temp_excel_path)
-            
-            # Open Excel application with xlwings
-            app = xw.App(visible=False, add_book=False)
-            
-            try:
-                # Open the workbook
-                wb = app.books.open(temp_excel_path)
-                ws = wb.sheets[0]  # Get the active sheet
-                
-                # Dynamically import and call the insertion function based on pdf_type
-                if pdf_type == 'normal':
-                    from .insertions_normal import insert_data as insert_func
-                elif pdf_type == 'maritime':
-                    from .insertions_maritime import insert_data as insert_func
-                elif pdf_type == 'possiano':
-                    from .insertions_possiano import insert_data as insert_func
-                elif pdf_type == 'busia':
-                    from .insertions_busia import insert_data as insert_func
-                else:
-                    from .insertions_maritime import insert_data as insert_func
-                
-                # Insert the data
-                # Pass template filename only for modules that accept it
-                try:
-                    insert_func(ws, data, freight_number, container_type, num_containers, template_file)
-                except TypeError:
-                    insert_func(ws, data, freight_number, container_type, num_containers)
-
-                # Force calculation of all formulas
-                wb.app.calculate()
-                
-                # Save the Excel file
-                wb.save()
-                
-                # Export to PDF with exact formatting
-                wb.api.ExportAsFixedFormat(Type=0, Filename=temp_pdf_path)
-                
-                # Read the modified Excel file into memory
-                with open(temp_excel_path, 'rb') as f:
-                    modified_excel = BytesIO(f.read()) 
-                
-                # Read the PDF file into memory
-                with open(temp_pdf_path, 'rb') as f:
+            excel_path, pdf_path = generate_files(
+                data, pdf_type, template_file, freight_number, container_type, num_containers, temp_dir, progress
+            )
+
+            # Read the modified Excel file into memory
+            if excel_path:
+                with open(excel_path, 'rb') as f:
+                    modified_excel = BytesIO(f.read())
+
+            # Read the PDF file into memory
+            if pdf_path:
+                with open(pdf_path, 'rb') as f:
                     modified_pdf = BytesIO(f.read())
-                
-                # Store in globals
-                modified_excel_global = modified_excel
-                modified_pdf_global = modified_pdf
-                
-            finally:
-                # Close workbook and quit Excel application
-                wb.close()
-                app.quit()
-                
-        except Exception as e:
-            print(f"Error processing Excel/PDF: {str(e)}")
-            # Cleanup in case of error
-            try:
-                if 'app' in locals():
-                    app.quit()
-            except:
-                pass
-            
+
         finally:
             # Clean up temporary files
             try:
@@ -135,6 +141,41 @@ def process_excel_and_pdf(data, pdf_type, template_file, freight_number, contain
 
     return modified_excel, modified_pdf, json_data
 
+def generate_artifact(data, pdf_type, template_file, freight_number, container_type='', num_containers=1, progress=None):
+    """
+    Generate the Excel/PDF for a request and keep them in the artifact store.
+    With a directory tier the files are written straight into it and served
+    from disk, so they are never held in memory. progress is passed on to
+    generate_files. Returns the token, or None when nothing was generated.
+    """
+    staging = artifact_store.staging_dir()
+    if staging is None:
+        modified_excel, modified_pdf, _ = process_excel_and_pdf(
+            data, pdf_type, template_file, freight_number, container_type, num_containers, progress
+        )
+        if modified_excel is None:
+            return None
+        return artifact_store.put(
+            data,
+            pdf_type,
+            modified_excel.getvalue(),
+            modified_pdf.getvalue() if modified_pdf is not None else None,
+        )
+
+    token = None
+    try:
+        excel_path, pdf_path = generate_files(
+            data, pdf_type, template_file, freight_number, container_type, num_containers, staging, progress
+        )
+        if excel_path:
+            token = artifact_store.put_files(staging, data, pdf_type, excel_path, pdf_path)
+    except OSError as e:
+        print(f"Error storing artifact: {str(e)}")
+    finally:
+        if token is None:
+            shutil.rmtree(staging, ignore_errors=True)
+    return token
+
 def cleanup_excel_processes():
     """
     Utility function to cleanup any remaining Excel processes
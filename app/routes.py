@@ -1,23 +1,51 @@
 import json
-import subprocess
-import sys
-from flask import Blueprint, jsonify, render_template, request, send_file
-from .data_extraction import extract_certificate_data, extract_data_from_pdf
-from .processing import get_available_templates, process_excel_and_pdf, laban_dir, malaba_dir, possiano_dir, busia_dir, modified_excel_global, modified_pdf_global, data_global, pdf_type_global
+from io import BytesIO
+from flask import Blueprint, Response, jsonify, make_response, render_template, request, send_file, stream_with_context, url_for
+from .data_extraction import WrongDocumentError, extract_certificate_data, extract_data_from_pdf
+from .flagging import FLAGGING_RETRIES, FlaggingBusy, submit_certificate, submit_certificates
+from .jobs import get_job_queue, job_events, submit_job
+from .artifacts import artifact_store
+from .metrics import metrics
+from .processing import generate_artifact, get_download_name, template_registry
+from .uploads import source_bytes, upload_source
 import re
 import os
+import shutil
+import tempfile
+import uuid
+import zipfile
 
 bp = Blueprint('main', __name__)
 
+# Rendered index page per template registry version
+_index_cache = {}
+# Distinguishes ETags across restarts, so a deploy never serves a stale 304
+_boot_id = uuid.uuid4().hex[:8]
+
+def template_lists():
+    """Template dropdown lists for upload_form.html"""
+    listing = template_registry.listing()
+    return {
+        'normal_templates': listing['normal'],
+        'maritime_templates': listing['maritime'],
+        'possiano_templates': listing['possiano'],
+        'busia_templates': listing['busia'],
+    }
+
 @bp.route('/')
 def index():
-    # templates = get_available_templates()
-    # return render_template('upload_form.html', data=None, modified=False, templates=templates)
-    normal_templates = get_available_templates(laban_dir)
-    maritime_templates = get_available_templates(malaba_dir)
-    possiano_templates= get_available_templates(possiano_dir)
-    busia_templates = get_available_templates(busia_dir)
-    return render_template('upload_form.html', normal_templates=normal_templates, maritime_templates=maritime_templates, possiano_templates=possiano_templates, busia_templates=busia_templates)
+    lists = template_lists()
+    version = template_registry.version
+    html = _index_cache.get(version)
+    if html is None:
+        html = render_template('upload_form.html', **lists)
+        _index_cache.clear()
+        _index_cache[version] = html
+
+    response = make_response(html)
+    response.set_etag(f"{_boot_id}-{version}")
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @bp.route('/process/<pdf_type>', methods=['POST'])
 def process_pdf(pdf_type):
@@ -27,6 +55,7 @@ def process_pdf(pdf_type):
     data = None
     modified = False
     json_data = None
+    token = None
     
     if 'pdf_file' not in request.files:
         return "No PDF file part"
@@ -34,9 +63,9 @@ def process_pdf(pdf_type):
     if pdf_file.filename == '':
         return "No selected PDF file"
     if pdf_file and pdf_file.filename.endswith('.pdf'):
-        pdf_content = pdf_file.read()
-        data = extract_data_from_pdf(pdf_content, pdf_type)
-        
+        # Bytes for small uploads, the spooled temp file for large ones
+        pdf_content = upload_source(pdf_file)
+
         # Get Freight Number from form input
         freight_number = request.form.get('freight_number', '').strip()
         try:
@@ -54,50 +83,157 @@ def process_pdf(pdf_type):
             except ValueError:
                 num_containers = 1
 
-        # Process Excel and PDF
         template_file = request.form.get('template_file', '').strip()
-        modified_excel, modified_pdf, json_data = process_excel_and_pdf(
-            data, pdf_type, template_file, freight_number, container_type, num_containers
-        )
-        modified = modified_excel is not None
-
-    normal_templates = get_available_templates(laban_dir)
-    maritime_templates = get_available_templates(malaba_dir)
-    possiano_templates = get_available_templates(possiano_dir)
-    busia_templates = get_available_templates(busia_dir)
+
+        # Queue the work and return a job id straight away when asked to
+        if request.values.get('async'):
+            job_id = submit_job({
+                'pdf_type': pdf_type,
+                'template_file': template_file,
+                'freight_number': freight_number,
+                'container_type': container_type,
+                'num_containers': num_containers,
+            }, source_bytes(pdf_content))
+            return jsonify({
+                'job_id': job_id,
+                'status_url': url_for('main.job_status', job_id=job_id),
+                'events_url': url_for('main.job_events_stream', job_id=job_id),
+            }), 202
+
+        data = extract_data_from_pdf(pdf_content, pdf_type)
+        json_data = json.dumps(data, ensure_ascii=False, indent=2)
+
+        # Process Excel and PDF, keeping the outputs under a per-request token for the download links
+        token = generate_artifact(data, pdf_type, template_file, freight_number, container_type, num_containers)
+        modified = token is not None
+
     return render_template(
         'upload_form.html',
         data=data,
         json_data=json_data,
         modified=modified,
-        normal_templates=normal_templates,
-        maritime_templates=maritime_templates,
-        possiano_templates=possiano_templates,
-        busia_templates=busia_templates,
+        token=token,
+        **template_lists(),
+    )
+
+@bp.route('/process_batch/<pdf_type>', methods=['POST'])
+def process_batch(pdf_type):
+    """
+    Process many PDFs (pdf_files, or a zip archive) in the batch process pool and
+    stream back a zip of the generated files plus manifest.json. The PDFs wait
+    in a temporary directory rather than in memory, and each result goes out
+    as soon as it is done.
+    """
+    from .batch import BatchTooLarge, read_batch_inputs, run_batch, stream_batch_zip
+
+    if pdf_type not in ['normal', 'maritime', 'possiano', 'busia']:
+        return "Invalid PDF type", 400
+
+    freight_number = request.form.get('freight_number', '').strip()
+    try:
+        freight_number = int(freight_number) if freight_number else None
+    except ValueError:
+        freight_number = None
+
+    container_type = request.form.get('container_type', '') if pdf_type == 'maritime' else ''
+    num_containers = 1
+    if pdf_type == 'maritime':
+        num_containers = request.form.get('num_containers', '').strip()
+        try:
+            num_containers = int(num_containers) if num_containers else 1
+        except ValueError:
+            num_containers = 1
+
+    template_file = request.form.get('template_file', '').strip()
+
+    uploads = request.files.getlist('pdf_files') + request.files.getlist('zip_file')
+    directory = tempfile.mkdtemp(prefix='batch_')
+    try:
+        inputs = read_batch_inputs([(f.filename, f.stream) for f in uploads if f and f.filename], directory)
+    except BatchTooLarge as e:
+        shutil.rmtree(directory, ignore_errors=True)
+        return str(e), 413
+    except zipfile.BadZipFile:
+        shutil.rmtree(directory, ignore_errors=True)
+        return "Invalid zip archive", 400
+    if not inputs:
+        shutil.rmtree(directory, ignore_errors=True)
+        return "No PDF files provided", 400
+
+    def generate():
+        try:
+            results = run_batch(inputs, pdf_type, template_file, freight_number, container_type, num_containers)
+            yield from stream_batch_zip(results)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=Proforma_Invoices_{pdf_type}.zip'},
     )
 
+@bp.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
+@bp.route('/jobs/<job_id>/events')
+def job_events_stream(job_id):
+    return Response(
+        stream_with_context(job_events(job_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@bp.route('/jobs/<job_id>/download/<kind>')
+def job_download(job_id, kind):
+    if kind not in ['excel', 'pdf']:
+        return "Invalid artifact", 400
+    # Job outputs live in the artifact store and expire like the synchronous downloads
+    token = get_job_queue().get_token(job_id)
+    artifact = artifact_store.get(token)
+    if artifact is None:
+        return f"No {kind} available", 404
+
+    extension = 'xlsx' if kind == 'excel' else 'pdf'
+    download_name = get_download_name(artifact['data'], artifact['pdf_type'], extension)
+    mimetype = 'application/pdf' if kind == 'pdf' else 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    path = artifact_store.get_path(token, kind)
+    if path is not None:
+        return send_file(path, as_attachment=True, download_name=download_name, mimetype=mimetype)
+    content = artifact_store.get_file(token, kind)
+    if content is None:
+        return f"No {kind} available", 404
+    return send_file(BytesIO(content), as_attachment=True, download_name=download_name, mimetype=mimetype)
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Stage timings, byte counters and errors in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @bp.route('/download_excel')
 def download_excel():
-    from .processing import modified_excel_global, data_global, pdf_type_global
-    if modified_excel_global is None:
+    token = request.args.get('token', '')
+    artifact = artifact_store.get(token)
+    if artifact is None:
         return "No modified Excel available"
-    
+
     # Determine download name based on pdf_type and data
-    download_name = 'modified.xlsx'
-    if data_global and pdf_type_global:
-        identifier = None
-        if pdf_type_global in ['maritime', 'busia', 'possiano'] and 'bl' in data_global:
-            identifier = data_global['bl']
-        elif pdf_type_global == 'normal' and 'transport_id' in data_global:
-            identifier = data_global['transport_id']
-        if identifier:
-            # Sanitize identifier for safe filename
-            identifier = re.sub(r'[^\w\-]', '_', identifier.strip())
-            download_name = f'Proforma_Invoice_{identifier}.xlsx'
-
-    modified_excel_global.seek(0)
+    download_name = get_download_name(artifact['data'], artifact['pdf_type'], 'xlsx')
+
+    # Served from disk when possible: streamed with sendfile, Range requests supported
+    path = artifact_store.get_path(token, 'excel')
+    if path is not None:
+        return send_file(path, as_attachment=True, download_name=download_name, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+    modified_excel = artifact_store.get_file(token, 'excel')
+    if modified_excel is None:
+        return "No modified Excel available"
     return send_file(
-        modified_excel_global,
+        BytesIO(modified_excel),
         as_attachment=True,
         download_name=download_name,
         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
@@ -105,26 +241,24 @@ def download_excel():
 
 @bp.route('/download_pdf')
 def download_pdf():
-    from .processing import modified_pdf_global, data_global, pdf_type_global
-    if modified_pdf_global is None:
+    token = request.args.get('token', '')
+    artifact = artifact_store.get(token)
+    if artifact is None:
         return "No PDF available"
-    
+
     # Determine download name based on pdf_type and data
-    download_name = 'modified.pdf'
-    if data_global and pdf_type_global:
-        identifier = None
-        if pdf_type_global in ['maritime', 'busia', 'possiano'] and 'bl' in data_global:
-            identifier = data_global['bl']
-        elif pdf_type_global == 'normal' and 'transport_id' in data_global:
-            identifier = data_global['transport_id']
-        if identifier:
-            # Sanitize identifier for safe filename
-            identifier = re.sub(r'[^\w\-]', '_', identifier.strip())
-            download_name = f'Proforma_Invoice_{identifier}.pdf'
-
-    modified_pdf_global.seek(0)
+    download_name = get_download_name(artifact['data'], artifact['pdf_type'], 'pdf')
+
+    # Served from disk when possible: streamed with sendfile, Range requests supported
+    path = artifact_store.get_path(token, 'pdf')
+    if path is not None:
+        return send_file(path, as_attachment=True, download_name=download_name, mimetype='application/pdf')
+
+    modified_pdf = artifact_store.get_file(token, 'pdf')
+    if modified_pdf is None:
+        return "No PDF available"
     return send_file(
-        modified_pdf_global,
+        BytesIO(modified_pdf),
         as_attachment=True,
         download_name=download_name,
         mimetype='application/pdf'
@@ -141,7 +275,10 @@ def flagging_index():
         if pdf_file.filename == "":
             return "No selected file", 400
 
-        extracted_data = extract_certificate_data(pdf_file)
+        try:
+            extracted_data = extract_certificate_data(pdf_file)
+        except WrongDocumentError as e:
+            return render_template("index.html", data=None, error=str(e)), 422
 
     return render_template("index.html", data=extracted_data)
 
@@ -151,15 +288,49 @@ def fill_form():
     if not data:
         return jsonify({"error": "No data provided"}), 400
 
+    # Filled in a pooled browser that is already logged in
+    try:
+        timings = submit_certificate(data)
+        return jsonify({"status": "success", "timings": timings})
+    except FlaggingBusy as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@bp.route("/flagging/fill-form-batch", methods=["POST"])
+def fill_form_batch():
+    """
+    Fill and submit the form for a list of extracted certificates in one
+    logged-in session. Body: {"certificates": [...], "submit": true,
+    "retries": 2} or a bare list of certificates. "submit": false only
+    checks that every certificate fills: each fill replaces the last one.
+    """
+    payload = request.get_json(silent=True)
+    if isinstance(payload, list):
+        payload = {"certificates": payload}
+    certificates = (payload or {}).get("certificates")
+    if not certificates or not isinstance(certificates, list) or not all(isinstance(c, dict) for c in certificates):
+        return jsonify({"error": "No certificates provided"}), 400
+
     try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        login_script = os.path.join(base_dir, "login.py")
-        result = subprocess.run(
-            [sys.executable, login_script],
-            input=json.dumps(data),
-            text=True,
-            capture_output=True
-        )
-        return jsonify({"status": "success", "output": result.stdout, "error": result.stderr})
+        retries = int(payload.get("retries", FLAGGING_RETRIES))
+    except (TypeError, ValueError):
+        retries = FLAGGING_RETRIES
+
+    try:
+        results = submit_certificates(certificates, submit=bool(payload.get("submit", True)), retries=max(0, retries))
+    except FlaggingBusy as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+    # Screenshots show the portal with the certificate's data, so they stay on
+    # the server under FLAGGING_SCREENSHOT_DIR and are only named here
+    for result in results:
+        result["screenshots"] = [os.path.basename(path) for path in result["screenshots"]]
+    return jsonify({
+        "status": "done",
+        "ok": sum(1 for r in results if r["status"] == "ok"),
+        "failed": sum(1 for r in results if r["status"] != "ok"),
+        "results": results,
+    })
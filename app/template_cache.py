@@ -0,0 +1,93 @@
+import os
+import pickle
+import threading
+import time
+from io import BytesIO
+
+# Seconds between mtime checks for a cached template
+TEMPLATE_CACHE_CHECK_INTERVAL = float(os.environ.get('TEMPLATE_CACHE_CHECK_INTERVAL', 2))
+
+
+class _Entry:
+    def __init__(self, mtime, data):
+        self.mtime = mtime
+        self.data = data
+        self.snapshot = None  # pickled parsed workbook, built on first request
+        self.checked = time.monotonic()
+
+
+class TemplateCache:
+    """
+    Keep Excel templates in memory so a fill never reads or parses the file again.
+
+    Each template is read once and invalidated when its mtime changes. Callers
+    get either the raw bytes (immutable, shared) or a private parsed workbook.
+    The parsed workbook is stored as a pickle snapshot; unpickling a clone is an
+    order of magnitude cheaper than openpyxl parsing the xlsx, and each request
+    gets its own copy to write into.
+    """
+
+    def __init__(self, check_interval=TEMPLATE_CACHE_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _entry(self, template_path):
+        key = os.path.abspath(template_path)
+        now = time.monotonic()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry.checked < self.check_interval:
+                self.hits += 1
+                return entry
+            mtime = os.path.getmtime(key)
+            if entry is not None and entry.mtime == mtime:
+                entry.checked = now
+                self.hits += 1
+                return entry
+            self.misses += 1
+            with open(key, 'rb') as f:
+                entry = _Entry(mtime, f.read())
+            self.entries[key] = entry
+            return entry
+
+    def get_bytes(self, template_path):
+        """Return the template file contents"""
+        return self._entry(template_path).data
+
+    def get_workbook(self, template_path):
+        """Return a private openpyxl workbook cloned from the cached template"""
+        entry = self._entry(template_path)
+        snapshot = entry.snapshot
+        if snapshot is None:
+            import openpyxl
+            wb = openpyxl.load_workbook(BytesIO(entry.data))
+            snapshot = pickle.dumps(wb, protocol=pickle.HIGHEST_PROTOCOL)
+            entry.snapshot = snapshot
+        return pickle.loads(snapshot)
+
+    def invalidate(self, template_path=None):
+        """Drop one template, or every template when no path is given"""
+        with self._lock:
+            if template_path is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(os.path.abspath(template_path), None)
+
+    def stats(self):
+        """Return hit/miss counts and the memory held by cached templates"""
+        with self._lock:
+            entries = list(self.entries.values())
+            return {
+                'entries': len(entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes': sum(len(e.data) for e in entries),
+                'snapshot_bytes': sum(len(e.snapshot) for e in entries if e.snapshot is not None),
+            }
+
+
+# Shared cache used by the fill engines
+template_cache = TemplateCache()
@@ -0,0 +1,82 @@
+import glob
+import os
+import threading
+import time
+
+# Seconds between directory mtime checks
+TEMPLATE_INDEX_CHECK_INTERVAL = float(os.environ.get('TEMPLATE_INDEX_CHECK_INTERVAL', 5))
+
+
+class TemplateRegistry:
+    """
+    Index of the Excel templates available per pdf_type.
+
+    The directories are scanned once and rescanned only when one of their
+    mtimes changes (a file was added, removed or renamed), checked at most
+    every check_interval seconds. version increases on every change, so it can
+    key caches of anything rendered from the listing.
+    """
+
+    def __init__(self, template_dirs, check_interval=TEMPLATE_INDEX_CHECK_INTERVAL):
+        self.template_dirs = template_dirs
+        self.check_interval = check_interval
+        self.version = 0
+        self._dir_mtimes = None
+        self._templates = {}
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _current_mtimes(self):
+        mtimes = {}
+        for pdf_type, template_dir in self.template_dirs.items():
+            if not os.path.exists(template_dir):
+                os.makedirs(template_dir)
+            mtimes[pdf_type] = os.path.getmtime(template_dir)
+        return mtimes
+
+    def _scan(self):
+        templates = {}
+        for pdf_type, template_dir in self.template_dirs.items():
+            entries = []
+            for path in sorted(glob.glob(os.path.join(template_dir, '*.xlsx'))):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append({
+                    'name': os.path.basename(path),
+                    'path': path,
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime,
+                })
+            templates[pdf_type] = entries
+        return templates
+
+    def refresh(self, force=False):
+        """Rescan if a template directory changed since the last scan"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._dir_mtimes is not None and now - self._last_check < self.check_interval:
+                return
+            self._last_check = now
+            mtimes = self._current_mtimes()
+            if force or mtimes != self._dir_mtimes:
+                self._templates = self._scan()
+                self._dir_mtimes = mtimes
+                self.version += 1
+
+    def listing(self):
+        """Return {pdf_type: [template filename, ...]}"""
+        self.refresh()
+        return {pdf_type: [t['name'] for t in entries] for pdf_type, entries in self._templates.items()}
+
+    def templates(self, pdf_type):
+        """Return the filenames available for one pdf_type"""
+        return self.listing().get(pdf_type, [])
+
+    def metadata(self, pdf_type=None):
+        """Return name, path, size and mtime per template, for one or all pdf_types"""
+        self.refresh()
+        if pdf_type is not None:
+            return [dict(t) for t in self._templates.get(pdf_type, [])]
+        return {key: [dict(t) for t in entries] for key, entries in self._templates.items()}
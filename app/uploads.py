@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+
+from flask import Request
+
+# Uploads larger than this are spooled to a temporary file instead of memory
+UPLOAD_SPOOL_BYTES = int(os.environ.get('UPLOAD_SPOOL_BYTES', 1024 * 1024))
+# Largest request body accepted (Flask MAX_CONTENT_LENGTH); larger uploads get a 413
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 100 * 1024 * 1024))
+
+
+class SpooledRequest(Request):
+    """Request whose file uploads stay in memory only up to UPLOAD_SPOOL_BYTES"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode='rb+')
+
+
+def upload_source(file_storage):
+    """
+    Return an uploaded PDF in the form the extractors take: bytes for small
+    uploads, or the spooled file itself (rewound) for large ones, so a big PDF
+    is read from disk instead of being copied into memory.
+    """
+    stream = file_storage.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size > UPLOAD_SPOOL_BYTES:
+        return stream
+    return stream.read()
+
+
+def body_source(request):
+    """
+    Return a raw request body (e.g. Content-Type: application/pdf) in the same
+    form as upload_source(): bytes when small, a spooled temporary file otherwise.
+    """
+    length = request.content_length
+    if length is not None and length <= UPLOAD_SPOOL_BYTES:
+        return request.get_data(cache=False)
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode='rb+')
+    shutil.copyfileobj(request.stream, spool)
+    size = spool.tell()
+    spool.seek(0)
+    if size > UPLOAD_SPOOL_BYTES:
+        return spool
+    return spool.read()
+
+
+def source_bytes(source):
+    """Bytes of an upload_source() result"""
+    if hasattr(source, 'read'):
+        source.seek(0)
+        return source.read()
+    return source
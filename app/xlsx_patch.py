@@ -0,0 +1,332 @@
+"""
+Set cells of an xlsx by rewriting the first sheet's XML inside the zip.
+
+Only the first worksheet part and xl/workbook.xml (to request a full
+recalculation on load) are rewritten. Every other member, including styles,
+images and the other sheets, is copied as its original compressed bytes, so
+the output is byte-identical to the template outside the patched parts and
+the cost grows with the cells written, not the size of the workbook. Strings
+are written as inline strings, so sharedStrings.xml is never touched.
+Formula cells can be given new cached values (see formulas.py), so readers
+that do not recalculate still show the right totals.
+"""
+import datetime
+import math
+import posixpath
+import re
+import struct
+import zipfile
+import zlib
+from io import BytesIO
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+from openpyxl.utils import column_index_from_string
+
+from .formulas import to_number
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+_CALC_CHAIN_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/calcChain'
+
+_ADDRESS = re.compile(r'\$?([A-Z]{1,3})\$?([1-9][0-9]*)')
+_ROW = re.compile(r'<row\b[^>]*?(?:/>|>.*?</row>)', re.S)
+_ROW_NUMBER = re.compile(r'\sr="(\d+)"')
+_CELL = re.compile(r'<c\b[^>]*?(?:/>|>.*?</c>)', re.S)
+_CELL_REF = re.compile(r'\sr="([A-Z]+)(\d+)"')
+_CELL_STYLE = re.compile(r'\ss="(\d+)"')
+_CELL_TYPE = re.compile(r'\st="\w+"')
+_FORMULA_VALUE = re.compile(r'<v>[^<]*</v>|<v/>')
+_SHARED_MASTER = re.compile(r'<f\b[^>]*\bt="shared"[^>]*\bref="')
+_CALC_PR = re.compile(r'<calcPr\b[^>]*?/?>')
+# Elements that follow calcPr in a workbook, where a missing calcPr is inserted
+_AFTER_CALC_PR = re.compile(
+    r'<(?:oleSize|customWorkbookViews|pivotCaches|smartTagPr|smartTagTypes|webPublishing|'
+    r'fileRecoveryPr|webPublishObjects|extLst)\b|</workbook>'
+)
+# XML 1.0 cannot carry these control characters, even escaped
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Zip general purpose flags: encrypted member, sizes in a data descriptor, UTF-8 name
+_ENCRYPTED = 0x01
+_DATA_DESCRIPTOR = 0x08
+_UTF8_NAME = 0x800
+# Sizes, offsets and counts beyond these need zip64 records
+_ZIP32_LIMIT = 0xFFFFFFFF
+_ZIP32_MEMBERS = 0xFFFF
+
+
+class PatchError(Exception):
+    """The workbook has a structure the patcher does not handle; fill it another way"""
+
+
+def split_address(address):
+    """('D', 14) for 'D14' (or '$D$14')"""
+    match = _ADDRESS.fullmatch(address.upper())
+    if not match:
+        raise PatchError(f"Invalid cell address: {address}")
+    return match.group(1), int(match.group(2))
+
+
+def first_sheet_path(archive):
+    """Zip path of the workbook's first worksheet"""
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    sheet = workbook.find(f'{_MAIN_NS}sheets/{_MAIN_NS}sheet')
+    if sheet is None:
+        raise PatchError("Workbook has no sheets")
+    rel_id = sheet.get(f'{_REL_NS}id')
+    rels = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for rel in rels.iter(f'{_PKG_REL_NS}Relationship'):
+        if rel.get('Id') == rel_id:
+            target = rel.get('Target')
+            return target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+    raise PatchError(f"First sheet relationship {rel_id} not found")
+
+
+def cell_xml(address, value, style=None):
+    """The <c> element for one value, keeping the cell's style"""
+    attributes = f' r="{address}"' + (f' s="{style}"' if style is not None else '')
+    if value is None:
+        return f'<c{attributes}/>'
+    if isinstance(value, bool):
+        return f'<c{attributes} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        if isinstance(value, float) and not math.isfinite(value):
+            raise PatchError(f"Cannot write {value} to {address}")
+        return f'<c{attributes}><v>{value!r}</v></c>'
+    text = _INVALID_XML_CHARS.sub('', str(value))
+    return f'<c{attributes} t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+def _patch_row(row_xml, row_number, cells, replaced_formulas):
+    """Return row_xml with cells {column: value} set, in column order"""
+    if row_xml.endswith('/>'):
+        row_xml = row_xml[:-2] + '></row>'
+    open_end = row_xml.index('>') + 1
+    body = row_xml[open_end:-len('</row>')]
+    pending = {column_index_from_string(column): (column, value) for column, value in cells.items()}
+
+    parts = []
+    for match in _CELL.finditer(body):
+        cell = match.group(0)
+        ref = _CELL_REF.search(cell[:cell.index('>')])
+        if ref is None:
+            raise PatchError(f"Cell without a reference in row {row_number}")
+        index = column_index_from_string(ref.group(1))
+        for new_index in sorted(i for i in pending if i < index):
+            column, value = pending.pop(new_index)
+            parts.append(cell_xml(f'{column}{row_number}', value))
+        if index in pending:
+            if _SHARED_MASTER.search(cell):
+                raise PatchError(f"{ref.group(1)}{row_number} holds a shared formula used by other cells")
+            if '<f' in cell:
+                replaced_formulas.append(f'{ref.group(1)}{row_number}')
+            style = _CELL_STYLE.search(cell[:cell.index('>')])
+            column, value = pending.pop(index)
+            cell = cell_xml(f'{column}{row_number}', value, style.group(1) if style else None)
+        parts.append(cell)
+    for new_index in sorted(pending):
+        column, value = pending[new_index]
+        parts.append(cell_xml(f'{column}{row_number}', value))
+    return row_xml[:open_end] + ''.join(parts) + '</row>'
+
+
+def _cached_value(value):
+    """The type attribute and <v> element caching a formula result; None caches nothing"""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = to_number(value)
+    if value is None or (isinstance(value, float) and not math.isfinite(value)):
+        return '', ''
+    if isinstance(value, bool):
+        return ' t="b"', f'<v>{int(value)}</v>'
+    if isinstance(value, (int, float)):
+        return '', f'<v>{value!r}</v>'
+    return ' t="str"', f'<v>{escape(_INVALID_XML_CHARS.sub("", str(value)))}</v>'
+
+
+def _update_formula_value(cell, formula_values):
+    """
+    A formula cell with its cached value replaced from formula_values, where
+    None drops it so the application opening the file computes it. Formula
+    cells that are not listed keep their value; without formula_values every
+    cached value is dropped.
+    """
+    if '<f' not in cell:
+        return cell
+    open_end = cell.index('>')
+    head = cell[:open_end]
+    if formula_values is None:
+        value = None
+    else:
+        address = ''.join(_CELL_REF.search(head).groups())
+        if address not in formula_values:
+            return cell
+        value = formula_values[address]
+    type_attribute, cached = _cached_value(value)
+    body = _FORMULA_VALUE.sub('', cell[open_end:])
+    return _CELL_TYPE.sub('', head) + type_attribute + body[:-len('</c>')] + cached + '</c>'
+
+
+def patch_sheet_xml(sheet_xml, values, formula_values=None):
+    """
+    Return sheet_xml with values {address: value} set, plus the addresses of
+    formula cells that were overwritten. Rows and cells missing from the
+    sheet are inserted in order. Formula cells get their cached values from
+    formula_values {address: value}; without it every cached formula value
+    is dropped.
+    """
+    start = sheet_xml.find('<sheetData')
+    if start < 0:
+        raise PatchError("Worksheet has no sheetData element")
+    if sheet_xml.startswith('<sheetData/>', start):
+        sheet_xml = sheet_xml[:start] + '<sheetData></sheetData>' + sheet_xml[start + len('<sheetData/>'):]
+    body_start = sheet_xml.index('>', start) + 1
+    body_end = sheet_xml.index('</sheetData>', body_start)
+
+    rows = {}
+    for address, value in values.items():
+        column, row_number = split_address(address)
+        rows.setdefault(row_number, {})[column] = value
+
+    replaced_formulas = []
+    parts = []
+    for match in _ROW.finditer(sheet_xml, body_start, body_end):
+        row_xml = match.group(0)
+        number = _ROW_NUMBER.search(row_xml[:row_xml.index('>')])
+        if number is None:
+            raise PatchError("Row without a row number")
+        row_number = int(number.group(1))
+        for new_row in sorted(r for r in rows if r < row_number):
+            parts.append(_patch_row(f'<row r="{new_row}"/>', new_row, rows.pop(new_row), replaced_formulas))
+        if row_number in rows:
+            row_xml = _patch_row(row_xml, row_number, rows.pop(row_number), replaced_formulas)
+        parts.append(_CELL.sub(lambda m: _update_formula_value(m.group(0), formula_values), row_xml))
+    for new_row in sorted(rows):
+        parts.append(_patch_row(f'<row r="{new_row}"/>', new_row, rows[new_row], replaced_formulas))
+    return sheet_xml[:body_start] + ''.join(parts) + sheet_xml[body_end:], replaced_formulas
+
+
+def _full_calc_on_load(workbook_xml):
+    """workbook.xml asking the opening application to recalculate every formula"""
+    match = _CALC_PR.search(workbook_xml)
+    if match is None:
+        insert_at = _AFTER_CALC_PR.search(workbook_xml)
+        if insert_at is None:
+            raise PatchError("Workbook has no closing element")
+        return workbook_xml[:insert_at.start()] + '<calcPr fullCalcOnLoad="1"/>' + workbook_xml[insert_at.start():]
+    element = re.sub(r'\sfullCalcOnLoad="[^"]*"', '', match.group(0))
+    element = element.replace('<calcPr', '<calcPr fullCalcOnLoad="1"', 1)
+    return workbook_xml[:match.start()] + element + workbook_xml[match.end():]
+
+
+def _without_calc_chain(rels_xml, content_types_xml):
+    """The workbook relationships and content types without the calcChain part"""
+    rels_xml = re.sub(r'<Relationship\b[^>]*\bType=' + re.escape(quoteattr(_CALC_CHAIN_TYPE)) + r'[^>]*/>', '', rels_xml)
+    content_types_xml = re.sub(r'<Override\b[^>]*\bPartName="/xl/calcChain\.xml"[^>]*/>', '', content_types_xml)
+    return rels_xml, content_types_xml
+
+
+def _raw_member(data, info):
+    """The stored (still compressed) bytes of one member of the zip held in data"""
+    header = data[info.header_offset:info.header_offset + 30]
+    if header[:4] != b'PK\x03\x04':
+        raise PatchError(f"Bad local header for {info.filename}")
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    start = info.header_offset + 30 + name_length + extra_length
+    return data[start:start + info.compress_size]
+
+
+def _dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (max(year, 1980) - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2
+
+
+class _ZipWriter:
+    """
+    Writes a zip member by member. zipfile can only write members it
+    compresses itself, so this writer exists to append the template's
+    members as their stored compressed bytes. Everything it needs from the
+    template comes from ZipInfo's documented attributes.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+        self.central = []
+
+    def add(self, info, raw, crc, file_size):
+        """Append a member with compressed bytes raw, keeping info's name, date, method and attributes"""
+        if info.flag_bits & _ENCRYPTED:
+            raise PatchError(f"{info.filename} is encrypted")
+        if max(self.offset, len(raw), file_size) >= _ZIP32_LIMIT or len(self.central) >= _ZIP32_MEMBERS:
+            raise PatchError("Workbook is too large for a zip32 archive")
+        name = info.filename.encode('utf-8')
+        flags = info.flag_bits & _UTF8_NAME if name.isascii() else _UTF8_NAME
+        date, time = _dos_date_time(info.date_time)
+        # Sizes go in the local header, so no data descriptor follows the data
+        fields = struct.pack('<HHHHHIIIH', 20, flags, info.compress_type, time, date,
+                             crc, len(raw), file_size, len(name))
+        self.fileobj.write(b'PK\x03\x04' + fields + b'\x00\x00' + name)
+        self.fileobj.write(raw)
+        self.central.append(
+            b'PK\x01\x02' + struct.pack('<H', info.create_system << 8 | 20) + fields
+            + struct.pack('<HHHHII', 0, 0, 0, info.internal_attr, info.external_attr, self.offset) + name
+        )
+        self.offset += 30 + len(name) + len(raw)
+
+    def add_content(self, info, content):
+        """Append a member holding content, compressed with info's method"""
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            raw = compressor.compress(content) + compressor.flush()
+        elif info.compress_type == zipfile.ZIP_STORED:
+            raw = content
+        else:
+            raise PatchError(f"{info.filename} uses unsupported compression {info.compress_type}")
+        self.add(info, raw, zlib.crc32(content), len(content))
+
+    def close(self):
+        """Write the central directory"""
+        directory = b''.join(self.central)
+        self.fileobj.write(directory)
+        self.fileobj.write(b'PK\x05\x06' + struct.pack('<HHHHIIH', 0, 0, len(self.central), len(self.central),
+                                                         len(directory), self.offset, 0))
+
+
+def patch_workbook(template_bytes, values, fileobj, formula_values=None):
+    """
+    Write the xlsx template_bytes to fileobj with values {address: value} set
+    on its first sheet, and the cached results of its formulas updated from
+    formula_values (see patch_sheet_xml). Raises PatchError when the workbook
+    cannot be patched in place. Returns the addresses of formula cells that
+    were overwritten.
+    """
+    with zipfile.ZipFile(BytesIO(template_bytes)) as source:
+        sheet_path = first_sheet_path(source)
+        names = set(source.namelist())
+        replacements = {}
+        sheet_xml, replaced_formulas = patch_sheet_xml(source.read(sheet_path).decode('utf-8'), values, formula_values)
+        replacements[sheet_path] = sheet_xml
+        replacements['xl/workbook.xml'] = _full_calc_on_load(source.read('xl/workbook.xml').decode('utf-8'))
+        # A calcChain listing a cell that no longer has a formula makes Excel repair the file
+        dropped = set()
+        if replaced_formulas and 'xl/calcChain.xml' in names:
+            rels, content_types = _without_calc_chain(
+                source.read('xl/_rels/workbook.xml.rels').decode('utf-8'),
+                source.read('[Content_Types].xml').decode('utf-8'),
+            )
+            replacements['xl/_rels/workbook.xml.rels'] = rels
+            replacements['[Content_Types].xml'] = content_types
+            dropped.add('xl/calcChain.xml')
+
+        target = _ZipWriter(fileobj)
+        for info in source.infolist():
+            if info.filename in dropped:
+                continue
+            if info.filename in replacements:
+                target.add_content(info, replacements[info.filename].encode('utf-8'))
+            else:
+                target.add(info, _raw_member(template_bytes, info), info.CRC, info.file_size)
+        target.close()
+    return replaced_formulas
@@ -0,0 +1,184 @@
+"""
+Synthetic shipping PDFs for benchmarking.
+
+Each generator draws a document with reportlab that follows the wording and
+field order of the real issuer layouts closely enough for the extractors in
+app/data_extraction.py to find every field. pages and goods control the
+size of the document.
+"""
+import random
+from io import BytesIO
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+GOODS = [
+    'TOYOTA LAND CRUISER USED MOTOR VEHICLE',
+    'PORTLAND CEMENT 50KG BAGS',
+    'SUGAR IN 50KG BAGS',
+    'COOKING OIL IN 20L JERRYCANS',
+    'STEEL BARS 12MM',
+    'ROOFING SHEETS GAUGE 30',
+    'MAIZE FLOUR 25KG BAGS',
+    'MOTORCYCLE SPARE PARTS',
+]
+
+
+class _Writer:
+    """Writes lines top to bottom, starting new pages as needed"""
+
+    def __init__(self):
+        self.buffer = BytesIO()
+        self.canvas = canvas.Canvas(self.buffer, pagesize=A4)
+        self.canvas.setFont('Helvetica', 8)
+        self.y = A4[1] - 40
+        self.pages = 1
+
+    def line(self, text):
+        if self.y < 40:
+            self.new_page()
+        self.canvas.drawString(30, self.y, text)
+        self.y -= 11
+
+    def new_page(self):
+        self.canvas.showPage()
+        self.canvas.setFont('Helvetica', 8)
+        self.y = A4[1] - 40
+        self.pages += 1
+
+    def finish(self, pages):
+        while self.pages < pages:
+            self.new_page()
+            for i in range(40):
+                self.line(f"ANNEXE {self.pages}-{i} CONDITIONS GENERALES DE TRANSPORT ET DE VALIDATION")
+        self.canvas.showPage()
+        self.canvas.save()
+        return self.buffer.getvalue()
+
+
+def _goods_lines(writer, rng, goods):
+    for i in range(goods):
+        writer.line(
+            f"{i + 1:>4}  {rng.choice(GOODS):<40} HS {rng.randint(10000000, 99999999)}  "
+            f"QTE {rng.randint(1, 900):>4}  {rng.uniform(100, 90000):>10.2f} USD"
+        )
+
+
+def normal_pdf(pages=1, goods=5, seed=1):
+    """Laban / Normal FERI"""
+    rng = random.Random(seed)
+    w = _Writer()
+    w.line(f"A.D N° 2025TSLTZ{rng.randint(1000000, 9999999)}")
+    w.line("IMPORTATEUR : KASEREKA MGAFUMOJA ERICK ; Importer")
+    w.line("EXPORTATEUR AU TRIOMPHAL LIMITED E ; Exporter")
+    w.line("TRANSITAIRE : CORPORATE LEGENDS LIMITED Forwarding agent")
+    w.line("DEST. FINALE EN RDC : BUNIA")
+    w.line(f"TITRE DE TRANSPORT : E {rng.randint(10000, 99999)} TRANSPORTEUR : OWN")
+    w.line(f"VOLUME {rng.uniform(5, 80):.3f} CBM")
+    w.line(f"POIDS BRUT : {rng.uniform(500, 30000):.2f} Kg")
+    _goods_lines(w, rng, goods)
+    return w.finish(pages)
+
+
+def _maritime_header(w, rng):
+    w.line(f"FERI N° : 2025TSLTZ{rng.randint(1000000, 9999999)}")
+    w.line(f"A.D N° 2025AD{rng.randint(100000, 999999)}")
+    w.line("IMPORTATEUR : MIKE AYINGA MALIAMUKONO ; Importer")
+    w.line("EXPORTATEUR WORLD DOMAIN LIMITED E ; Exporter")
+    w.line("TRANSITAIRE : B.T.S. CLEARING AND FORWARDING ADD: KAMPALA")
+    w.line(f"BL : MOLU{rng.randint(10000000000, 99999999999)} ARMATEUR MSC")
+    w.line(f"TN: {rng.randint(1, 40)} CBM : {rng.uniform(5, 80):.3f}")
+    w.line(f"POIDS BRUT : {rng.uniform(1, 30):.2f} T")
+
+
+def maritime_pdf(pages=1, goods=5, seed=2):
+    """Malaba / Maritime"""
+    rng = random.Random(seed)
+    w = _Writer()
+    _maritime_header(w, rng)
+    _goods_lines(w, rng, goods)
+    return w.finish(pages)
+
+
+def possiano_pdf(pages=1, goods=5, seed=3):
+    """Possiano (maritime-style layout)"""
+    rng = random.Random(seed)
+    w = _Writer()
+    w.line("PONSIANO LOGISTICS - ATTESTATION DE VALIDATION")
+    _maritime_header(w, rng)
+    _goods_lines(w, rng, goods)
+    return w.finish(pages)
+
+
+def busia_pdf(pages=1, goods=5, seed=4):
+    """Busia (maritime-style layout, forwarding agent labelled as on the Laban form)"""
+    rng = random.Random(seed)
+    w = _Writer()
+    w.line("BUSIA BORDER POST - ATTESTATION DE VALIDATION")
+    w.line(f"FERI N° : 2025TSLTZ{rng.randint(1000000, 9999999)}")
+    w.line(f"A.D N° 2025AD{rng.randint(100000, 999999)}")
+    w.line("IMPORTATEUR : MIKE AYINGA MALIAMUKONO ; Importer")
+    w.line("EXPORTATEUR WORLD DOMAIN LIMITED E ; Exporter")
+    w.line("TRANSITAIRE : B.T.S. CLEARING AND FORWARDING Forwarding agent")
+    w.line(f"BL : MOLU{rng.randint(10000000000, 99999999999)} ARMATEUR MSC")
+    w.line(f"TN: {rng.randint(1, 40)} CBM : {rng.uniform(5, 80):.3f}")
+    w.line(f"POIDS BRUT : {rng.uniform(1, 30):.2f} T")
+    _goods_lines(w, rng, goods)
+    return w.finish(pages)
+
+
+def normal_certificate_pdf(pages=1, goods=5, seed=5):
+    """Flagging certificate, Normal variant (multi-item goods section)"""
+    rng = random.Random(seed)
+    w = _Writer()
+    w.line(f"A.D N° 2025TSLTZ{rng.randint(1000000, 9999999)}")
+    w.line("IMPORTATEUR : ETS FISTON")
+    w.line("EXPORTATEUR GOLDEN COURTS AFRICA LTD")
+    w.line("TRANSITAIRE : WORLD DOMAIN LIMITED")
+    w.line(f"TITRE DE TRANSPORT : C {rng.randint(10000, 99999)} TRANSPORTEUR OWN")
+    w.line("DEST. FINALE EN RDC : BENI")
+    w.line("LIEU DE KASINDI 12/05/2025")
+    w.line("MOYEN DE TRANSPORT : UBA123X/UBB456Y VG")
+    for i in range(goods):
+        w.line("MARCHANDISE N.C. Pays : UG")
+        w.line(f"CODE HS : {rng.randint(1000, 9999)}.{rng.randint(10, 99)}")
+        w.line(f"{rng.choice(GOODS)} LOT {i + 1} QTE {rng.randint(1, 900)} VALEUR {rng.uniform(100, 9000):.2f}")
+    w.line("VALEURS DECLAREES PAR L'EXPORTATEUR")
+    w.line(
+        f"VALEUR FOB {rng.uniform(1000, 90000):.2f} FRET {rng.uniform(100, 5000):.2f} "
+        f"FRAIS {rng.uniform(10, 500):.2f} ASSURANCE {rng.uniform(10, 500):.2f} TOTAL"
+    )
+    w.line("TYPE NR COLIS 12 CARTONS")
+    return w.finish(pages)
+
+
+def ad_certificate_pdf(pages=1, goods=5, seed=6):
+    """Flagging certificate, AD variant"""
+    rng = random.Random(seed)
+    w = _Writer()
+    w.line(f"AD N°: 2025/AD {rng.randint(100000, 999999)}")
+    w.line("IMPORTATEUR: ETS FISTON BL#: 25NUUEX100185794")
+    w.line("Transporteur : GOLDEN COURTS LOGISTICS Fret")
+    w.line("Carrier: MAERSK LINE On")
+    w.line("Transitaire: WORLD DOMAIN LIMITED")
+    w.line(f"N° Declaration C {rng.randint(10000, 99999)} Agent")
+    w.line("Lieu d'entrée en RDC: KASINDI")
+    w.line("Destination finale en Beni")
+    w.line("ID Transporteur: UBA123X")
+    w.line(f"MARCHANDISE : {rng.choice(GOODS)}")
+    w.line(f"Valeur FOB : {rng.uniform(1000, 90000):.2f}")
+    w.line(f"Valeur Fret : {rng.uniform(100, 5000):.2f}")
+    w.line(f"Assurance {rng.uniform(10, 500):.2f} USD")
+    _goods_lines(w, rng, goods)
+    return w.finish(pages)
+
+
+# Document kind -> (generator, pdf_type for proformas or None for certificates)
+CORPUS = {
+    'normal': (normal_pdf, 'normal'),
+    'maritime': (maritime_pdf, 'maritime'),
+    'possiano': (possiano_pdf, 'possiano'),
+    'busia': (busia_pdf, 'busia'),
+    'certificate_normal': (normal_certificate_pdf, None),
+    'certificate_ad': (ad_certificate_pdf, None),
+}
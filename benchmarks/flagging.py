@@ -0,0 +1,159 @@
+"""
+Benchmark flagging browser profiles against the local stub portal.
+
+    python -m benchmarks.flagging --profiles headless-full,headless --fills 10 --sessions 2 --asset-delay 0.3
+
+Starts benchmarks.stub_portal on a free port and points app/flagging.py at
+it. Then, for each profile, it fills the form --fills times in --sessions
+concurrent pooled browsers (FLAGGING_BROWSER, Chrome or Edge). The report
+gives median/p95 seconds per browser step, the browser start time, fills
+per second and the resident memory of each browser's process tree (Linux
+only). The 'visible' profile needs a display.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from functools import partial
+
+from werkzeug.serving import make_server
+
+from app import flagging
+from app.data_extraction import _extract_certificate_data
+from app.metrics import StageTimer
+
+from .corpus import normal_certificate_pdf
+from .run import summarize
+from .stub_portal import create_stub_app
+
+# Profile name -> create_driver arguments
+PROFILES = {
+    'visible': {'headless': False, 'page_load_strategy': 'normal', 'block': ''},
+    'headless-full': {'headless': True, 'page_load_strategy': 'normal', 'block': ''},
+    'headless': {'headless': True, 'page_load_strategy': 'eager', 'block': 'image,font,media,analytics'},
+}
+
+
+def _process_tree_rss(pid):
+    """Resident memory in MB of pid and all its descendants, or None off Linux"""
+    children = {}
+    rss = {}
+    try:
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/status') as f:
+                    status = dict(line.split(':', 1) for line in f if ':' in line)
+            except OSError:
+                continue
+            children.setdefault(int(status['PPid']), []).append(int(entry))
+            rss[int(entry)] = int(status.get('VmRSS', '0 kB').split()[0])
+    except OSError:
+        return None
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack.extend(children.get(current, []))
+    return round(total / 1024, 1)
+
+
+def run_profile(name, certificate, fills, sessions):
+    """Fill the stub form fills times with the named profile; returns the profile's report"""
+    starts = []
+
+    def session_factory():
+        started = time.perf_counter()
+        session = flagging.BrowserSession(partial(flagging.create_driver, **PROFILES[name]))
+        starts.append(time.perf_counter() - started)
+        return session
+
+    pool = flagging.SessionPool(size=sessions, session_factory=session_factory, lease_timeout=600)
+    steps = {}
+    errors = []
+    lock = threading.Lock()
+
+    def worker(count):
+        try:
+            with pool.lease() as session:
+                for _ in range(count):
+                    # Stages are read from the timer directly, so nothing is recorded to METRICS_DB
+                    timer = StageTimer('fill_form', mode='benchmark')
+                    flagging._fill_once(session, certificate, timer)
+                    with lock:
+                        for stage, seconds in timer.stages.items():
+                            steps.setdefault(stage, []).append(seconds)
+        except Exception as e:
+            errors.append(str(e))
+
+    counts = [fills // sessions + (1 if i < fills % sessions else 0) for i in range(sessions)]
+    threads = [threading.Thread(target=worker, args=(count,)) for count in counts if count]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    memory = [_process_tree_rss(session.driver.service.process.pid) for session in list(pool.idle.queue)]
+    pool.close()
+    completed = len(steps.get('text_fields', []))
+    return {
+        'profile': PROFILES[name],
+        'fills': completed,
+        'errors': errors,
+        'fills_per_second': round(completed / elapsed, 3),
+        'browser_start': summarize(starts) if starts else None,
+        'browser_rss_mb': memory,
+        'steps': {stage: summarize(samples) for stage, samples in steps.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark flagging browser profiles against the stub portal')
+    parser.add_argument('--profiles', default='headless-full,headless', help=f"Comma-separated profiles ({', '.join(PROFILES)})")
+    parser.add_argument('--fills', type=int, default=10, help='Forms filled per profile')
+    parser.add_argument('--sessions', type=int, default=2, help='Concurrent browser sessions')
+    parser.add_argument('--asset-delay', type=float, default=0.3, help='Seconds each stub image, font and script takes')
+    parser.add_argument('--output', help='Where to write the JSON report')
+    args = parser.parse_args(argv)
+
+    profiles = [p.strip() for p in args.profiles.split(',') if p.strip()]
+    unknown = [p for p in profiles if p not in PROFILES]
+    if unknown:
+        parser.error(f"Unknown profiles: {', '.join(unknown)} (choose from {', '.join(PROFILES)})")
+
+    server = make_server('127.0.0.1', 0, create_stub_app(asset_delay=args.asset_delay), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    flagging.FLAGGING_LOGIN_URL = f'{base_url}/auth/login'
+    flagging.FLAGGING_FORM_URL = f'{base_url}/business/application/new'
+    # The stub accepts any login
+    flagging.FLAGGING_EMAIL = flagging.FLAGGING_EMAIL or 'benchmark@example.com'
+    flagging.FLAGGING_PASSWORD = flagging.FLAGGING_PASSWORD or 'benchmark'
+
+    certificate = _extract_certificate_data(normal_certificate_pdf())
+    report = {'fills': args.fills, 'sessions': args.sessions, 'asset_delay': args.asset_delay, 'profiles': {}}
+    try:
+        for name in profiles:
+            result = run_profile(name, certificate, args.fills, args.sessions)
+            report['profiles'][name] = result
+            parts = [f"{stage} {summary['median'] * 1000:.0f}ms" for stage, summary in result['steps'].items()]
+            print(f"{name:<14} {result['fills_per_second']} fills/s  rss {result['browser_rss_mb']} MB  " + '  '.join(parts))
+            for error in result['errors']:
+                print(f"{name:<14} error: {error}")
+    finally:
+        server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    return 1 if any(result['errors'] for result in report['profiles'].values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+Benchmark the goods section parser of Normal flagging certificates.
+
+    python -m benchmarks.goods --items 500,1000,2000 --repeat 5 --gap 0,200
+
+Each size is generated with corpus.normal_certificate_pdf, its text is read
+once, and then tokenize_goods and the previous per-marker regex parser
+(kept here as legacy_descriptions) are timed on the same text. --gap pads the
+columns of every goods line with that many spaces, as layout-preserving text
+of wide certificate tables has; the old parser's lookahead is quadratic in
+such whitespace runs. The run fails if the two parsers disagree on the
+descriptions.
+"""
+import argparse
+import re
+import sys
+import time
+
+from app.data_extraction import _pdfium_pages, tokenize_goods
+
+from .corpus import normal_certificate_pdf
+from .run import _int_list, summarize
+
+
+def legacy_descriptions(extracted_text):
+    """The goods parser extract_normal_certificate_data used before tokenize_goods"""
+    descriptions_list = []
+    start_matches = list(re.finditer(r"MARCHANDISE\s+N\.C\.\s+Pays\s*:", extracted_text, re.IGNORECASE))
+    end_match = re.search(r"TYPE NR COLIS", extracted_text, re.IGNORECASE)
+    if start_matches and end_match:
+        for i, start_match in enumerate(start_matches):
+            start_pos = start_match.end()
+            end_pos = start_matches[i + 1].start() if i < len(start_matches) - 1 else end_match.start()
+            goods_text = extracted_text[start_pos:end_pos].strip()
+            description_match = re.search(
+                r"[A-Z]+\s*HS\s*:\s*([^\n]*)\n([\s\S]*?)(?=(?:\s*MARCHANDISE\s+N\.C\.\s+Pays\s*:|\s*VALEURS DECLAREES PAR L'EXPORTATEUR|$))",
+                goods_text,
+                re.IGNORECASE
+            )
+            if description_match:
+                descriptions_list.append(' '.join(description_match.group(2).split()).strip())
+    return descriptions_list
+
+
+def _time(func, text, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(text)
+        samples.append(time.perf_counter() - started)
+    return result, summarize(samples)
+
+
+def run(items_list, repeat, gaps=(0,)):
+    """Time both parsers per item count and gap; returns {case: {...}} and raises if they disagree"""
+    results = {}
+    for items in items_list:
+        text = "".join(page + "\n" for page in _pdfium_pages(normal_certificate_pdf(goods=items)))
+        for gap in gaps:
+            padded = text.replace(' QTE ', ' ' * (gap + 1) + 'QTE ') if gap else text
+            goods, tokenized = _time(tokenize_goods, padded, repeat)
+            legacy, previous = _time(legacy_descriptions, padded, repeat)
+            if [item['description'] for item in goods] != legacy:
+                raise AssertionError(f"tokenize_goods and the legacy parser disagree at {items} items, gap {gap}")
+            missing = sum(1 for item in goods if item['quantity'] is None or item['value'] is None)
+            results[f"i{items}/gap{gap}"] = {'text_chars': len(padded), 'tokenize_goods': tokenized,
+                                             'legacy': previous, 'incomplete_items': missing}
+            print(f"{items:>6} items gap {gap:>4}  tokenize_goods {tokenized['median'] * 1000:9.2f}ms  "
+                  f"legacy {previous['median'] * 1000:9.2f}ms  incomplete {missing}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the certificate goods parser')
+    parser.add_argument('--items', type=_int_list, default=[500, 1000, 2000], help='Comma-separated goods item counts')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per size')
+    parser.add_argument('--gap', type=_int_list, default=[0, 200], help='Comma-separated column paddings in spaces')
+    args = parser.parse_args(argv)
+    try:
+        run(args.items, args.repeat, args.gap)
+    except AssertionError as e:
+        print(e)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
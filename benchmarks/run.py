@@ -0,0 +1,209 @@
+"""
+Benchmark extraction and generation on the synthetic corpus.
+
+    python -m benchmarks.run --pages 1,5 --goods 5,200 --output report.json
+    python -m benchmarks.run --baseline baseline.json
+
+Each document kind is generated at every pages x goods size and timed per
+stage: extract (uncached), and for proformas load, insert (insert_data),
+save and export (PDF_EXPORT with the openpyxl engine), plus patch: the same
+writes patched into the template's sheet XML with the dependent totals
+recomputed, as the xmlpatch engine does, in place of load and save. The
+report holds min/median/p95/mean seconds per stage. With --baseline, medians are compared
+and the exit status is 1 when any stage is slower than --threshold times the
+baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from app.data_extraction import _extract_certificate_data, _extract_data_from_pdf
+from app.engines import PDF_EXPORT, CellRecorder, OpenpyxlEngine, SheetAdapter, call_insert_function, get_insert_function
+from app.formulas import get_formula_graph
+from app.processing import template_registry
+from app.template_cache import template_cache
+from app.xlsx_patch import patch_workbook
+
+from .corpus import CORPUS
+
+
+def summarize(samples):
+    """min/median/p95/mean of a list of seconds"""
+    ordered = sorted(samples)
+    return {
+        'runs': len(ordered),
+        'min': round(ordered[0], 6),
+        'median': round(statistics.median(ordered), 6),
+        'p95': round(ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))], 6),
+        'mean': round(statistics.fmean(ordered), 6),
+    }
+
+
+def _timed(timings, stage, func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    timings.setdefault(stage, []).append(time.perf_counter() - started)
+    return result
+
+
+def _patch(template_path, values, excel_path):
+    formula_values = get_formula_graph(template_path).recalculate(values, changed=values)
+    with open(excel_path, 'wb') as f:
+        patch_workbook(template_cache.get_bytes(template_path), values, f, formula_values)
+
+
+def run_proforma(pdf_content, pdf_type, template_path, timings, work_dir, export=True):
+    """Time one proforma through extract, load, insert, save, patch and export"""
+    data = _timed(timings, 'extract', _extract_data_from_pdf, pdf_content, pdf_type)
+    if template_path is None:
+        return
+
+    engine = OpenpyxlEngine()
+    template_file = os.path.basename(template_path)
+    insert_func = get_insert_function(pdf_type)
+    wb = _timed(timings, 'load', engine.load, template_path)
+    ws = wb.worksheets[0]
+    _timed(timings, 'insert', call_insert_function, insert_func, SheetAdapter(ws), data, '4500', '', 1, template_file)
+
+    excel_path = os.path.join(work_dir, template_file)
+    _timed(timings, 'save', wb.save, excel_path)
+    cells = CellRecorder()
+    call_insert_function(insert_func, cells, data, '4500', '', 1, template_file)
+    _timed(timings, 'patch', _patch, template_path, cells.values, os.path.join(work_dir, f"patched_{template_file}"))
+    if export and PDF_EXPORT in ('libreoffice', 'overlay'):
+        pdf_path = os.path.join(work_dir, 'output.pdf')
+        if _timed(timings, 'export', engine.export_pdf, template_path, ws, excel_path, pdf_path) is False:
+            # A failed export would only measure the failure path
+            timings.pop('export')
+
+
+def run_certificate(pdf_content, timings):
+    _timed(timings, 'extract', _extract_certificate_data, pdf_content)
+
+
+def default_template(pdf_type):
+    """Path of the first template listed for pdf_type, or None"""
+    entries = template_registry.metadata(pdf_type)
+    return entries[0]['path'] if entries else None
+
+
+def run(kinds, pages_list, goods_list, repeat, templates=None, export=True):
+    """Run the benchmark and return the report dict"""
+    templates = templates or {}
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='proforma_bench_')
+    try:
+        for kind in kinds:
+            generate, pdf_type = CORPUS[kind]
+            template_path = None
+            if pdf_type is not None:
+                template_path = templates.get(pdf_type) or default_template(pdf_type)
+            for pages in pages_list:
+                for goods in goods_list:
+                    pdf_content = generate(pages=pages, goods=goods)
+                    timings = {}
+                    # One untimed pass warms the template cache and imports
+                    for i in range(repeat + 1):
+                        run_timings = {} if i == 0 else timings
+                        if pdf_type is None:
+                            run_certificate(pdf_content, run_timings)
+                        else:
+                            run_proforma(pdf_content, pdf_type, template_path, run_timings, work_dir, export)
+                    results[f"{kind}/p{pages}/g{goods}"] = {
+                        'kind': kind,
+                        'pages': pages,
+                        'goods': goods,
+                        'pdf_bytes': len(pdf_content),
+                        'template': os.path.basename(template_path) if template_path else None,
+                        'stages': {stage: summarize(samples) for stage, samples in timings.items()},
+                    }
+                    print(_format_case(f"{kind}/p{pages}/g{goods}", results[f"{kind}/p{pages}/g{goods}"]['stages']))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'pdf_export': PDF_EXPORT if export else 'none',
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def _format_case(name, stages):
+    parts = [f"{stage} {summary['median'] * 1000:.1f}ms" for stage, summary in stages.items()]
+    return f"{name:<32} " + '  '.join(parts)
+
+
+def compare(report, baseline, threshold):
+    """
+    Compare medians against a baseline report.
+    Returns a list of (case, stage, baseline median, current median, ratio) for
+    every stage present in both, and the subset slower than threshold.
+    """
+    rows = []
+    for case, result in report['results'].items():
+        base_result = baseline.get('results', {}).get(case)
+        if not base_result:
+            continue
+        for stage, summary in result['stages'].items():
+            base = base_result['stages'].get(stage)
+            if not base or not base['median']:
+                continue
+            rows.append((case, stage, base['median'], summary['median'], summary['median'] / base['median']))
+    regressions = [row for row in rows if row[4] > threshold]
+    return rows, regressions
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark PDF extraction and proforma generation')
+    parser.add_argument('--kinds', default=','.join(CORPUS), help='Comma-separated document kinds (default: all)')
+    parser.add_argument('--pages', type=_int_list, default=[1, 5], help='Comma-separated page counts')
+    parser.add_argument('--goods', type=_int_list, default=[5, 100], help='Comma-separated goods line counts')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per case')
+    parser.add_argument('--template', action='append', default=[], metavar='PDF_TYPE=PATH',
+                        help='Template to fill for a pdf_type (default: first template listed)')
+    parser.add_argument('--no-export', action='store_true', help='Skip the PDF export stage')
+    parser.add_argument('--output', default='benchmark_report.json', help='Where to write the JSON report')
+    parser.add_argument('--baseline', help='Baseline report to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='Median ratio above which a stage counts as a regression')
+    args = parser.parse_args(argv)
+
+    kinds = [k.strip() for k in args.kinds.split(',') if k.strip()]
+    unknown = [k for k in kinds if k not in CORPUS]
+    if unknown:
+        parser.error(f"Unknown kinds: {', '.join(unknown)} (choose from {', '.join(CORPUS)})")
+    templates = dict(item.split('=', 1) for item in args.template)
+
+    report = run(kinds, args.pages, args.goods, args.repeat, templates, export=not args.no_export)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows, regressions = compare(report, baseline, args.threshold)
+        for case, stage, base, current, ratio in rows:
+            flag = '  REGRESSION' if ratio > args.threshold else ''
+            print(f"{case:<32} {stage:<8} {base * 1000:9.1f}ms -> {current * 1000:9.1f}ms  x{ratio:.2f}{flag}")
+        if regressions:
+            print(f"{len(regressions)} stage(s) slower than x{args.threshold} the baseline")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Local stand-in for the Invesco flagging portal.
+
+Serves a login page and an application form with the same element ids,
+custom tags and ngb dropdown markup that app/flagging.py drives, so the
+browser session pool can be exercised without the real site:
+
+    python -m benchmarks.stub_portal --port 5055 --session-ttl 600
+    FLAGGING_LOGIN_URL=http://127.0.0.1:5055/auth/login \
+    FLAGGING_FORM_URL=http://127.0.0.1:5055/business/application/new \
+    FLAGGING_BROWSER=chrome python main.py
+
+Sessions expire after --session-ttl seconds, or immediately on
+POST /__expire, to exercise re-login. The last submitted form values are
+available at GET /__last.
+
+Like the real portal, every page pulls in a banner image, a web font and an
+analytics script. --asset-delay makes each of them answer that many seconds
+late, to show what blocking them and eager page loads save.
+"""
+import argparse
+import secrets
+import time
+
+from flask import Flask, Response, jsonify, redirect, request
+
+from app.data_extraction import BORDER_MAPPING
+
+DROPDOWNS = [
+    ('Issuing Body', ['DR CONGO', 'UGANDA', 'KENYA']),
+    ('Cert. Type', ['REGIONAL', 'CONTINUANCE']),
+    ('Cargo Origin', ['UGANDA', 'OUTSIDE UGANDA']),
+    ('Shipment Route', ['IN-BOUND', 'OUT-BOUND']),
+    ('Transport Mode', ['ROAD', 'RAIL', 'WATER']),
+    ('FOB Currency', ['USD', 'UGX']),
+]
+TEXT_INPUTS = [
+    'certificateNumber', 'customsDeclarationNumber', 'importerName', 'exporterName', 'importAgentName',
+    'exportAgentName', 'transporterName', 'vehicleNumber', 'dischargeLocation', 'finalDestination',
+    'fobValue', 'freightValue',
+]
+TEXT_AREAS = ['validationNotes', 'cargoDescription']
+
+SCRIPT = """
+<script>
+document.addEventListener('click', function (event) {
+  var toggle = event.target.closest('[ngbdropdowntoggle]');
+  var item = event.target.closest('[ngbdropdownitem]');
+  document.querySelectorAll('.dropdown-menu').forEach(function (menu) {
+    if (!toggle || menu.parentNode !== toggle.parentNode) menu.style.display = 'none';
+  });
+  if (toggle) {
+    var menu = toggle.parentNode.querySelector('.dropdown-menu');
+    menu.style.display = menu.style.display === 'block' ? 'none' : 'block';
+  }
+  if (item) {
+    var dropdown = item.closest('[ngbdropdown]');
+    dropdown.querySelector('[ngbdropdowntoggle]').textContent = item.textContent;
+    dropdown.querySelector('input[type=hidden]').value = item.textContent;
+  }
+});
+document.addEventListener('input', function (event) { event.target.dataset.dirty = '1'; });
+</script>
+"""
+
+
+def _dropdown(name, options, toggle_text='Select'):
+    items = ''.join(f'<button type="button" ngbdropdownitem>{o}</button>' for o in options)
+    return (
+        f'<div ngbdropdown class="dropdown"><button type="button" ngbdropdowntoggle>{toggle_text}</button>'
+        f'<input type="hidden" name="{name}"><div class="dropdown-menu" style="display:none">{items}</div></div>'
+    )
+
+
+def form_page():
+    parts = [f'<html>{ASSETS_HEAD}<body>{ASSETS_BODY}<form method="post" action="/__submit">']
+    for label, options in DROPDOWNS:
+        parts.append(f'<app-my-input-dropdown label="{label}">{_dropdown(label, options)}</app-my-input-dropdown>')
+    borders = sorted(set(BORDER_MAPPING.values())) + ['UNKNOWN']
+    parts.append(_dropdown('Out_Bound_Border', borders, 'Select Border Point'))
+    for field_id in TEXT_INPUTS:
+        parts.append(f'<app-my-text-input id="{field_id}"><input id="{field_id}" name="{field_id}"></app-my-text-input>')
+    for field_id in TEXT_AREAS:
+        parts.append(f'<app-my-text-area id="{field_id}"><textarea id="{field_id}" name="{field_id}"></textarea></app-my-text-area>')
+    parts.append(f'<app-my-input-dropdown label="Freight Currency">{_dropdown("Freight Currency", ["USD", "UGX"])}</app-my-input-dropdown>')
+    parts.append('<button type="submit" id="submit">Submit</button></form>')
+    parts.append(SCRIPT)
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+# Third-party style resources referenced by every page
+ASSETS_HEAD = """<head>
+<style>@font-face { font-family: Portal; src: url('/assets/portal.woff2') format('woff2'); }
+body { font-family: Portal, sans-serif; }</style>
+<script src="/assets/analytics.js"></script>
+</head>"""
+ASSETS_BODY = '<img src="/assets/banner.png" alt="">'
+ASSETS = {
+    'banner.png': ('image/png', 200 * 1024),
+    'portal.woff2': ('font/woff2', 80 * 1024),
+    'analytics.js': ('application/javascript', 40 * 1024),
+}
+
+LOGIN_PAGE = f"""<html>{ASSETS_HEAD}<body>{ASSETS_BODY}<form method="post" action="/auth/login">
+<input id="emailAddress" name="email"><input id="password" name="password" type="password">
+<button type="submit">Login</button></form></body></html>"""
+
+
+def create_stub_app(session_ttl=600, email=None, password=None, asset_delay=0.0):
+    app = Flask(__name__)
+    sessions = {}
+    state = {'logins': 0, 'last': None, 'assets': 0}
+
+    def logged_in():
+        token = request.cookies.get('stub_session')
+        expires = sessions.get(token)
+        return expires is not None and expires > time.time()
+
+    @app.route('/auth/login', methods=['GET', 'POST'])
+    def login():
+        if request.method == 'GET':
+            return LOGIN_PAGE
+        if (email and request.form.get('email') != email) or (password and request.form.get('password') != password):
+            return LOGIN_PAGE, 401
+        token = secrets.token_hex(8)
+        sessions[token] = time.time() + session_ttl
+        state['logins'] += 1
+        response = redirect('/business/dashboard')
+        response.set_cookie('stub_session', token)
+        return response
+
+    @app.route('/business/dashboard')
+    def dashboard():
+        if not logged_in():
+            return redirect('/auth/login')
+        return f'<html>{ASSETS_HEAD}<body>{ASSETS_BODY}<h1>Dashboard</h1></body></html>'
+
+    @app.route('/assets/<name>')
+    def asset(name):
+        if name not in ASSETS:
+            return 'Not found', 404
+        state['assets'] += 1
+        time.sleep(asset_delay)
+        mimetype, size = ASSETS[name]
+        # A script of comments, or zero bytes standing in for binary content
+        body = b'//' + b' ' * size if mimetype == 'application/javascript' else bytes(size)
+        return Response(body, mimetype=mimetype)
+
+    @app.route('/business/application/new')
+    def application():
+        if not logged_in():
+            return redirect('/auth/login')
+        return form_page()
+
+    @app.route('/__submit', methods=['POST'])
+    def submit():
+        state['last'] = request.form.to_dict()
+        return redirect('/business/dashboard')
+
+    @app.route('/__expire', methods=['POST'])
+    def expire():
+        sessions.clear()
+        return jsonify({'expired': True})
+
+    @app.route('/__last')
+    def last():
+        return jsonify({'logins': state['logins'], 'last': state['last'], 'assets': state['assets']})
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stub flagging portal')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--session-ttl', type=float, default=600, help='Seconds a login stays valid')
+    parser.add_argument('--asset-delay', type=float, default=0.0, help='Seconds each image, font and script takes')
+    args = parser.parse_args(argv)
+    create_stub_app(args.session_ttl, asset_delay=args.asset_delay).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Keep artifacts in process memory, metrics in a throwaway database, and
+# resolve the relative template paths
+os.environ.setdefault('ARTIFACT_DIR', '')
+os.environ.setdefault('METRICS_DB', os.path.join(tempfile.mkdtemp(prefix='proforma_tests_'), 'metrics.db'))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
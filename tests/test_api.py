@@ -0,0 +1,98 @@
+import pytest
+
+from app import create_app, engines
+from benchmarks.corpus import normal_certificate_pdf, normal_pdf
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(engines, 'EXCEL_ENGINE', 'openpyxl')
+    monkeypatch.setattr(engines, 'PDF_EXPORT', 'none')
+    app = create_app()
+    return app.test_client()
+
+
+def test_extract_from_raw_body(client):
+    response = client.post('/api/v1/extract/normal', data=normal_pdf(), content_type='application/pdf')
+    assert response.status_code == 200
+    assert response.json['data']['attestation_number']
+
+
+def test_extract_from_multipart_upload(client):
+    from io import BytesIO
+
+    response = client.post('/api/v1/extract/normal', data={'pdf_file': (BytesIO(normal_pdf()), 'a.pdf')})
+    assert response.status_code == 200
+    assert response.json['data']['transport_id']
+
+
+def test_process_returns_an_artifact_handle(client):
+    response = client.post('/api/v1/process/normal?template_file=PROFORMA_INVOICE.xlsx',
+                           data=normal_pdf(), content_type='application/pdf')
+    assert response.status_code == 201
+    artifact = response.json['artifact']
+    assert list(artifact['files']) == ['excel']
+    assert client.get(f"/api/v1/artifacts/{artifact['token']}").json['token'] == artifact['token']
+    excel = client.get(f"/api/v1/artifacts/{artifact['token']}/excel")
+    assert excel.status_code == 200 and excel.data.startswith(b'PK')
+    assert client.get(f"/api/v1/artifacts/{artifact['token']}/pdf").status_code == 404
+
+
+def test_process_serves_the_file_per_accept_header(client):
+    url = '/api/v1/process/normal?template_file=PROFORMA_INVOICE.xlsx'
+    excel = client.post(url, data=normal_pdf(), content_type='application/pdf',
+                        headers={'Accept': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'})
+    assert excel.status_code == 200 and excel.data.startswith(b'PK')
+    # No PDF is exported with PDF_EXPORT=none
+    response = client.post(url, data=normal_pdf(), content_type='application/pdf', headers={'Accept': 'application/pdf'})
+    assert response.status_code == 406
+    assert 'artifact' in response.json
+
+
+def test_certificates_and_templates(client):
+    response = client.post('/api/v1/certificates', data=normal_certificate_pdf(), content_type='application/pdf')
+    assert response.json['data']['Certificate_Type'] == 'Normal'
+    assert 'PROFORMA_INVOICE.xlsx' in str(client.get('/api/v1/templates').json)
+
+
+@pytest.mark.parametrize('method, url, kwargs, status', [
+    ('get', '/api/v1/nowhere', {}, 404),
+    ('get', '/api/v1/extract/normal', {}, 405),
+    ('post', '/api/v1/extract/ferry', {'data': b'%PDF-'}, 404),
+    ('post', '/api/v1/extract/normal', {'data': b'text', 'content_type': 'text/plain'}, 415),
+    ('post', '/api/v1/extract/normal', {'data': b'not a pdf', 'content_type': 'application/pdf'}, 400),
+    ('post', '/api/v1/extract/normal', {'data': b'%PDF-1.4 corrupt', 'content_type': 'application/pdf'}, 422),
+    ('post', '/api/v1/certificates', {'data': b'%PDF-1.4 corrupt', 'content_type': 'application/pdf'}, 422),
+    ('post', '/api/v1/certificates', {'data': normal_pdf(), 'content_type': 'application/pdf'}, 422),
+    ('get', '/api/v1/artifacts/unknown', {}, 404),
+    ('get', '/api/v1/templates', {'headers': {'Accept': 'text/html'}}, 406),
+])
+def test_errors_are_json(client, method, url, kwargs, status):
+    response = getattr(client, method)(url, **kwargs)
+    assert response.status_code == status
+    assert response.is_json and 'error' in response.json
+
+
+def test_oversized_body_is_json(client):
+    client.application.config['MAX_CONTENT_LENGTH'] = 10
+    response = client.post('/api/v1/extract/normal', data=normal_pdf(), content_type='application/pdf')
+    assert response.status_code == 413
+    assert response.is_json
+
+
+def test_unexpected_error_is_json(client, monkeypatch):
+    from app import api
+
+    def broken(*args):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(api, 'extract_certificate_data', broken)
+    response = client.post('/api/v1/certificates', data=normal_certificate_pdf(), content_type='application/pdf')
+    assert response.status_code == 500
+    assert response.json == {'error': 'Internal server error'}
+
+
+def test_other_pages_keep_html_errors(client):
+    response = client.get('/nowhere')
+    assert response.status_code == 404
+    assert not response.is_json
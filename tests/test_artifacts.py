@@ -0,0 +1,97 @@
+import os
+
+from app import create_app
+from app.artifacts import ArtifactStore, artifact_store
+
+
+def test_memory_tier():
+    store = ArtifactStore(directory='')
+    token = store.put({'bl': 'X'}, 'maritime', excel=b'PK', pdf=None)
+    assert store.get(token)['data'] == {'bl': 'X'}
+    assert store.get_file(token, 'excel') == b'PK'
+    assert store.get_file(token, 'pdf') is None
+    assert store.get_path(token, 'excel') is None
+    assert store.kinds(token) == ['excel']
+
+
+def test_memory_tier_is_bounded_by_size():
+    store = ArtifactStore(directory='', memory_bytes=10)
+    first = store.put({}, 'normal', excel=b'x' * 6)
+    second = store.put({}, 'normal', excel=b'y' * 6)
+    assert store.get(first) is None
+    assert store.get_file(second, 'excel') == b'y' * 6
+
+
+def test_another_process_reads_the_directory_tier(tmp_path):
+    token = ArtifactStore(directory=str(tmp_path)).put({'bl': 'X'}, 'maritime', excel=b'PK', pdf=b'%PDF')
+    other = ArtifactStore(directory=str(tmp_path))
+    meta = other.get(token)
+    assert (meta['data'], meta['pdf_type']) == ({'bl': 'X'}, 'maritime')
+    assert other.kinds(token) == ['excel', 'pdf']
+    assert other.get_file(token, 'pdf') == b'%PDF'
+    with open(other.get_path(token, 'excel'), 'rb') as f:
+        assert f.read() == b'PK'
+
+
+def test_put_files_publishes_staged_outputs(tmp_path):
+    store = ArtifactStore(directory=str(tmp_path))
+    staging = store.staging_dir()
+    excel = os.path.join(staging, 'Filled.xlsx')
+    with open(excel, 'wb') as f:
+        f.write(b'PK')
+    with open(os.path.join(staging, 'scratch.tmp'), 'wb') as f:
+        f.write(b'junk')
+    token = store.put_files(staging, {'bl': 'X'}, 'maritime', excel_path=excel)
+    assert not os.path.exists(staging)
+    assert sorted(os.listdir(tmp_path / token)) == ['meta.json', 'output.xlsx']
+    assert store.get_file(token, 'excel') == b'PK'
+
+
+def test_artifacts_expire(tmp_path):
+    store = ArtifactStore(directory=str(tmp_path), ttl=60)
+    token = store.put({}, 'normal', excel=b'PK')
+    os.utime(tmp_path / token, (0, 0))
+    store.entries[token]['meta']['created'] -= 61
+    assert store.get(token) is None
+    assert store.get_file(token, 'excel') is None
+
+
+def test_tokens_cannot_escape_the_directory(tmp_path):
+    store = ArtifactStore(directory=str(tmp_path / 'artifacts'))
+    os.makedirs(tmp_path / 'artifacts')
+    os.makedirs(tmp_path / 'secret')
+    assert store.get('../secret') is None
+    assert store.get_file('../secret', 'excel') is None
+    assert store.get_path('../secret', 'excel') is None
+    assert store.get_file('x', 'meta') is None
+
+
+def test_sweep_removes_expired_and_abandoned_directories(tmp_path):
+    store = ArtifactStore(directory=str(tmp_path), ttl=60)
+    old = store.put({}, 'normal', excel=b'PK')
+    abandoned = store.staging_dir()
+    fresh = store.staging_dir()
+    for path in (tmp_path / old, abandoned):
+        os.utime(path, (0, 0))
+    store._last_sweep = 0
+    store._sweep_disk()
+    assert os.listdir(tmp_path) == [os.path.basename(fresh)]
+
+
+def test_downloads_are_served_by_token():
+    client = create_app().test_client()
+    token = artifact_store.put({'transport_id': 'E 12345'}, 'normal', excel=b'PK')
+    response = client.get(f'/download_excel?token={token}')
+    assert response.data == b'PK'
+    assert 'Proforma_Invoice_E_12345.xlsx' in response.headers['Content-Disposition']
+    assert client.get('/download_excel?token=unknown').data == b'No modified Excel available'
+    assert client.get(f'/download_pdf?token={token}').data == b'No PDF available'
+
+
+def test_downloads_from_the_directory_tier_support_ranges(tmp_path, monkeypatch):
+    store = ArtifactStore(directory=str(tmp_path))
+    monkeypatch.setattr('app.routes.artifact_store', store)
+    token = store.put({'transport_id': 'E 12345'}, 'normal', excel=b'PK0123456789')
+    response = create_app().test_client().get(f'/download_excel?token={token}', headers={'Range': 'bytes=2-5'})
+    assert response.status_code == 206
+    assert response.data == b'0123'
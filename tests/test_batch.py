@@ -0,0 +1,239 @@
+import json
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import pytest
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from app import batch, create_app, engines
+from app.batch import (BatchTooLarge, choose_template, infer_pdf_type, main, read_batch_inputs, run_batch,
+                       stream_batch_zip, write_batch_zip)
+
+
+def _zip(members, compression=zipfile.ZIP_DEFLATED):
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression) as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+def _normal_pdf(transport_id):
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    c.setFont('Helvetica', 8)
+    lines = [
+        "A.D N° 2025TSLTZ1234567",
+        "IMPORTATEUR : KASEREKA MGAFUMOJA ERICK ; Importer",
+        "TRANSITAIRE : CORPORATE LEGENDS LIMITED Forwarding agent",
+        f"TITRE DE TRANSPORT : {transport_id} TRANSPORTEUR : OWN",
+        "VOLUME 12.500 CBM",
+    ]
+    for i, line in enumerate(lines):
+        c.drawString(30, A4[1] - 40 - 11 * i, line)
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # Workers are forked from this process, so they inherit the engine settings
+    monkeypatch.setattr(engines, 'EXCEL_ENGINE', 'openpyxl')
+    monkeypatch.setattr(engines, 'PDF_EXPORT', 'none')
+    monkeypatch.setattr(batch, 'BATCH_WORKERS', 2)
+    monkeypatch.setattr(batch, '_executor', None)
+    yield
+    if batch._executor is not None:
+        batch._executor.shutdown()
+
+
+def test_zip_members_and_pdfs_are_written_to_the_directory(tmp_path):
+    archive = _zip({'a.pdf': b'%PDF-a', 'docs/b.PDF': b'%PDF-b', 'notes.txt': b'x', '__MACOSX/c.pdf': b'x'})
+    inputs = read_batch_inputs([('batch.zip', BytesIO(archive)), ('d.pdf', b'%PDF-d')], str(tmp_path))
+    assert [name for name, path in inputs] == ['a.pdf', 'b.PDF', 'd.pdf']
+    assert all(os.path.dirname(path) == str(tmp_path) for name, path in inputs)
+    contents = []
+    for name, path in inputs:
+        with open(path, 'rb') as f:
+            contents.append(f.read())
+    assert contents == [b'%PDF-a', b'%PDF-b', b'%PDF-d']
+
+
+def test_too_many_files_are_refused_before_reading(tmp_path):
+    archive = _zip({f'{i}.pdf': b'%PDF-' for i in range(5)})
+    with pytest.raises(BatchTooLarge):
+        read_batch_inputs([('batch.zip', archive)], str(tmp_path), max_files=4)
+    assert os.listdir(tmp_path) == []
+
+
+def test_zip_bomb_is_refused_from_its_directory(monkeypatch, tmp_path):
+    archive = _zip({'bomb.pdf': b'\0' * (4 * 1024 * 1024)})
+    assert len(archive) < 16 * 1024
+
+    def never_read(*args, **kwargs):
+        raise AssertionError("a member was decompressed")
+
+    monkeypatch.setattr(zipfile.ZipFile, 'open', never_read)
+    with pytest.raises(BatchTooLarge):
+        read_batch_inputs([('bomb.zip', archive)], str(tmp_path), max_bytes=1024 * 1024)
+
+
+def _crash(source, *args):
+    if source == 'crash.pdf':
+        os._exit(1)
+    return batch._result(source, 'normal')
+
+
+def test_broken_pool_is_replaced(monkeypatch):
+    monkeypatch.setattr(batch, 'BATCH_WORKERS', 1)
+    monkeypatch.setattr(batch, '_executor', None)
+    monkeypatch.setattr(batch, 'process_one', _crash)
+    try:
+        results = list(run_batch([('crash.pdf', b'')], 'normal', '', None))
+        assert results[0]['status'] == 'error'
+        assert results[0]['error'].startswith('Worker process died')
+
+        # The next batch runs in a fresh pool
+        results = list(run_batch([('ok.pdf', b'')], 'normal', '', None))
+        assert [r['source'] for r in results] == ['ok.pdf']
+    finally:
+        if batch._executor is not None:
+            batch._executor.shutdown()
+
+
+def test_pool_broken_by_an_earlier_batch_is_replaced(monkeypatch):
+    broken = ProcessPoolExecutor(max_workers=1)
+    with pytest.raises(Exception):
+        broken.submit(os._exit, 1).result()
+    monkeypatch.setattr(batch, '_executor', broken)
+    monkeypatch.setattr(batch, 'process_one', _crash)
+    try:
+        results = list(run_batch([('ok.pdf', b'')], 'normal', '', None))
+        assert [r['source'] for r in results] == ['ok.pdf']
+        assert batch._executor is not broken
+    finally:
+        batch._executor.shutdown()
+
+
+def test_batch_zip_holds_outputs_and_manifest(pool):
+    inputs = [('one.pdf', _normal_pdf('E 1')), ('two.pdf', _normal_pdf('E 1'))]
+    output = BytesIO()
+    manifest = write_batch_zip(run_batch(inputs, 'normal', 'PROFORMA_INVOICE.xlsx', 7), output)
+    by_source = {entry['source']: entry for entry in manifest}
+    assert [by_source[name]['status'] for name in ('one.pdf', 'two.pdf')] == ['ok', 'ok']
+    outputs = sorted(by_source['one.pdf']['outputs'] + by_source['two.pdf']['outputs'])
+    # Both name their file after the transport ID; the second gets a suffix
+    assert outputs == ['Proforma_Invoice_E_1.xlsx', 'Proforma_Invoice_E_1_2.xlsx']
+    with zipfile.ZipFile(output) as archive:
+        assert sorted(archive.namelist()) == outputs + ['manifest.json']
+        assert json.loads(archive.read('manifest.json')) == manifest
+
+
+def test_streamed_zip_matches_the_written_one(pool, tmp_path):
+    path = tmp_path / 'one.pdf'
+    path.write_bytes(_normal_pdf('E 1'))
+    inputs = [('one.pdf', str(path))]
+    streamed = list(stream_batch_zip(run_batch(inputs, 'normal', 'PROFORMA_INVOICE.xlsx', 7)))
+    # One piece per result, then the manifest and the central directory
+    assert len(streamed) == 2
+    with zipfile.ZipFile(BytesIO(b''.join(streamed))) as archive:
+        assert archive.testzip() is None
+        assert sorted(archive.namelist()) == ['Proforma_Invoice_E_1.xlsx', 'manifest.json']
+        assert json.loads(archive.read('manifest.json'))[0]['source'] == 'one.pdf'
+
+
+def test_only_a_few_files_per_worker_are_in_flight(monkeypatch):
+    monkeypatch.setattr(batch, 'BATCH_WORKERS', 1)
+    monkeypatch.setattr(batch, '_executor', None)
+    monkeypatch.setattr(batch, 'process_one', _crash)
+    queued = []
+    inputs = ((name, queued.append(name) or b'') for name in ('a.pdf', 'b.pdf', 'c.pdf', 'd.pdf'))
+    try:
+        results = run_batch(inputs, 'normal', '', None)
+        first = next(results)
+        # Two were queued for the one worker, and a third once the first was done
+        assert len(queued) == 3
+        rest = [r['source'] for r in results]
+        assert sorted([first['source']] + rest) == ['a.pdf', 'b.pdf', 'c.pdf', 'd.pdf']
+    finally:
+        if batch._executor is not None:
+            batch._executor.shutdown()
+
+
+def test_missing_template_is_an_error(pool):
+    results = list(run_batch([('one.pdf', _normal_pdf('E 1'))], 'normal', 'missing.xlsx', 7))
+    assert (results[0]['status'], results[0]['error']) == ('error', 'Excel generation failed')
+
+
+def test_batch_route_returns_a_zip(pool):
+    client = create_app().test_client()
+    upload = {'zip_file': (BytesIO(_zip({'one.pdf': _normal_pdf('E 5')})), 'batch.zip'),
+              'template_file': 'PROFORMA_INVOICE.xlsx'}
+    response = client.post('/process_batch/normal', data=upload, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.headers['Content-Disposition'] == 'attachment; filename=Proforma_Invoices_normal.zip'
+    with zipfile.ZipFile(BytesIO(response.data)) as archive:
+        assert 'Proforma_Invoice_E_5.xlsx' in archive.namelist()
+
+
+def test_batch_route_needs_pdfs():
+    client = create_app().test_client()
+    response = client.post('/process_batch/normal', data={}, content_type='multipart/form-data')
+    assert response.status_code == 400
+    upload = {'zip_file': (BytesIO(b'not a zip'), 'batch.zip')}
+    response = client.post('/process_batch/normal', data=upload, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+def test_batch_route_refuses_oversized_batches(monkeypatch):
+    monkeypatch.setattr(batch, 'BATCH_MAX_FILES', 1)
+    client = create_app().test_client()
+    upload = {'zip_file': (BytesIO(_zip({'one.pdf': b'%PDF-', 'two.pdf': b'%PDF-'})), 'batch.zip')}
+    response = client.post('/process_batch/normal', data=upload, content_type='multipart/form-data')
+    assert response.status_code == 413
+
+
+@pytest.mark.parametrize('source, first_page, pdf_type', [
+    ('malaba/a.pdf', '', 'maritime'),
+    ('2025/Possiano/a.pdf', 'TITRE DE TRANSPORT', 'possiano'),
+    ('a.pdf', 'BUSIA BORDER POST\nFERI N° : 1', 'busia'),
+    ('a.pdf', 'FERI N° : 1', 'maritime'),
+    ('a.pdf', 'TITRE DE TRANSPORT : E 1', 'normal'),
+    ('a.pdf', 'nothing', None),
+])
+def test_pdf_type_comes_from_folders_then_markers(source, first_page, pdf_type):
+    assert infer_pdf_type(source, first_page) == pdf_type
+
+
+def test_template_is_chosen_by_option_forwarder_or_uniqueness():
+    data = {'forwarding_agent': 'CORPORATE LEGENDS LIMITED'}
+    assert choose_template('normal', data, {'*': 'PROFORMA_INVOICE.xlsx'}) == 'PROFORMA_INVOICE.xlsx'
+    assert choose_template('normal', data, {}) == 'Corporate Legends Limited.xlsx'
+    assert choose_template('busia', {}, {}) == 'PROFORMA_Invoice.xlsx'
+    with pytest.raises(ValueError, match='pass --template normal=NAME'):
+        choose_template('normal', {'forwarding_agent': 'UNKNOWN'}, {})
+    with pytest.raises(ValueError):
+        choose_template('normal', data, {'normal': 'missing.xlsx'})
+
+
+def test_command_line_run_resumes(pool, tmp_path, capsys):
+    folder = tmp_path / 'normal'
+    folder.mkdir()
+    for name, transport_id in (('one.pdf', 'E 1'), ('two.pdf', 'E 2')):
+        (folder / name).write_bytes(_normal_pdf(transport_id))
+    output = tmp_path / 'out'
+    argv = [str(tmp_path), '--output', str(output), '--workers', '1', '--template', 'PROFORMA_INVOICE.xlsx']
+
+    assert main(argv) == 0
+    assert sorted(os.listdir(output)) == ['Proforma_Invoice_E_1.xlsx', 'Proforma_Invoice_E_2.xlsx', 'manifest.jsonl']
+    assert '2 files processed (2 ok, 0 failed), 0 already done' in capsys.readouterr().out
+
+    (folder / 'two.pdf').write_bytes(_normal_pdf('E 3'))
+    assert main(argv) == 0
+    assert '1 files processed (1 ok, 0 failed), 1 already done' in capsys.readouterr().out
+    assert 'Proforma_Invoice_E_3.xlsx' in os.listdir(output)
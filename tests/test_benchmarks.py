@@ -0,0 +1,38 @@
+import pytest
+
+from app import engines
+from app.data_extraction import REQUIRED_FIELDS, _extract_data_from_pdf
+from benchmarks.corpus import CORPUS
+from benchmarks.run import compare, run, summarize
+
+
+@pytest.mark.parametrize('kind', [kind for kind, (_, pdf_type) in CORPUS.items() if pdf_type])
+def test_corpus_documents_yield_every_required_field(kind):
+    generate, pdf_type = CORPUS[kind]
+    data = _extract_data_from_pdf(generate(pages=2, goods=40), pdf_type)
+    assert set(REQUIRED_FIELDS[pdf_type]) <= set(data)
+
+
+def test_corpus_is_reproducible():
+    generate, _ = CORPUS['normal']
+    assert _extract_data_from_pdf(generate(), 'normal') == _extract_data_from_pdf(generate(), 'normal')
+
+
+def test_summarize():
+    assert summarize([3.0, 1.0, 2.0]) == {'runs': 3, 'min': 1.0, 'median': 2.0, 'p95': 3.0, 'mean': 2.0}
+
+
+def test_compare_flags_slower_stages():
+    baseline = {'results': {'a': {'stages': {'extract': {'median': 1.0}, 'load': {'median': 1.0}}}}}
+    report = {'results': {'a': {'stages': {'extract': {'median': 2.0}, 'load': {'median': 1.1}}},
+                          'b': {'stages': {'extract': {'median': 9.0}}}}}
+    rows, regressions = compare(report, baseline, 1.25)
+    assert [row[1] for row in rows] == ['extract', 'load']
+    assert [row[1] for row in regressions] == ['extract']
+
+
+def test_run_times_each_stage(monkeypatch):
+    monkeypatch.setattr(engines, 'EXCEL_ENGINE', 'openpyxl')
+    report = run(['normal', 'certificate_normal'], [1], [5], repeat=1, export=False)
+    assert set(report['results']['normal/p1/g5']['stages']) == {'extract', 'load', 'insert', 'save', 'patch'}
+    assert set(report['results']['certificate_normal/p1/g5']['stages']) == {'extract'}
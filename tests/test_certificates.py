@@ -0,0 +1,98 @@
+from io import BytesIO
+
+import pytest
+
+from app import create_app, data_extraction
+from app.data_extraction import WrongDocumentError, _extract_certificate_data, classify_certificate, tokenize_goods
+from benchmarks.corpus import CORPUS, ad_certificate_pdf, normal_certificate_pdf
+from benchmarks.goods import run as run_goods
+
+
+@pytest.mark.parametrize('kind, certificate_type', [
+    ('certificate_normal', 'Normal'),
+    ('certificate_ad', 'AD'),
+    ('normal', 'Proforma'),
+    ('maritime', 'Proforma'),
+    ('possiano', 'Proforma'),
+    ('busia', 'Proforma'),
+])
+def test_uploads_are_classified_from_the_first_page(kind, certificate_type):
+    generate, _ = CORPUS[kind]
+    first_page = next(data_extraction._pdfium_pages(generate()))
+    assert classify_certificate(first_page) == certificate_type
+
+
+def _count_pages(monkeypatch):
+    read = []
+
+    def counted(pdf_content):
+        for text in data_extraction._pdfium_pages(pdf_content):
+            read.append(text)
+            yield text
+
+    monkeypatch.setattr(data_extraction, 'TEXT_TIERS', [('pypdfium2', counted)] + data_extraction.TEXT_TIERS[1:])
+    return read
+
+
+@pytest.mark.parametrize('generate, certificate_type', [
+    (normal_certificate_pdf, 'Normal'),
+    (ad_certificate_pdf, 'AD'),
+])
+def test_annex_pages_are_not_read(generate, certificate_type, monkeypatch):
+    read = _count_pages(monkeypatch)
+    data = _extract_certificate_data(generate(pages=20))
+    assert data['Certificate_Type'] == certificate_type
+    assert data['Certificate_No']
+    # The classifying first page, then the certificate page again
+    assert len(read) == 2
+    assert data == _extract_certificate_data(generate(pages=1))
+
+
+def test_proforma_is_refused():
+    with pytest.raises(WrongDocumentError):
+        _extract_certificate_data(CORPUS['maritime'][0]())
+
+
+def test_flagging_page_reports_a_proforma_upload():
+    response = create_app().test_client().post(
+        '/flagging/', data={'pdf': (BytesIO(CORPUS['normal'][0]()), 'proforma.pdf')}
+    )
+    assert response.status_code == 422
+    assert b'Proforma Generator page' in response.data
+
+
+GOODS_TEXT = """MARCHANDISE N.C. Pays : UG
+CODE HS : 8703.23
+TOYOTA LAND CRUISER
+USED QTE 2 VALEUR 1500.00
+MARCHANDISE N.C. Pays : UG
+CODE HS : 2523.29
+PORTLAND CEMENT 50KG BAGS
+VALEURS DECLAREES PAR L'EXPORTATEUR
+VALEUR FOB 9000.00 TOTAL
+TYPE NR COLIS 12 CARTONS
+"""
+
+
+def test_goods_are_split_into_items():
+    assert tokenize_goods(GOODS_TEXT) == [
+        {'hs_code': '8703.23', 'description': 'TOYOTA LAND CRUISER USED QTE 2 VALEUR 1500.00',
+         'quantity': '2', 'value': '1500.00'},
+        {'hs_code': '2523.29', 'description': 'PORTLAND CEMENT 50KG BAGS', 'quantity': None, 'value': None},
+    ]
+
+
+def test_goods_need_the_end_marker():
+    assert tokenize_goods(GOODS_TEXT.replace('TYPE NR COLIS', '')) == []
+
+
+@pytest.mark.parametrize('gap', [0, 50])
+def test_goods_match_the_previous_parser(gap):
+    result = run_goods([40], repeat=1, gaps=[gap])
+    assert result[f'i40/gap{gap}']['incomplete_items'] == 0
+
+
+def test_certificate_descriptions_come_from_the_goods():
+    data = _extract_certificate_data(normal_certificate_pdf(goods=3))
+    assert len(data['Goods']) == 3
+    assert data['Descriptions'] == [item['description'] for item in data['Goods']]
@@ -0,0 +1,129 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from app import converter, engines
+from app.converter import ConverterBusy, ConverterError, ConverterPool
+
+# Stands in for soffice --convert-to: sleeps for sources named hang*, otherwise
+# writes "<name>.pdf" into --outdir
+FAKE_SOFFICE = '''#!{python}
+import os, sys, time
+args = sys.argv[1:]
+out_dir, source = args[args.index('--outdir') + 1], args[-1]
+if os.path.basename(source).startswith('hang'):
+    time.sleep(60)
+name = os.path.splitext(os.path.basename(source))[0] + '.pdf'
+with open(os.path.join(out_dir, name), 'wb') as f:
+    f.write(b'%PDF-' + open(source, 'rb').read())
+'''
+
+
+@pytest.fixture
+def soffice(tmp_path, monkeypatch):
+    path = tmp_path / 'soffice'
+    path.write_text(FAKE_SOFFICE.format(python=sys.executable))
+    path.chmod(0o755)
+    monkeypatch.setattr(converter, 'LIBREOFFICE_PATH', str(path))
+    monkeypatch.setattr(converter, '_uno_available', lambda: False)
+    return str(path)
+
+
+@pytest.fixture
+def pool(soffice):
+    pool = ConverterPool(size=1, queue_size=1, timeout=5)
+    yield pool
+    pool.close()
+
+
+def _source(tmp_path, name, content=b'xlsx'):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_workbook_is_converted(pool, tmp_path):
+    pdf_path = str(tmp_path / 'out.pdf')
+    assert pool.convert(_source(tmp_path, 'book.xlsx'), pdf_path) == pdf_path
+    with open(pdf_path, 'rb') as f:
+        assert f.read() == b'%PDF-xlsx'
+    assert pool.health()['conversions'] == 1
+
+
+def test_hung_conversion_times_out_and_the_converter_recovers(pool, tmp_path):
+    with pytest.raises(ConverterError, match='timed out'):
+        pool.convert(_source(tmp_path, 'hang.xlsx'), str(tmp_path / 'hang.pdf'), timeout=0.5)
+    pdf_path = str(tmp_path / 'out.pdf')
+    assert pool.convert(_source(tmp_path, 'book.xlsx'), pdf_path) == pdf_path
+    assert pool.health()['restarts'] >= 1
+
+
+def test_full_queue_is_refused(pool, tmp_path):
+    hang = _source(tmp_path, 'hang.xlsx')
+    pool.submit(hang, str(tmp_path / 'a.pdf'))
+    while pool.converters[0].process is None:
+        pass
+    queued = pool.submit(hang, str(tmp_path / 'b.pdf'))
+    with pytest.raises(ConverterBusy):
+        pool.submit(hang, str(tmp_path / 'c.pdf'))
+    queued.cancel()
+    pool.converters[0].stop()
+
+
+def test_openpyxl_engine_exports_through_the_pool(soffice, tmp_path, monkeypatch):
+    monkeypatch.setattr(engines, 'PDF_EXPORT', 'libreoffice')
+    monkeypatch.setattr(converter, '_pool', ConverterPool(size=1))
+    excel_path, pdf_path = str(tmp_path / 'out.xlsx'), str(tmp_path / 'out.pdf')
+    template = os.path.join('template', 'laban', 'PROFORMA_INVOICE.xlsx')
+    try:
+        assert engines.OpenpyxlEngine().fill(template, excel_path, pdf_path, lambda ws: None) is True
+    finally:
+        converter._pool.close()
+    with open(pdf_path, 'rb') as f:
+        assert f.read(5) == b'%PDF-'
+
+
+class FakeDesktop:
+    """Stands in for the UNO desktop of a resident soffice"""
+
+    def __init__(self, hang=False):
+        self.hang = hang
+
+    def getFrames(self):
+        if self.hang:
+            time.sleep(60)
+        return self
+
+    def getCount(self):
+        return 0
+
+
+@pytest.fixture
+def uno_converter(monkeypatch):
+    monkeypatch.setattr(converter, '_uno_available', lambda: True)
+    monkeypatch.setattr(converter, 'CONVERTER_PROBE_TIMEOUT', 0.2)
+    resident = converter._Converter(0)
+    resident.process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'], start_new_session=True)
+    resident.desktop = FakeDesktop()
+    yield resident
+    resident.destroy()
+
+
+def test_health_probe_needs_an_answer(uno_converter):
+    assert uno_converter.healthy()
+    uno_converter.desktop.hang = True
+    started = time.monotonic()
+    assert not uno_converter.healthy()
+    assert time.monotonic() - started < 5
+
+
+def test_uno_conversion_is_timed_out_inside_the_converter(uno_converter, monkeypatch):
+    monkeypatch.setattr(uno_converter, '_convert_uno', lambda source_path, pdf_path: time.sleep(60))
+    process = uno_converter.process
+    with pytest.raises(ConverterError, match='timed out'):
+        uno_converter.convert('book.xlsx', 'book.pdf', timeout=0.2)
+    assert process.poll() is not None
+    assert not uno_converter.healthy()
@@ -0,0 +1,180 @@
+from io import BytesIO
+
+import pytest
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from app import data_extraction
+from app.data_extraction import FIELD_SPECS, _extract_data_from_pdf, extract_data_from_pdf, extract_fields, extract_tiered
+from app.layouts import FirstPage, LayoutCache, layout_cache
+
+
+def _pdf(*pages):
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    c.setFont('Helvetica', 8)
+    for lines in pages:
+        y = A4[1] - 40
+        for line in lines:
+            c.drawString(30, y, line)
+            y -= 11
+        c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+NORMAL_TEXT = '''A.D N° 2025TSLTZ3254257
+IMPORTATEUR : KASEREKA MGAFUMOJA ERICK ; Importer
+EXPORTATEUR AU TRIOMPHAL LIMITED E ; Exporter
+TRANSITAIRE : CORPORATE LEGENDS LIMITED Forwarding agent
+DEST. FINALE EN RDC : BUNIA
+TITRE DE TRANSPORT : E 84606 TRANSPORTEUR : OWN
+VOLUME 68.558 CBM
+POIDS BRUT : 23031.35 Kg'''
+
+NORMAL_FIELDS = {
+    'attestation_number': '2025TSLTZ3254257',
+    'importateur': 'KASEREKA MGAFUMOJA ERICK',
+    'exporter': 'AU TRIOMPHAL LIMITED',
+    'forwarding_agent': 'CORPORATE LEGENDS LIMITED',
+    'transport_id': 'E 84606',
+    'cbm': '68.558 CBM',
+    'gross_weight': 23031.35,
+}
+
+MARITIME_TEXT = '''FERI N° : 2025TSLTZ1948774
+A.D N° 2025AD196033
+IMPORTATEUR : MIKE AYINGA MALIAMUKONO ; Importer
+EXPORTATEUR WORLD DOMAIN LIMITED E ; Exporter
+TRANSITAIRE : B.T.S. CLEARING AND FORWARDING ADD: KAMPALA
+BL : MOLU57609162717 ARMATEUR MSC
+TN: 3 CBM : 60.198
+POIDS BRUT : 20.42 T'''
+
+
+# The fields needed to accept the fast text are on page 1, the rest on page 2
+SPLIT_NORMAL = _pdf(
+    [
+        "A.D N° 2025TSLTZ1234567",
+        "IMPORTATEUR : KASEREKA MGAFUMOJA ERICK ; Importer",
+        "TITRE DE TRANSPORT : E 12345 TRANSPORTEUR : OWN",
+        "VOLUME 12.500 CBM",
+    ],
+    [
+        "EXPORTATEUR AU TRIOMPHAL LIMITED E ; Exporter",
+        "TRANSITAIRE : CORPORATE LEGENDS LIMITED Forwarding agent",
+        "POIDS BRUT : 1520.50 Kg",
+    ],
+)
+
+SPLIT_NORMAL_FIELDS = {
+    'attestation_number': '2025TSLTZ1234567',
+    'importateur': 'KASEREKA MGAFUMOJA ERICK',
+    'transport_id': 'E 12345',
+    'cbm': '12.500 CBM',
+    'exporter': 'AU TRIOMPHAL LIMITED',
+    'forwarding_agent': 'CORPORATE LEGENDS LIMITED',
+    'gross_weight': 1520.5,
+}
+
+
+def test_normal_fields():
+    assert extract_fields(NORMAL_TEXT, FIELD_SPECS['normal']) == NORMAL_FIELDS
+
+
+def test_maritime_fields():
+    assert extract_fields(MARITIME_TEXT, FIELD_SPECS['maritime']) == {
+        'feri_number': '2025TSLTZ1948774',
+        'attestation_number': '2025AD196033',
+        'importateur': 'MIKE AYINGA MALIAMUKONO',
+        'transitaire': 'B.T.S. CLEARING AND FORWARDING',
+        'bl': 'MOLU57609162717',
+        'cbm': 60.198,
+        'gross_weight': 20.42,
+        'exporter': 'WORLD DOMAIN LIMITED',
+    }
+
+
+def test_maritime_cbm_falls_back_to_a_trailing_unit():
+    text = MARITIME_TEXT.replace('TN: 3 CBM : 60.198', 'VOLUME 12.5 CBM')
+    assert extract_fields(text, FIELD_SPECS['maritime'])['cbm'] == 12.5
+
+
+def test_missing_anchors_leave_fields_out():
+    text = NORMAL_TEXT.replace('POIDS BRUT : 23031.35 Kg', '')
+    assert 'gross_weight' not in extract_fields(text, FIELD_SPECS['normal'])
+
+
+@pytest.mark.parametrize('pdf_type', sorted(FIELD_SPECS))
+def test_field_names_are_unique(pdf_type):
+    names = [field['name'] for field in FIELD_SPECS[pdf_type]]
+    assert len(names) == len(set(names))
+
+
+@pytest.mark.parametrize('pdf_type, forwarder', [('possiano', 'transitaire'), ('busia', 'forwarding_agent')])
+def test_possiano_and_busia_have_their_own_specs(pdf_type, forwarder):
+    from benchmarks.corpus import CORPUS
+
+    assert FIELD_SPECS[pdf_type] is not FIELD_SPECS['maritime']
+    make, _ = CORPUS[pdf_type]
+    extracted = _extract_data_from_pdf(make(), pdf_type)
+    assert {'importateur', 'bl', 'cbm', 'gross_weight', forwarder} <= set(extracted)
+    assert extracted[forwarder] == 'B.T.S. CLEARING AND FORWARDING'
+
+
+def test_busia_forwarder_ends_at_the_transport_document():
+    text = MARITIME_TEXT.replace('ADD: KAMPALA\nBL : MOLU57609162717 ARMATEUR MSC',
+                                 'TITRE DE TRANSPORT : UBA 123X TRANSPORTEUR : OWN')
+    extracted = extract_fields(text, FIELD_SPECS['busia'])
+    assert extracted['forwarding_agent'] == 'B.T.S. CLEARING AND FORWARDING'
+    assert extracted['bl'] == 'UBA 123X'
+
+
+def test_first_page_shortcut_keeps_later_fields():
+    # The first call learns the layout, the second reads the same layout again
+    for _ in range(2):
+        extracted = _extract_data_from_pdf(SPLIT_NORMAL, 'normal')
+        assert extracted.pop('extraction_tier') == 'pypdfium2'
+        assert extracted == SPLIT_NORMAL_FIELDS
+
+
+def test_tiers_parse_each_page_once_for_the_missing_fields(monkeypatch):
+    pages = ['A: 1', 'filler', 'B: 2', 'never read']
+    read, parsed = [], []
+
+    def pages_of(pdf_content):
+        for page in pages:
+            read.append(page)
+            yield page
+
+    def parse(page_texts, found=None):
+        parsed.append((page_texts, dict(found or {})))
+        result = dict(found or {})
+        for key in 'AB':
+            if key not in result and f'{key}:' in page_texts[0]:
+                result[key] = page_texts[0]
+        return result
+
+    monkeypatch.setattr(data_extraction, 'TEXT_TIERS', [('fake', pages_of)])
+    result, tier = extract_tiered(b'', parse, lambda result: 'A' in result, is_done=lambda result: len(result) == 2)
+    assert (result, tier) == ({'A': 'A: 1', 'B': 'B: 2'}, 'fake')
+    assert read == pages[:3]
+    assert parsed == [(['A: 1'], {}), (['filler'], {'A': 'A: 1'}), (['B: 2'], {'A': 'A: 1'})]
+
+
+def test_pages_with_few_labels_are_not_fingerprinted():
+    with FirstPage(_pdf(['IMPORTATEUR : NOBODY', 'nothing else'])) as page:
+        assert page.fingerprint() is None
+    with FirstPage(_pdf(NORMAL_TEXT.splitlines())) as page:
+        assert page.fingerprint() is not None
+
+
+def test_layout_cache_is_bounded():
+    cache = LayoutCache(max_entries=2)
+    cache.put('a', {'bl': (0, 0, 1, 1)})
+    cache.put('b', None)
+    cache.get('a')
+    cache.put('c', None)
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, {'bl': (0, 0, 1, 1)})
+    assert cache.stats() == {'layouts': 2, 'usable': 1, 'hits': 2, 'misses': 1}
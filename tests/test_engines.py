@@ -0,0 +1,79 @@
+import os
+
+import openpyxl
+import pytest
+
+from app import engines, overlay, processing
+from app.engines import CellRecorder, OpenpyxlEngine, SheetAdapter, XmlPatchEngine
+
+TEMPLATE = os.path.join('template', 'laban', 'PROFORMA_INVOICE.xlsx')
+
+DATA = {
+    'attestation_number': '2025TSLTZ1234567',
+    'forwarding_agent': 'CORPORATE LEGENDS LIMITED',
+    'importateur': 'KASEREKA MGAFUMOJA ERICK',
+    'transport_id': 'E 12345',
+    'cbm': '12.500 CBM',
+}
+
+
+def _fill(ws):
+    ws.range('E6').value = 'ACME LIMITED'
+    ws.range('D14').value = 12.5
+
+
+def test_sheet_adapter_reads_and_writes_cells():
+    ws = openpyxl.Workbook().active
+    sheet = SheetAdapter(ws)
+    sheet.range('B8').value = 'x'
+    assert ws['B8'].value == 'x'
+    assert sheet.range('B8').value == 'x'
+
+
+def test_openpyxl_engine_fills_a_copy_of_the_template(tmp_path):
+    excel_path = str(tmp_path / 'out.xlsx')
+    assert OpenpyxlEngine().fill(TEMPLATE, excel_path, str(tmp_path / 'out.pdf'), _fill) is False
+    template = openpyxl.load_workbook(TEMPLATE).worksheets[0]
+    ws = openpyxl.load_workbook(excel_path).worksheets[0]
+    assert (ws['E6'].value, ws['D14'].value) == ('ACME LIMITED', 12.5)
+    assert ws['E6']._style == template['E6']._style
+    # Formulas are kept for Excel to calculate on open
+    formulas = [c.coordinate for row in template.iter_rows() for c in row
+                if isinstance(c.value, str) and c.value.startswith('=')]
+    assert formulas and all(ws[address].value == template[address].value for address in formulas)
+
+
+@pytest.mark.parametrize('engine', [OpenpyxlEngine, XmlPatchEngine])
+def test_failed_overlay_keeps_the_workbook(engine, tmp_path, monkeypatch):
+    def broken(*args):
+        raise ValueError("bad layout")
+
+    monkeypatch.setattr(engines, 'PDF_EXPORT', 'overlay')
+    monkeypatch.setattr(overlay, 'render_overlay_pdf', broken)
+    excel_path = str(tmp_path / 'out.xlsx')
+    assert engine().fill(TEMPLATE, excel_path, str(tmp_path / 'out.pdf'), _fill) is False
+    assert os.path.getsize(excel_path) > 0
+
+
+def test_cell_recorder_keeps_the_writes():
+    cells = CellRecorder()
+    _fill(cells)
+    cells.range('e6').value = 'OTHER'
+    assert cells.values == {'E6': 'OTHER', 'D14': 12.5}
+    assert cells.range('D14').value == 12.5
+
+
+@pytest.mark.parametrize('engine', ['openpyxl', 'xmlpatch'])
+def test_insert_data_runs_through_the_engine(engine, monkeypatch):
+    monkeypatch.setattr(engines, 'EXCEL_ENGINE', engine)
+    excel, pdf, _ = processing.process_excel_and_pdf(DATA, 'normal', 'PROFORMA_INVOICE.xlsx', 7)
+    assert pdf is None
+    ws = openpyxl.load_workbook(excel).worksheets[0]
+    assert ws['E6'].value == 'FERI/AD: 2025TSLTZ1234567'
+    assert ws['B10'].value == 'IMPORTER: KASEREKA MGAFUMOJA ERICK'
+    assert (ws['B14'].value, ws['D14'].value, ws['D18'].value) == ('E 12345', 12.5, 7)
+
+
+def test_unknown_engine_is_refused():
+    with pytest.raises(ValueError):
+        engines.get_engine('calc')
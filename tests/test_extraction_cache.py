@@ -0,0 +1,85 @@
+import sqlite3
+
+from app import extraction_cache as module
+from app.extraction_cache import ExtractionCache, cache_key
+
+
+def _rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [key for key, in conn.execute('SELECT key FROM extractions ORDER BY created')]
+    finally:
+        conn.close()
+
+
+def test_key_covers_content_type_and_version():
+    assert cache_key(b'%PDF-1', 'normal', 1) == cache_key(b'%PDF-1', 'normal', 1)
+    assert cache_key(b'%PDF-1', 'normal', 1) != cache_key(b'%PDF-2', 'normal', 1)
+    assert cache_key(b'%PDF-1', 'normal', 1) != cache_key(b'%PDF-1', 'maritime', 1)
+    assert cache_key(b'%PDF-1', 'normal', 1) != cache_key(b'%PDF-1', 'normal', 2)
+
+
+def test_results_are_computed_once_and_copied():
+    cache = ExtractionCache(db_path='')
+    calls = []
+
+    def extract():
+        calls.append(1)
+        return {'cbm': 1.5}
+
+    first = cache.cached(b'%PDF-1', 'normal', 1, extract)
+    first['cbm'] = 0
+    assert cache.cached(b'%PDF-1', 'normal', 1, extract) == {'cbm': 1.5}
+    assert len(calls) == 1
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 1)
+
+
+def test_memory_tier_is_bounded_by_size():
+    cache = ExtractionCache(max_bytes=40, db_path='')
+    for i in range(5):
+        cache.put(f'k{i}', {'n': 'x' * 10})
+    assert cache.stats()['bytes'] <= 40
+    assert cache.get('k0') is None
+    assert cache.get('k4') == {'n': 'x' * 10}
+
+
+def test_sqlite_tier_is_shared(tmp_path):
+    db_path = str(tmp_path / 'cache.db')
+    ExtractionCache(db_path=db_path).put('k', {'cbm': 1.5})
+    other = ExtractionCache(db_path=db_path)
+    assert other.get('k') == {'cbm': 1.5}
+    assert other.stats()['disk_hits'] == 1
+
+
+def test_sqlite_rows_expire(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'cache.db')
+    now = [1000.0]
+    monkeypatch.setattr(module.time, 'time', lambda: now[0])
+    ExtractionCache(db_path=db_path, ttl=60).put('k', {'cbm': 1.5})
+    now[0] += 61
+    cache = ExtractionCache(db_path=db_path, ttl=60)
+    assert _rows(db_path) == []  # pruned when opened
+    assert cache.get('k') is None
+
+
+def test_expired_rows_are_not_read_before_pruning(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'cache.db')
+    now = [1000.0]
+    monkeypatch.setattr(module.time, 'time', lambda: now[0])
+    writer = ExtractionCache(db_path=db_path, ttl=60)
+    reader = ExtractionCache(db_path=db_path, ttl=60)
+    writer.put('k', {'cbm': 1.5})
+    now[0] += 61
+    assert reader.get('k') is None
+
+
+def test_sqlite_rows_are_capped(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'cache.db')
+    now = [1000.0]
+    monkeypatch.setattr(module.time, 'time', lambda: now[0])
+    monkeypatch.setattr(module, 'PRUNE_EVERY', 4)
+    cache = ExtractionCache(db_path=db_path, max_rows=3, ttl=0)
+    for i in range(8):
+        now[0] += 1
+        cache.put(f'k{i}', {'i': i})
+    assert _rows(db_path) == ['k5', 'k6', 'k7']
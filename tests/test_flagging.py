@@ -0,0 +1,310 @@
+import pytest
+
+from app import create_app, flagging
+from app.flagging import FlaggingBusy, FlaggingError, SessionPool, submit_certificate, submit_certificates
+
+
+class FakeSession:
+    """A browser session whose browser dies after dies_after fills"""
+
+    def __init__(self, dies_after=None):
+        self.driver = None
+        self.dies_after = dies_after
+        self.filled = []
+        self.submitted = []
+        self.is_expired = False
+
+    def alive(self):
+        return self.dies_after is None or len(self.filled) < self.dies_after
+
+    def expired(self, max_age):
+        return self.is_expired
+
+    def open_form(self, progress):
+        progress('navigate')
+
+    def fill(self, form_data, progress):
+        progress('text_fields')
+        if form_data.get('fail'):
+            raise FlaggingError("field did not take its value")
+        self.filled.append(form_data['Certificate_No'])
+
+    def submit(self):
+        self.submitted.append(self.filled[-1])
+
+    def close(self):
+        pass
+
+
+def _use_pool(monkeypatch, session_factory):
+    pool = SessionPool(size=1, session_factory=session_factory, lease_timeout=0.1)
+    monkeypatch.setattr(flagging, '_pool', pool)
+    monkeypatch.setattr(flagging, 'save_screenshot', lambda driver, name: None)
+    monkeypatch.setattr(flagging, 'FLAGGING_EMAIL', 'test@example.com')
+    monkeypatch.setattr(flagging, 'FLAGGING_PASSWORD', 'test')
+    return pool
+
+
+def _certificates(count, **extra):
+    return [dict({'Certificate_No': f'C{i}'}, **extra) for i in range(count)]
+
+
+def test_sessions_are_reused_between_leases():
+    sessions = []
+    pool = SessionPool(size=1, session_factory=lambda: sessions.append(FakeSession()) or sessions[-1])
+    with pool.lease() as first:
+        pass
+    with pool.lease() as second:
+        assert second is first
+    assert len(sessions) == 1
+    assert pool.stats() == {'size': 1, 'created': 1, 'leased': 0, 'idle': 1, 'replaced': 0}
+
+
+def test_dead_and_expired_sessions_are_replaced():
+    sessions = []
+    pool = SessionPool(size=1, session_factory=lambda: sessions.append(FakeSession(dies_after=1)) or sessions[-1])
+    with pool.lease() as session:
+        session.fill({'Certificate_No': 'C0'}, lambda stage: None)
+    with pool.lease() as session:
+        assert session is sessions[1]
+        session.is_expired = True
+    with pool.lease() as session:
+        assert session is sessions[2]
+    assert pool.stats()['replaced'] == 1
+    assert pool.stats()['created'] == 1
+
+
+def test_busy_pool_refuses_a_lease():
+    pool = SessionPool(size=1, session_factory=FakeSession, lease_timeout=0.1)
+    with pool.lease():
+        with pytest.raises(FlaggingBusy):
+            with pool.lease():
+                pass
+
+
+def test_submit_fills_in_a_pooled_session(monkeypatch):
+    session = FakeSession()
+    _use_pool(monkeypatch, lambda: session)
+    timings = submit_certificate({'Certificate_No': 'C0'})
+    assert set(timings) == {'lease', 'navigate', 'text_fields'}
+    with pytest.raises(FlaggingError):
+        submit_certificate({'Certificate_No': 'C1', 'fail': True})
+    assert session.filled == ['C0']
+
+
+@pytest.mark.parametrize('submit', [
+    lambda: submit_certificate({'Certificate_No': 'C0'}),
+    lambda: submit_certificates(_certificates(1)),
+])
+def test_missing_credentials_fail_before_any_browser_starts(submit, monkeypatch):
+    _use_pool(monkeypatch, lambda: pytest.fail("a browser was started"))
+    monkeypatch.setattr(flagging, 'FLAGGING_PASSWORD', '')
+    with pytest.raises(FlaggingError, match='set FLAGGING_PASSWORD'):
+        submit()
+
+
+def test_fill_form_route_reports_a_busy_pool(monkeypatch):
+    pool = _use_pool(monkeypatch, FakeSession)
+    client = create_app().test_client()
+    with pool.lease():
+        response = client.post('/flagging/fill-form', json={'Certificate_No': 'C0'})
+    assert response.status_code == 503
+    assert client.post('/flagging/fill-form', json={'Certificate_No': 'C0'}).get_json()['status'] == 'success'
+
+
+def test_batch_retries_then_moves_on(monkeypatch):
+    session = FakeSession()
+    _use_pool(monkeypatch, lambda: session)
+    certificates = _certificates(3)
+    certificates[1]['fail'] = True
+    results = submit_certificates(certificates, retries=1)
+    assert [(r['status'], r['attempts']) for r in results] == [('ok', 1), ('error', 2), ('ok', 1)]
+    assert results[1]['error'] == "field did not take its value"
+    assert session.filled == ['C0', 'C2']
+
+
+def test_dead_browser_is_replaced_mid_batch(monkeypatch):
+    sessions = []
+
+    def factory():
+        sessions.append(FakeSession(dies_after=2))
+        return sessions[-1]
+
+    _use_pool(monkeypatch, factory)
+    results = submit_certificates(_certificates(5))
+    assert all(r['status'] == 'ok' for r in results)
+    assert [s.filled for s in sessions] == [['C0', 'C1'], ['C2', 'C3'], ['C4']]
+
+
+def test_lease_failure_keeps_finished_results(monkeypatch):
+    sessions = []
+
+    def factory():
+        if sessions:
+            raise FlaggingError("browser did not start")
+        sessions.append(FakeSession(dies_after=2))
+        return sessions[-1]
+
+    _use_pool(monkeypatch, factory)
+    results = submit_certificates(_certificates(4))
+    assert [r['status'] for r in results] == ['ok', 'ok', 'error', 'error']
+    assert results[2]['error'] == "No browser session available: browser did not start"
+    assert results[3]['attempts'] == 0
+
+
+def test_busy_pool_fails_an_untouched_batch(monkeypatch):
+    pool = _use_pool(monkeypatch, FakeSession)
+    with pool.lease():
+        with pytest.raises(FlaggingBusy):
+            submit_certificates(_certificates(2))
+
+
+def test_batch_route_submits_by_default(monkeypatch):
+    session = FakeSession()
+    _use_pool(monkeypatch, lambda: session)
+    client = create_app().test_client()
+    response = client.post('/flagging/fill-form-batch', json=_certificates(2))
+    assert [r['status'] for r in response.get_json()['results']] == ['ok', 'ok']
+    assert session.submitted == ['C0', 'C1']
+    response = client.post('/flagging/fill-form-batch', json={'certificates': _certificates(1), 'submit': False})
+    assert response.get_json()['ok'] == 1
+    assert session.filled == ['C0', 'C1', 'C0'] and session.submitted == ['C0', 'C1']
+    assert client.post('/flagging/fill-form-batch', json={'certificates': []}).status_code == 400
+
+
+def test_batch_reports_screenshot_names_without_serving_them(monkeypatch, tmp_path):
+    session = FakeSession()
+    _use_pool(monkeypatch, lambda: session)
+    screenshot = str(tmp_path / 'certificate_0_attempt_1.png')
+    monkeypatch.setattr(flagging, 'save_screenshot', lambda driver, name: screenshot)
+    client = create_app().test_client()
+    response = client.post('/flagging/fill-form-batch', json={'certificates': _certificates(1, fail=True), 'retries': 0})
+    assert response.get_json()['results'][0]['screenshots'] == ['certificate_0_attempt_1.png']
+    assert client.get('/flagging/screenshots/certificate_0_attempt_1.png').status_code == 404
+
+
+def test_submitting_needs_a_submit_button(monkeypatch):
+    session = FakeSession()
+    _use_pool(monkeypatch, lambda: session)
+    monkeypatch.setattr(flagging, 'FLAGGING_SUBMIT_XPATH', '')
+    with pytest.raises(FlaggingError, match='FLAGGING_SUBMIT_XPATH'):
+        submit_certificates(_certificates(1))
+    assert submit_certificates(_certificates(1), submit=False)[0]['status'] == 'ok'
+    assert session.submitted == []
+
+
+def test_submit_form_clicks_the_configured_button(monkeypatch):
+    clicked = []
+
+    class Driver:
+        current_url = 'https://portal/form'
+
+    class Wait:
+        def until(self, condition):
+            pass
+
+    monkeypatch.setattr(flagging, 'FLAGGING_SUBMIT_XPATH', "//button[text()='Send']")
+    monkeypatch.setattr(flagging, '_click', lambda driver, xpath: clicked.append(xpath))
+    monkeypatch.setattr(flagging, '_wait', lambda driver, seconds=10: Wait())
+    flagging.submit_form(Driver())
+    assert clicked == ["//button[text()='Send']"]
+
+
+class ScriptDriver:
+    """Runs the fill scripts against a dict of xpath -> value"""
+
+    def __init__(self, fields, ignored=()):
+        self.fields = fields
+        self.ignored = set(ignored)
+        self.calls = 0
+
+    def execute_script(self, script, argument):
+        self.calls += 1
+        if script == flagging.SET_VALUES_SCRIPT:
+            for xpath, value in argument:
+                if xpath in self.fields and xpath not in self.ignored:
+                    self.fields[xpath] = value
+            return [xpath for xpath, _ in argument if xpath not in self.fields]
+        return [self.fields.get(xpath) for xpath in argument]
+
+
+def test_text_values_cover_every_text_field():
+    values = dict(flagging.text_values({'Certificate_No': 'C0', 'Base_Freight': None}))
+    assert len(values) == len(flagging.TEXT_FIELDS) + 2
+    assert values["//app-my-text-input[@id='certificateNumber']//input[@id='certificateNumber']"] == 'C0'
+    assert values["//app-my-text-input[@id='freightValue']//input[@id='freightValue']"] == ''
+
+
+def test_script_fill_returns_fields_that_did_not_verify():
+    values = [('//a', '1'), ('//b', 'two\nlines'), ('//c', '3'), ('//missing', '4')]
+    driver = ScriptDriver({'//a': '', '//b': '', '//c': ''}, ignored={'//c'})
+    assert flagging.fill_by_script(driver, values) == [('//c', '3'), ('//missing', '4')]
+    assert driver.calls == 2
+
+
+def test_script_errors_fall_back_to_typing_everything():
+    class BrokenDriver:
+        def execute_script(self, script, argument):
+            raise RuntimeError('javascript error')
+
+    values = [('//a', '1'), ('//b', '2')]
+    assert flagging.fill_by_script(BrokenDriver(), values) == values
+
+
+def test_blocked_url_patterns():
+    patterns = flagging.blocked_url_patterns(' image , analytics,')
+    assert '*.png' in patterns and '*google-analytics.com*' in patterns
+    assert flagging.blocked_url_patterns('') == []
+    with pytest.raises(FlaggingError):
+        flagging.blocked_url_patterns('image,videos')
+
+
+@pytest.mark.parametrize('headless', [True, False])
+def test_create_driver_applies_the_profile(headless, monkeypatch):
+    from selenium import webdriver
+
+    created = []
+
+    class FakeChrome:
+        def __init__(self, service, options):
+            self.options = options
+            self.commands = []
+            created.append(self)
+
+        def execute_cdp_cmd(self, command, params):
+            self.commands.append((command, params))
+
+    monkeypatch.setattr(flagging, 'FLAGGING_BROWSER', 'chrome')
+    monkeypatch.setattr(webdriver, 'Chrome', FakeChrome)
+    driver = flagging.create_driver(headless=headless, page_load_strategy='eager', block='image,font')
+    assert driver.options.page_load_strategy == 'eager'
+    assert ('--headless=new' in driver.options.arguments) is headless
+    assert driver.options.experimental_options['prefs'] == {'profile.managed_default_content_settings.images': 2}
+    assert driver.commands == [
+        ('Network.enable', {}),
+        ('Network.setBlockedURLs', {'urls': flagging.blocked_url_patterns('image,font')}),
+    ]
+
+
+@pytest.mark.parametrize('block, images_off', [('image', True), ('css, image', True), ('font ,analytics', False)])
+def test_create_driver_switches_images_off_when_blocked(block, images_off, monkeypatch):
+    from selenium import webdriver
+
+    created = []
+
+    class FakeChrome:
+        def __init__(self, service, options):
+            self.options = options
+            self.commands = []
+            created.append(self)
+
+        def execute_cdp_cmd(self, command, params):
+            self.commands.append((command, params))
+
+    monkeypatch.setattr(flagging, 'FLAGGING_BROWSER', 'chrome')
+    monkeypatch.setattr(webdriver, 'Chrome', FakeChrome)
+    monkeypatch.setitem(flagging.BLOCKED_RESOURCES, 'css', ['*.css'])
+    driver = flagging.create_driver(headless=True, page_load_strategy='eager', block=block)
+    prefs = driver.options.experimental_options.get('prefs', {})
+    assert (prefs.get('profile.managed_default_content_settings.images') == 2) is images_off
+    assert driver.commands[-1][0] == 'Network.setBlockedURLs'
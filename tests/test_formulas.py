@@ -0,0 +1,103 @@
+import datetime
+import glob
+import os
+
+import openpyxl
+import pytest
+
+from app import engines
+from app.data_extraction import _extract_data_from_pdf
+from app.formulas import FormulaError, FormulaGraph, compile_formula, get_formula_graph
+from app.processing import TEMPLATE_DIRS
+from benchmarks.corpus import busia_pdf, maritime_pdf, normal_pdf, possiano_pdf
+
+CORPUS = {'normal': normal_pdf, 'maritime': maritime_pdf, 'possiano': possiano_pdf, 'busia': busia_pdf}
+TEMPLATES = [(pdf_type, path) for pdf_type, folder in TEMPLATE_DIRS.items()
+             for path in sorted(glob.glob(os.path.join(folder, '*.xlsx')))]
+
+
+def _evaluate(formula, cells=None):
+    evaluate, _, _ = compile_formula(formula)
+    return evaluate((cells or {}).get)
+
+
+def test_precedence_and_operators():
+    assert _evaluate('=1+2*3^2') == 19
+    assert _evaluate('=-2^2') == 4
+    assert _evaluate('=50%*A1', {'A1': 8}) == 4
+    assert _evaluate('="N"&A1', {'A1': 3.0}) == 'N3'
+    assert _evaluate('=A1<>2', {'A1': 3}) is True
+
+
+def test_functions():
+    cells = {'A1': 1, 'A2': 'text', 'A3': 2.5}
+    assert _evaluate('=SUM(A1:A3)', cells) == 3.5
+    assert _evaluate('=MAX(A1:A3,7)', cells) == 7
+    assert _evaluate('=ROUND(2.5,0)') == 3
+    assert _evaluate('=ROUND(-1.005,2)') == -1.01
+    assert _evaluate('=IF(A1>0,"yes",1/0)', cells) == 'yes'
+    assert _evaluate('=TODAY()') == datetime.date.today()
+
+
+@pytest.mark.parametrize('formula', ['=Sheet2!A1', '=VLOOKUP(A1,B1:C2,2)', '=1+'])
+def test_unsupported_formulas_raise(formula):
+    with pytest.raises(FormulaError):
+        compile_formula(formula)
+
+
+def test_graph_recalculates_downstream_only():
+    graph = FormulaGraph({'B1': '=A1*2', 'B2': '=B1+A2', 'B3': '=A2+1'}, {'A1': 1, 'A2': 10})
+    assert graph.recalculate({}) == {'B1': 2, 'B2': 12, 'B3': 11}
+    # B2 reads B1, which is recomputed, and A2 from the sheet; B3 is left alone
+    assert graph.recalculate({'A1': 5}, changed={'A1': 5}) == {'B1': 10, 'B2': 20}
+
+
+def test_unaffected_formula_cells_are_read_from_the_sheet():
+    graph = FormulaGraph({'B1': '=A2*2', 'B2': '=B1+A1'}, {'A1': 1, 'A2': 10})
+    assert graph.recalculate({'A1': 5}, changed={'A1': 5}) == {'B2': 25}
+
+
+def test_errors_and_cycles_propagate_as_none():
+    graph = FormulaGraph({'B1': '=1/A1', 'B2': '=B1+1', 'C1': '=C2', 'C2': '=C1', 'D1': '=FOO(1)'}, {'A1': 0})
+    assert graph.recalculate({}) == {'B1': None, 'B2': None, 'C1': None, 'C2': None, 'D1': None}
+    assert graph.recalculate({'A1': 4}, changed={'A1': 4})['B2'] == 1.25
+
+
+@pytest.mark.parametrize('pdf_type, template_path', TEMPLATES, ids=[os.path.basename(p) for _, p in TEMPLATES])
+def test_graph_reproduces_template_cached_values(pdf_type, template_path):
+    graph = get_formula_graph(template_path)
+    cached = openpyxl.load_workbook(template_path, data_only=True).worksheets[0]
+    for address, value in graph.recalculate({}).items():
+        expected = cached[address].value
+        if isinstance(value, datetime.date) or value is None:
+            continue
+        if isinstance(value, (int, float)) and expected is not None:
+            assert value == pytest.approx(expected), address
+        else:
+            assert value == expected or (value == '' and expected is None), address
+
+
+@pytest.mark.parametrize('pdf_type, template_path', TEMPLATES, ids=[os.path.basename(p) for _, p in TEMPLATES])
+def test_xmlpatch_caches_full_recalculation(pdf_type, template_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(engines, 'PDF_EXPORT', 'none')
+    data = _extract_data_from_pdf(CORPUS[pdf_type](), pdf_type)
+    insert_func = engines.get_insert_function(pdf_type)
+    written = engines.CellRecorder()
+
+    def fill_sheet(ws):
+        engines.call_insert_function(insert_func, ws, data, 7, '', 1, os.path.basename(template_path))
+        engines.call_insert_function(insert_func, written, data, 7, '', 1, os.path.basename(template_path))
+
+    excel_path = str(tmp_path / 'out.xlsx')
+    engines.XmlPatchEngine().fill(template_path, excel_path, None, fill_sheet)
+
+    expected = get_formula_graph(template_path).recalculate(written.values)
+    ws = openpyxl.load_workbook(excel_path, data_only=True).worksheets[0]
+    for address, value in expected.items():
+        if isinstance(value, datetime.date):
+            continue
+        got = ws[address].value
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            assert got == pytest.approx(value), address
+        else:
+            assert got == value or (value == '' and got is None), address
@@ -0,0 +1,157 @@
+import time
+from io import BytesIO
+
+import pytest
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from app import engines, jobs
+from app.artifacts import artifact_store
+from app.jobs import MemoryJobQueue, SqliteJobQueue, run_job
+
+PARAMS = {
+    'pdf_type': 'normal',
+    'template_file': 'PROFORMA_INVOICE.xlsx',
+    'freight_number': 7,
+    'container_type': '',
+    'num_containers': 1,
+}
+
+
+def normal_pdf():
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    c.setFont('Helvetica', 8)
+    lines = [
+        "A.D N° 2025TSLTZ1234567",
+        "IMPORTATEUR : KASEREKA MGAFUMOJA ERICK ; Importer",
+        "TITRE DE TRANSPORT : E 12345 TRANSPORTEUR : OWN",
+        "VOLUME 12.500 CBM",
+    ]
+    for i, line in enumerate(lines):
+        c.drawString(30, A4[1] - 40 - 11 * i, line)
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def job_queue(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryJobQueue()
+    return SqliteJobQueue(str(tmp_path / 'jobs.db'))
+
+
+def test_claim_runs_jobs_in_order(job_queue):
+    first = job_queue.submit(PARAMS, b'one')
+    second = job_queue.submit(PARAMS, b'two')
+    assert job_queue.claim(timeout=0) == (first, PARAMS, b'one')
+    assert job_queue.get(first)['status'] == 'running'
+    assert job_queue.claim(timeout=0) == (second, PARAMS, b'two')
+    assert job_queue.claim(timeout=0) is None
+
+
+def test_job_files_are_kept_in_the_artifact_store(job_queue, monkeypatch):
+    monkeypatch.setattr(engines, 'EXCEL_ENGINE', 'openpyxl')
+    monkeypatch.setattr(engines, 'PDF_EXPORT', 'none')
+    job_id = job_queue.submit(PARAMS, normal_pdf())
+    run_job(job_queue, *job_queue.claim(timeout=0))
+
+    job = job_queue.get(job_id)
+    assert job['status'] == 'done'
+    assert [entry['stage'] for entry in job['stages']] == ['queued', 'extract', 'fill', 'calculate', 'export', 'done']
+    assert (job['has_excel'], job['has_pdf']) == (True, False)
+    assert job['data']['transport_id'] == 'E 12345'
+    token = job_queue.get_token(job_id)
+    assert artifact_store.get_file(token, 'excel').startswith(b'PK')
+    assert 'token' not in job
+
+
+def test_failed_job_is_reported(job_queue):
+    job_id = job_queue.submit(dict(PARAMS, template_file='missing.xlsx'), normal_pdf())
+    run_job(job_queue, *job_queue.claim(timeout=0))
+    job = job_queue.get(job_id)
+    assert job['status'] == 'error'
+    assert job['error'] == 'Excel generation failed'
+    assert job['data']['attestation_number']
+
+
+def test_finished_jobs_are_purged(job_queue, monkeypatch):
+    job_id = job_queue.submit(PARAMS, b'')
+    job_queue.claim(timeout=0)
+    job_queue.finish(job_id, {}, None)
+    monkeypatch.setattr(jobs, 'JOB_TTL', -1)
+    job_queue.purge()
+    assert job_queue.get(job_id) is None
+
+
+def test_sqlite_queue_upgrades_an_older_file(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.execute(
+        'CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT NOT NULL, stages TEXT NOT NULL, '
+        'params TEXT NOT NULL, input BLOB, data TEXT, error TEXT, excel BLOB, pdf BLOB, '
+        'created REAL NOT NULL, updated REAL NOT NULL)'
+    )
+    conn.close()
+    job_queue = SqliteJobQueue(path)
+    job_id = job_queue.submit(PARAMS, b'')
+    job_queue.claim(timeout=0)
+    job_queue.finish(job_id, {}, 'token')
+    assert job_queue.get_token(job_id) == 'token'
+
+
+def test_event_stream_follows_the_job(monkeypatch):
+    job_queue = MemoryJobQueue()
+    monkeypatch.setattr(jobs, '_job_queue', job_queue)
+    job_id = job_queue.submit(PARAMS, b'')
+    job_queue.claim(timeout=0)
+    job_queue.set_stage(job_id, 'extract')
+    job_queue.finish(job_id, {}, None, 'boom')
+    events = list(jobs.job_events(job_id, poll_interval=0.01))
+    assert [event.split('\n')[0] for event in events] == [
+        'event: stage', 'event: stage', 'event: stage', 'event: error'
+    ]
+    assert list(jobs.job_events('nope'))[0].startswith('event: error')
+
+
+def test_job_of_a_dead_worker_is_failed(job_queue, monkeypatch):
+    job_id = job_queue.submit(PARAMS, b'')
+    job_queue.claim(timeout=0)
+    job_queue.heartbeat(job_id)
+    assert job_queue.get(job_id)['status'] == 'running'
+
+    monkeypatch.setattr(jobs, 'JOB_LEASE_TIMEOUT', -1)
+    job = job_queue.get(job_id)
+    assert job['status'] == 'error'
+    assert job['error'] == jobs.LOST_WORKER_ERROR
+    assert job['stages'][-1]['stage'] == 'done'
+
+
+def test_heartbeats_keep_a_long_job_alive(job_queue, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_HEARTBEAT_INTERVAL', 0.05)
+    monkeypatch.setattr(jobs, 'JOB_LEASE_TIMEOUT', 0.5)
+    seen = []
+
+    def slow_job(job_queue, job_id, params, pdf_content):
+        for _ in range(10):
+            time.sleep(0.1)
+            seen.append(job_queue.get(job_id)['status'])
+        job_queue.finish(job_id, {}, None)
+
+    monkeypatch.setattr(jobs, '_run_job', slow_job)
+    job_id = job_queue.submit(PARAMS, b'')
+    run_job(job_queue, *job_queue.claim(timeout=0))
+    assert set(seen) == {'running'}
+    assert job_queue.get(job_id)['status'] == 'done'
+
+
+def test_event_stream_ends_after_its_timeout(monkeypatch):
+    job_queue = MemoryJobQueue()
+    monkeypatch.setattr(jobs, '_job_queue', job_queue)
+    job_id = job_queue.submit(PARAMS, b'')
+    events = list(jobs.job_events(job_id, poll_interval=0.01, timeout=0.05))
+    assert events[0].startswith('event: stage')
+    assert events[-1].startswith('event: timeout')
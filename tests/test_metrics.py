@@ -0,0 +1,123 @@
+import os
+import sqlite3
+
+import pytest
+
+from app import create_app, metrics as metrics_module
+from app.metrics import BufferedMetricsStore, Metrics, SqliteMetricsStore, StageTimer
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'metrics.db')
+
+
+def _total(db_path, name='proforma_input_bytes_total'):
+    return sum(value for sample, _, value in SqliteMetricsStore(db_path).collect() if sample == name)
+
+
+def test_recording_does_not_touch_the_database(db_path, monkeypatch):
+    metrics = Metrics(db_path, flush_interval=3600)
+    metrics.store  # opening creates the table
+    connections = []
+    original = SqliteMetricsStore._connect
+    monkeypatch.setattr(SqliteMetricsStore, '_connect', lambda self: connections.append(1) or original(self))
+    for _ in range(100):
+        metrics.inc('proforma_input_bytes_total', 10, operation='extract')
+        metrics.observe('proforma_stage_duration_seconds', 0.02, operation='extract', stage='parse')
+    assert connections == []
+    metrics.store.flush()
+    assert len(connections) == 1
+    assert _total(db_path) == 1000
+    metrics.store.close()
+
+
+def test_workers_share_totals(db_path):
+    first, second = Metrics(db_path, flush_interval=3600), Metrics(db_path, flush_interval=3600)
+    first.inc('proforma_input_bytes_total', 5, operation='extract')
+    second.inc('proforma_input_bytes_total', 7, operation='extract')
+    second.store.flush()
+    # Rendering flushes the rendering process's own samples
+    assert 'proforma_input_bytes_total{operation="extract"} 12' in first.render()
+    first.store.close()
+    second.store.close()
+
+
+def test_background_thread_flushes(db_path):
+    metrics = Metrics(db_path, flush_interval=0.05)
+    metrics.inc('proforma_input_bytes_total', 3)
+    metrics.store._thread.join(0.5)
+    assert _total(db_path) == 3
+    metrics.store.close()
+
+
+def test_failed_flush_keeps_the_samples(db_path, monkeypatch):
+    store = BufferedMetricsStore(SqliteMetricsStore(db_path), interval=3600)
+    store.add([('proforma_input_bytes_total', '[]', 4)])
+
+    def fail(rows):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(store.store, 'add', fail)
+    with pytest.raises(sqlite3.OperationalError):
+        store.flush()
+    monkeypatch.undo()
+    store.add([('proforma_input_bytes_total', '[]', 1)])
+    store.close()
+    assert _total(db_path) == 5
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs fork")
+def test_forked_child_does_not_flush_its_parents_samples(db_path):
+    metrics = Metrics(db_path, flush_interval=3600)
+    metrics.inc('proforma_input_bytes_total', 100)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            metrics.inc('proforma_input_bytes_total', 1)
+            metrics.store.flush()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    assert _total(db_path) == 1
+    metrics.store.close()
+    assert _total(db_path) == 101
+
+
+def test_render_format():
+    metrics = Metrics('')
+    metrics.observe('proforma_operation_duration_seconds', 0.3, operation='process', status='ok')
+    lines = metrics.render().splitlines()
+    assert lines[:2] == [
+        '# HELP proforma_operation_duration_seconds End-to-end duration of an operation',
+        '# TYPE proforma_operation_duration_seconds histogram',
+    ]
+    assert 'proforma_operation_duration_seconds_bucket{le="+Inf",operation="process",status="ok"} 1' in lines
+    assert 'proforma_operation_duration_seconds_bucket{le="0.5",operation="process",status="ok"} 1' in lines
+    assert 'proforma_operation_duration_seconds_bucket{le="0.25",operation="process",status="ok"} 1' not in lines
+    assert 'proforma_operation_duration_seconds_count{operation="process",status="ok"} 1' in lines
+
+
+def test_stage_timer_records_stages_and_errors(monkeypatch):
+    metrics = Metrics('')
+    monkeypatch.setattr(metrics_module, 'metrics', metrics)
+    with pytest.raises(ValueError):
+        with StageTimer('process', pdf_type='normal') as timer:
+            timer('fill')
+            timer('export')
+            raise ValueError('export failed')
+
+    text = metrics.render()
+    assert 'proforma_errors_total{operation="process",pdf_type="normal",stage="export"} 1' in text
+    assert 'proforma_operation_duration_seconds_count{operation="process",pdf_type="normal",status="error"} 1' in text
+    for stage in ('fill', 'export'):
+        assert f'proforma_stage_duration_seconds_count{{operation="process",pdf_type="normal",stage="{stage}"}} 1' in text
+
+
+def test_metrics_route_serves_the_text_format(monkeypatch):
+    metrics = Metrics('')
+    metrics.inc('proforma_input_bytes_total', 3, operation='extract')
+    monkeypatch.setattr('app.routes.metrics', metrics)
+    response = create_app().test_client().get('/metrics')
+    assert response.mimetype == 'text/plain'
+    assert b'proforma_input_bytes_total{operation="extract"} 3' in response.data
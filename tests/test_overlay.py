@@ -0,0 +1,59 @@
+import datetime
+import os
+from io import BytesIO
+
+import openpyxl
+import pypdfium2 as pdfium
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from app import overlay
+from app.template_cache import template_cache
+
+TEMPLATE = os.path.join('template', 'laban', 'PROFORMA_INVOICE.xlsx')
+
+
+def _blank_pdf():
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def test_values_are_formatted_like_excel():
+    assert overlay.format_value(1234.5, '#,##0.00') == '1,234.50'
+    assert overlay.format_value(1234.5, '[$USD-409] #,##0.00') == 'USD 1,234.50'
+    assert overlay.format_value(0.25, '0%') == '25%'
+    assert overlay.format_value(3.0, 'General') == '3'
+    assert overlay.format_value(datetime.date(2025, 3, 9), 'dd/mm/yyyy') == '09/03/2025'
+    assert overlay.format_value(None, 'General') == ''
+
+
+def test_formula_cells_are_dynamic_and_evaluated():
+    ws = openpyxl.Workbook().active
+    ws['D14'] = 4
+    ws['F14'] = 2.5
+    ws['H14'] = '=ROUND(D14*F14,0)'
+    ws['H20'] = '=SUM(H14:H19)+IF(D14>3,1,0)'
+    assert {'D14', 'H14', 'H20'} <= set(overlay.dynamic_cells(ws))
+    assert overlay.evaluate_formulas(ws) == {'H14': 10, 'H20': 11}
+
+
+def test_filled_cells_are_drawn_over_the_cached_base_pdf(tmp_path, monkeypatch):
+    monkeypatch.setattr(overlay, 'OVERLAY_CACHE_DIR', str(tmp_path))
+    path, mtime = overlay._cache_key(TEMPLATE)
+    name = os.path.basename(path).replace('.', '_')
+    (tmp_path / f"{name}_{int(mtime)}.pdf").write_bytes(_blank_pdf())
+
+    ws = template_cache.get_workbook(TEMPLATE).worksheets[0]
+    ws['B14'] = 'TRUCK E 12345'
+    pdf_path = str(tmp_path / 'out.pdf')
+    overlay.render_overlay_pdf(TEMPLATE, ws, pdf_path)
+
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        assert len(pdf) == 1
+        assert 'TRUCK E 12345' in pdf[0].get_textpage().get_text_bounded()
+    finally:
+        pdf.close()
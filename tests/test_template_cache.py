@@ -0,0 +1,33 @@
+import os
+import shutil
+
+from app.template_cache import TemplateCache
+
+TEMPLATE = os.path.join('template', 'laban', 'PROFORMA_INVOICE.xlsx')
+
+
+def test_bytes_are_read_once(tmp_path):
+    path = str(tmp_path / 'template.xlsx')
+    shutil.copy(TEMPLATE, path)
+    cache = TemplateCache(check_interval=0)
+    assert cache.get_bytes(path) is cache.get_bytes(path)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_changed_templates_are_reloaded(tmp_path):
+    path = str(tmp_path / 'template.xlsx')
+    shutil.copy(TEMPLATE, path)
+    cache = TemplateCache(check_interval=0)
+    cache.get_bytes(path)
+    with open(path, 'ab') as f:
+        f.write(b'\0')
+    os.utime(path, (1, 1))
+    assert cache.get_bytes(path).endswith(b'\0')
+    assert cache.misses == 2
+
+
+def test_workbooks_are_private_copies():
+    cache = TemplateCache()
+    first = cache.get_workbook(TEMPLATE)
+    first.worksheets[0]['A1'] = 'changed'
+    assert cache.get_workbook(TEMPLATE).worksheets[0]['A1'].value != 'changed'
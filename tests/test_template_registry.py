@@ -0,0 +1,43 @@
+import os
+import shutil
+
+from app import create_app
+from app.template_registry import TemplateRegistry
+
+TEMPLATE = os.path.join('template', 'laban', 'PROFORMA_INVOICE.xlsx')
+
+
+def test_listing_follows_the_folders(tmp_path):
+    folder = tmp_path / 'laban'
+    folder.mkdir()
+    shutil.copy(TEMPLATE, folder / 'b.xlsx')
+    registry = TemplateRegistry({'normal': str(folder), 'busia': str(tmp_path / 'busia')}, check_interval=0)
+    assert registry.listing() == {'normal': ['b.xlsx'], 'busia': []}
+    assert os.path.isdir(tmp_path / 'busia')
+    version = registry.version
+
+    registry.refresh()
+    assert registry.version == version
+    shutil.copy(TEMPLATE, folder / 'a.xlsx')
+    os.utime(folder, (1, 1))
+    assert registry.templates('normal') == ['a.xlsx', 'b.xlsx']
+    assert registry.version == version + 1
+    assert registry.metadata('normal')[0]['size'] == os.path.getsize(TEMPLATE)
+
+
+def test_rescans_wait_for_the_check_interval(tmp_path):
+    registry = TemplateRegistry({'normal': str(tmp_path)}, check_interval=3600)
+    assert registry.templates('normal') == []
+    shutil.copy(TEMPLATE, tmp_path / 'a.xlsx')
+    assert registry.templates('normal') == []
+    registry.refresh(force=True)
+    assert registry.templates('normal') == ['a.xlsx']
+
+
+def test_index_page_is_revalidated_by_etag():
+    client = create_app().test_client()
+    first = client.get('/')
+    assert first.status_code == 200
+    assert b'PROFORMA_INVOICE.xlsx' in first.data
+    again = client.get('/', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
@@ -0,0 +1,41 @@
+from io import BytesIO
+
+from werkzeug.datastructures import FileStorage
+
+from app import create_app, uploads
+from app.data_extraction import _extract_data_from_pdf
+from app.extraction_cache import cache_key
+from app.uploads import source_bytes, upload_source
+from benchmarks.corpus import normal_pdf
+
+
+def _upload(content):
+    return FileStorage(BytesIO(content), filename='proforma.pdf')
+
+
+def test_small_uploads_are_read_into_memory():
+    assert upload_source(_upload(b'%PDF-small')) == b'%PDF-small'
+
+
+def test_large_uploads_stay_in_their_file(monkeypatch):
+    monkeypatch.setattr(uploads, 'UPLOAD_SPOOL_BYTES', 4)
+    source = upload_source(_upload(b'%PDF-large'))
+    assert hasattr(source, 'read')
+    assert source_bytes(source) == b'%PDF-large'
+
+
+def test_files_are_hashed_like_their_bytes():
+    content = normal_pdf()
+    assert cache_key(BytesIO(content), 'normal', 1) == cache_key(content, 'normal', 1)
+
+
+def test_fields_are_read_from_a_file():
+    content = normal_pdf()
+    assert _extract_data_from_pdf(BytesIO(content), 'normal') == _extract_data_from_pdf(content, 'normal')
+
+
+def test_oversized_uploads_are_refused(monkeypatch):
+    app = create_app()
+    app.config['MAX_CONTENT_LENGTH'] = 16
+    response = app.test_client().post('/process/normal', data={'pdf_file': (BytesIO(b'%PDF-' + b'x' * 64), 'big.pdf')})
+    assert response.status_code == 413
@@ -0,0 +1,130 @@
+import glob
+import os
+import zipfile
+from io import BytesIO
+
+import openpyxl
+import pytest
+
+from app.template_cache import template_cache
+from app.xlsx_patch import PatchError, _raw_member, cell_xml, patch_sheet_xml, patch_workbook
+
+TEMPLATES = sorted(glob.glob(os.path.join('template', '*', '*.xlsx')))
+TEMPLATE = os.path.join('template', 'laban', 'PROFORMA_INVOICE.xlsx')
+
+SHEET = (
+    '<worksheet><sheetData>'
+    '<row r="2"><c r="B2" s="3"><v>1</v></c><c r="D2"><f>B2*2</f><v>2</v></c></row>'
+    '<row r="5"><c r="A5" t="s"><v>0</v></c></row>'
+    '</sheetData></worksheet>'
+)
+
+
+def _patch(values, formula_values=None, template=TEMPLATE):
+    output = BytesIO()
+    replaced = patch_workbook(template_cache.get_bytes(template), values, output, formula_values)
+    return output, replaced
+
+
+def test_cells_are_set_in_order_and_keep_their_style():
+    xml, replaced = patch_sheet_xml(SHEET, {'C2': 'x & y', 'B2': 4, 'A1': True, 'A9': 1.5})
+    assert replaced == []
+    assert xml == (
+        '<worksheet><sheetData>'
+        '<row r="1"><c r="A1" t="b"><v>1</v></c></row>'
+        '<row r="2"><c r="B2" s="3"><v>4</v></c>'
+        '<c r="C2" t="inlineStr"><is><t xml:space="preserve">x &amp; y</t></is></c><c r="D2"><f>B2*2</f></c></row>'
+        '<row r="5"><c r="A5" t="s"><v>0</v></c></row>'
+        '<row r="9"><c r="A9"><v>1.5</v></c></row>'
+        '</sheetData></worksheet>'
+    )
+
+
+def test_formula_values_replace_cached_values():
+    xml, _ = patch_sheet_xml(SHEET, {'B2': 4}, {'D2': 8})
+    assert '<c r="D2"><f>B2*2</f><v>8</v></c>' in xml
+    xml, _ = patch_sheet_xml(SHEET, {'B2': 4}, {'D2': 'eight'})
+    assert '<c r="D2" t="str"><f>B2*2</f><v>eight</v></c>' in xml
+    # Formula cells that are not listed keep their cached value
+    xml, _ = patch_sheet_xml(SHEET, {'A5': 1}, {})
+    assert '<c r="D2"><f>B2*2</f><v>2</v></c>' in xml
+
+
+def test_overwritten_formulas_are_reported():
+    _, replaced = patch_sheet_xml(SHEET, {'D2': 5})
+    assert replaced == ['D2']
+
+
+def test_shared_formula_master_cannot_be_overwritten():
+    sheet = '<worksheet><sheetData><row r="1"><c r="A1"><f t="shared" ref="A1:A3" si="0">B1</f></c></row></sheetData></worksheet>'
+    with pytest.raises(PatchError):
+        patch_sheet_xml(sheet, {'A1': 1})
+
+
+def test_non_finite_numbers_are_refused():
+    with pytest.raises(PatchError):
+        cell_xml('A1', float('nan'))
+
+
+@pytest.mark.parametrize('template', TEMPLATES, ids=os.path.basename)
+def test_only_the_sheet_and_workbook_change(template):
+    output, _ = _patch({'E6': 'ACME LIMITED', 'B30': 12.5}, template=template)
+    with zipfile.ZipFile(BytesIO(template_cache.get_bytes(template))) as source, zipfile.ZipFile(output) as patched:
+        assert patched.testzip() is None
+        changed = [info.filename for info in source.infolist() if source.read(info) != patched.read(info.filename)]
+        assert [info.filename for info in source.infolist()] == patched.namelist()
+    assert sorted(changed) == ['xl/workbook.xml', 'xl/worksheets/sheet1.xml']
+    ws = openpyxl.load_workbook(output).worksheets[0]
+    assert (ws['E6'].value, ws['B30'].value) == ('ACME LIMITED', 12.5)
+    assert b'fullCalcOnLoad="1"' in zipfile.ZipFile(output).read('xl/workbook.xml')
+
+
+def test_unchanged_members_keep_their_compressed_bytes():
+    template_bytes = template_cache.get_bytes(TEMPLATE)
+    output, _ = _patch({'E6': 'ACME LIMITED'})
+    with zipfile.ZipFile(BytesIO(template_bytes)) as source, zipfile.ZipFile(output) as patched:
+        for info in source.infolist():
+            if info.filename in ('xl/workbook.xml', 'xl/worksheets/sheet1.xml'):
+                continue
+            copied = patched.getinfo(info.filename)
+            assert (copied.CRC, copied.compress_type, copied.date_time) == (info.CRC, info.compress_type, info.date_time)
+            assert _raw_member(output.getvalue(), copied) == _raw_member(template_bytes, info)
+
+
+def test_stored_members_and_unicode_names_are_copied():
+    template = BytesIO()
+    with zipfile.ZipFile(BytesIO(template_cache.get_bytes(TEMPLATE))) as source, \
+            zipfile.ZipFile(template, 'w', zipfile.ZIP_DEFLATED) as target:
+        for info in source.infolist():
+            target.writestr(info, source.read(info))
+        target.writestr('docProps/données.bin', b'\x00' * 100, zipfile.ZIP_STORED)
+    output = BytesIO()
+    patch_workbook(template.getvalue(), {'E6': 'x'}, output)
+    with zipfile.ZipFile(output) as patched:
+        assert patched.testzip() is None
+        assert patched.read('docProps/données.bin') == b'\x00' * 100
+        assert patched.getinfo('docProps/données.bin').compress_type == zipfile.ZIP_STORED
+
+
+def test_styles_survive_patching():
+    template = openpyxl.load_workbook(TEMPLATE).worksheets[0]
+    output, _ = _patch({'E6': 'ACME LIMITED'})
+    ws = openpyxl.load_workbook(output).worksheets[0]
+    assert ws['E6']._style == template['E6']._style
+    assert ws['E6'].number_format == template['E6'].number_format
+
+
+def test_calc_chain_is_dropped_only_when_a_formula_is_overwritten():
+    template = next((t for t in TEMPLATES if 'xl/calcChain.xml' in zipfile.ZipFile(t).namelist()), None)
+    if template is None:
+        pytest.skip("No template has a calcChain")
+    graph_cell = next(c.coordinate for row in openpyxl.load_workbook(template).worksheets[0].iter_rows()
+                      for c in row if isinstance(c.value, str) and c.value.startswith('='))
+    output, replaced = _patch({'A1': 'x'}, template=template)
+    assert replaced == [] and 'xl/calcChain.xml' in zipfile.ZipFile(output).namelist()
+    output, replaced = _patch({graph_cell: 1}, template=template)
+    assert replaced == [graph_cell]
+    with zipfile.ZipFile(output) as patched:
+        assert 'xl/calcChain.xml' not in patched.namelist()
+        assert b'calcChain' not in patched.read('[Content_Types].xml')
+    openpyxl.load_workbook(output)